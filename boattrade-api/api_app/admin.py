@@ -1,15 +1,95 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.utils.html import format_html
+from django.utils.functional import cached_property
 from django.contrib import messages
+from django.core.paginator import Paginator
+from django.conf import settings
+import json
+from django.db import connections, router, transaction
+from django import forms
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
+from django.template.response import TemplateResponse
+from django.urls import path
 from .models import (
     Boat, BoatCategory, BoatImage, BoatVideo, Inquiry, 
     SellRequest, SellRequestImage, AmenityItem, TechnicalDetailItem,
-    Testimonial, BlogPost, get_storage_info
+    Testimonial, BlogPost, OutboundEmail, BoatDailyStat, LeadDailyStat, get_storage_info
 )
+from .analytics import dashboard
+from .importers import BoatImporter, read_rows
+from .images import LimitedUploadHandler, stage_uploads, schedule_image_processing
+from .signals import publish_images_change
+from django.utils import timezone
+
+def estimate_row_count(model):
+    """Cheap row count estimate of a table, None if the database cannot provide one"""
+    using = router.db_for_read(model)
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == 'sqlite':
+            # Walks down to the last rowid of the b-tree, deleted rows make it an upper bound
+            cursor.execute(f"SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}")
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+class EstimatedCountPaginator(Paginator):
+    """Replaces COUNT(*) of unfiltered changelists on large tables by a row estimate"""
+    estimated = False
+    
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where and not query.distinct:
+            estimate = estimate_row_count(self.object_list.model)
+            if estimate and estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                self.estimated = True
+                return estimate
+        return super().count
+    
+    def page(self, number):
+        page = super().page(number)
+        if self.estimated and len(page.object_list) < self.per_page:
+            # The estimate ran past the last row: the count becomes exact, from the rows of
+            # this page or COUNT(*) when it is empty, and the last non-empty page is served
+            self.estimated = False
+            if page.object_list:
+                self.count = (page.number - 1) * self.per_page + len(page.object_list)
+            else:
+                self.count = self.object_list.count()
+            self.__dict__.pop('num_pages', None)
+            if not page.object_list and page.number > 1:
+                page = super().page(self.num_pages)
+        return page
+
+class EstimatedCountChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # The paginator corrects an estimate running past the last row and serves the last page
+        self.result_count = self.paginator.count
+        self.page_num = min(self.page_num, self.paginator.num_pages)
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Admin for tables growing without bounds: estimated counts, no second full count"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
 
 class BoatImageInline(admin.TabularInline):
     model = BoatImage
-    extra = 3
+    # New photos go through the bulk image manager, the inline edits captions and deletes
+    extra = 0
+    fields = ('image', 'caption', 'is_main')
 
 class BoatVideoInline(admin.TabularInline):
     model = BoatVideo
@@ -68,11 +148,20 @@ class TechnicalDetailItemInline(admin.TabularInline):
     verbose_name_plural = "Détails techniques (facultatif)"
     fields = ('category', 'name', 'value')
 
+class BoatImportForm(forms.Form):
+    data_file = forms.FileField(label="Fichier CSV ou JSON",
+                                help_text="Une ligne par bateau, identifiée par la colonne external_ref")
+    images = forms.FileField(label="Archive ZIP des photos", required=False)
+    replace_images = forms.BooleanField(label="Remplacer les photos des bateaux existants", required=False)
+
 @admin.register(Boat)
-class BoatAdmin(admin.ModelAdmin):
+class BoatAdmin(LargeTableAdmin):
     list_display = ('title', 'category', 'price', 'year_built', 'location', 'is_active', 'is_featured')
+    list_select_related = ('category',)
     list_filter = ('category', 'is_active', 'is_featured', 'year_built')
-    search_fields = ('title', 'description', 'location')
+    search_fields = ('title', 'description', 'location', 'external_ref')
+    change_list_template = 'admin/api_app/boat/change_list.html'
+    change_form_template = 'admin/api_app/boat/change_form.html'
     inlines = [BoatImageInline, BoatVideoInline, AmenityItemInline, TechnicalDetailItemInline]
     fieldsets = (
         (None, {
@@ -82,11 +171,130 @@ class BoatAdmin(admin.ModelAdmin):
             'fields': ('length', 'width', 'year_built', 'engine_power', 'fuel_type')
         }),
         ('Informations supplémentaires (facultatif)', {
-            'fields': ('location',),
+            'fields': ('location', 'external_ref'),
             'classes': ('collapse',),
             'description': "Ces champs sont optionnels et peuvent être laissés vides."
         }),
     )
+    
+    def get_urls(self):
+        admin_view = self.admin_site.admin_view
+        return [
+            path('import/', admin_view(self.import_view), name='api_app_boat_import'),
+            path('<path:object_id>/images/', admin_view(self.images_view), name='api_app_boat_images'),
+            # CSRF is checked once the upload handler is installed, see images_upload_view
+            path('<path:object_id>/images/upload/', admin_view(csrf_exempt(require_POST(self.images_upload_view))),
+                 name='api_app_boat_images_upload'),
+            path('<path:object_id>/images/order/', admin_view(require_POST(self.images_order_view)),
+                 name='api_app_boat_images_order'),
+            path('<path:object_id>/images/<int:image_id>/main/', admin_view(require_POST(self.images_main_view)),
+                 name='api_app_boat_images_main'),
+        ] + super().get_urls()
+    
+    def get_editable_boat(self, request, object_id):
+        boat = get_object_or_404(Boat, pk=object_id)
+        if not self.has_change_permission(request, boat):
+            return None
+        return boat
+    
+    def images_view(self, request, object_id):
+        """Images of a boat in display order, polled by the bulk image manager"""
+        boat = self.get_editable_boat(request, object_id)
+        if boat is None:
+            return JsonResponse({'error': "Permission refusée"}, status=403)
+        images = [
+            {'id': image.id, 'url': image.image.url, 'is_main': image.is_main,
+             'caption': image.caption, 'position': image.position}
+            for image in boat.images.all()
+        ]
+        return JsonResponse({'images': images})
+    
+    def images_upload_view(self, request, object_id):
+        """Receive photos for a boat, they are resized and stored in the background"""
+        # The body is streamed to disk and capped before the CSRF check reads the form
+        upload_handler = LimitedUploadHandler(request, max_file_size=settings.BOAT_IMAGE_MAX_MB * 1024 * 1024)
+        if not hasattr(request, '_files'):
+            request.upload_handlers = [upload_handler]
+        return csrf_protect(self._images_upload)(request, object_id, upload_handler)
+    
+    def _images_upload(self, request, object_id, upload_handler):
+        boat = self.get_editable_boat(request, object_id)
+        if boat is None:
+            return JsonResponse({'error': "Permission refusée"}, status=403)
+        images = request.FILES.getlist('images')
+        if upload_handler.error:
+            return JsonResponse({'error': upload_handler.error}, status=400)
+        if not images:
+            return JsonResponse({'error': "Aucune image reçue."}, status=400)
+        
+        staging_dir = stage_uploads(images, f"boat_{boat.pk}")
+        transaction.on_commit(lambda: schedule_image_processing(
+            BoatImage, 'image', staging_dir, position_field='position', boat_id=boat.pk
+        ))
+        return JsonResponse({'received': len(images)}, status=202)
+    
+    def images_order_view(self, request, object_id):
+        """Persist the order of the images dragged in the bulk image manager"""
+        boat = self.get_editable_boat(request, object_id)
+        if boat is None:
+            return JsonResponse({'error': "Permission refusée"}, status=403)
+        try:
+            order = [int(image_id) for image_id in json.loads(request.body)['order']]
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({'error': "Ordre invalide"}, status=400)
+        
+        images = boat.images.in_bulk(order)
+        for position, image_id in enumerate(order):
+            if image_id in images:
+                images[image_id].position = position
+        BoatImage.objects.bulk_update(images.values(), ['position'])
+        publish_images_change(boat.pk)
+        return JsonResponse({'updated': len(images)})
+    
+    def images_main_view(self, request, object_id, image_id):
+        """Make one image the main image of the boat"""
+        boat = self.get_editable_boat(request, object_id)
+        if boat is None:
+            return JsonResponse({'error': "Permission refusée"}, status=403)
+        image = get_object_or_404(BoatImage, pk=image_id, boat=boat)
+        with transaction.atomic():
+            boat.images.filter(is_main=True).exclude(pk=image.pk).update(is_main=False)
+            BoatImage.objects.filter(pk=image.pk).update(is_main=True)
+            publish_images_change(boat.pk)
+        return JsonResponse({'main': image.pk})
+    
+    def import_view(self, request):
+        """Bulk import of boats from a broker inventory file"""
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            return redirect('admin:api_app_boat_changelist')
+        
+        result = None
+        form = BoatImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            try:
+                rows = read_rows(form.cleaned_data['data_file'])
+            except ValueError as e:
+                form.add_error('data_file', f"Fichier illisible : {e}")
+            else:
+                importer = BoatImporter(
+                    archive=form.cleaned_data['images'],
+                    replace_images=form.cleaned_data['replace_images'],
+                )
+                result = importer.run(rows)
+                messages.success(
+                    request,
+                    f"{result.created} bateau(x) créé(s), {result.updated} mis à jour, "
+                    f"{result.images} photo(s) importée(s), {len(result.errors)} ligne(s) rejetée(s)."
+                )
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Importer des bateaux",
+            'form': form,
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/api_app/boat/import.html', context)
 
 @admin.register(BoatCategory)
 class BoatCategoryAdmin(admin.ModelAdmin):
@@ -96,10 +304,16 @@ class BoatCategoryAdmin(admin.ModelAdmin):
 class SellRequestImageInline(admin.TabularInline):
     model = SellRequestImage
     extra = 1
+    
+    def get_queryset(self, request):
+        # Image labels show the parent request
+        return super().get_queryset(request).select_related('sell_request')
 
 @admin.register(Inquiry)
-class InquiryAdmin(admin.ModelAdmin):
+class InquiryAdmin(LargeTableAdmin):
     list_display = ('boat', 'first_name', 'last_name', 'email', 'created_at', 'is_processed')
+    list_select_related = ('boat',)
+    ordering = ('-created_at',)
     list_filter = ('is_processed', 'created_at')
     search_fields = ('first_name', 'last_name', 'email', 'comment')
     readonly_fields = ('created_at',)
@@ -111,8 +325,9 @@ class InquiryAdmin(admin.ModelAdmin):
     actions = ['mark_as_processed']
 
 @admin.register(SellRequest)
-class SellRequestAdmin(admin.ModelAdmin):
+class SellRequestAdmin(LargeTableAdmin):
     list_display = ('first_name', 'last_name', 'email', 'created_at', 'is_processed')
+    ordering = ('-created_at',)
     list_filter = ('is_processed', 'created_at')
     search_fields = ('first_name', 'last_name', 'email', 'boat_details', 'comment')
     readonly_fields = ('created_at',)
@@ -131,9 +346,11 @@ class TestimonialAdmin(admin.ModelAdmin):
     list_filter = ('rating',)
 
 @admin.register(BoatVideo)
-class BoatVideoAdmin(admin.ModelAdmin):
+class BoatVideoAdmin(LargeTableAdmin):
     list_display = ('boat', 'title', 'has_video_file', 'has_video_url', 'file_size_display', 'has_warnings')
-    list_filter = ('boat',)
+    list_select_related = ('boat',)
+    # Only offer the boats that have videos instead of loading every boat
+    list_filter = (('boat', admin.RelatedOnlyFieldListFilter),)
     search_fields = ('title', 'boat__title')
     fields = ('boat', 'title', 'video_url', 'video_file', 'thumbnail', 'is_main', 'warning_display', 'storage_info')
     readonly_fields = ('storage_info', 'warning_display')
@@ -263,3 +480,64 @@ class BlogPostAdmin(admin.ModelAdmin):
     fields = ('title', 'content', 'image', 'published_date', 'is_active')
     readonly_fields = ('published_date',)
 
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(LargeTableAdmin):
+    list_display = ('subject', 'status', 'attempts', 'created_at', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'body')
+    readonly_fields = ('subject', 'body', 'from_email', 'recipients', 'status', 'attempts',
+                       'next_attempt_at', 'last_error', 'created_at', 'sent_at')
+    
+    def retry_now(self, request, queryset):
+        queryset.exclude(status=OutboundEmail.STATUS_SENT).update(
+            status=OutboundEmail.STATUS_PENDING, next_attempt_at=timezone.now()
+        )
+    retry_now.short_description = "Retry sending the selected emails now"
+    
+    actions = ['retry_now']
+    
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(BoatDailyStat)
+class BoatDailyStatAdmin(LargeTableAdmin):
+    list_display = ('boat', 'date', 'views', 'impressions', 'inquiries')
+    list_select_related = ('boat',)
+    ordering = ('-date', '-views')
+    date_hierarchy = 'date'
+    search_fields = ('boat__title',)
+    
+    # Written by the view counters and the lead rollups only
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(LeadDailyStat)
+class LeadDashboardAdmin(admin.ModelAdmin):
+    """The lead rollups are shown as a dashboard instead of a list of rows"""
+    
+    def changelist_view(self, request, extra_context=None):
+        data = dashboard()
+        peak = max([week['inquiries'] + week['sell_requests'] for week in data['weekly']] + [1])
+        for week in data['weekly']:
+            week['inquiries_width'] = round(week['inquiries'] * 100 / peak)
+            week['sell_requests_width'] = round(week['sell_requests'] * 100 / peak)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Tableau de bord des demandes",
+            **data,
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'admin/api_app/leaddailystat/dashboard.html', context)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,126 @@
+import datetime
+from collections import defaultdict
+from django.db import router, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .counters import increment_rows
+from .models import BoatDailyStat, CategoryDailyStat, Inquiry, LeadDailyStat, SellRequest
+
+# Count columns of each rollup, new rows get 0 in the columns they do not increment
+BOAT_COUNTS = ['views', 'impressions', 'inquiries']
+CATEGORY_COUNTS = ['inquiries']
+LEAD_COUNTS = ['inquiries', 'sell_requests']
+
+def record_inquiry(inquiry):
+    """Add a new inquiry to the per boat, per category and per day rollups"""
+    using = router.db_for_write(LeadDailyStat)
+    day = timezone.localdate(inquiry.created_at)
+    increment_rows(BoatDailyStat, ['boat', 'date'], BOAT_COUNTS, [(inquiry.boat_id, day, 0, 0, 1)], using)
+    increment_rows(CategoryDailyStat, ['category', 'date'], CATEGORY_COUNTS,
+                   [(inquiry.boat.category_id, day, 1)], using)
+    increment_rows(LeadDailyStat, ['date'], LEAD_COUNTS, [(day, 1, 0)], using)
+
+def record_sell_request(sell_request):
+    """Add a new sell request to the per day rollup"""
+    using = router.db_for_write(LeadDailyStat)
+    day = timezone.localdate(sell_request.created_at)
+    increment_rows(LeadDailyStat, ['date'], LEAD_COUNTS, [(day, 0, 1)], using)
+
+def rebuild_rollups(using=None):
+    """Recompute the lead rollups from the inquiries and sell requests, returns the inquiries
+    and sell requests counted. Runs in one transaction, the dashboard never sees partial counts."""
+    using = using or router.db_for_write(LeadDailyStat)
+    with transaction.atomic(using=using):
+        BoatDailyStat.objects.using(using).filter(inquiries__gt=0).update(inquiries=0)
+        CategoryDailyStat.objects.using(using).all().delete()
+        LeadDailyStat.objects.using(using).all().delete()
+
+        # Grouped by the database, only one row per boat and day comes back
+        per_boat = (
+            Inquiry.objects.using(using)
+            .annotate(day=TruncDate('created_at'))
+            .values_list('boat_id', 'boat__category_id', 'day')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        per_category = defaultdict(int)
+        per_day = defaultdict(lambda: [0, 0])
+        boat_rows = []
+        for boat_id, category_id, day, count in per_boat:
+            boat_rows.append((boat_id, day, 0, 0, count))
+            per_category[(category_id, day)] += count
+            per_day[day][0] += count
+
+        sell_requests = (
+            SellRequest.objects.using(using)
+            .annotate(day=TruncDate('created_at'))
+            .values_list('day')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        for day, count in sell_requests:
+            per_day[day][1] += count
+
+        increment_rows(BoatDailyStat, ['boat', 'date'], BOAT_COUNTS, boat_rows, using)
+        increment_rows(CategoryDailyStat, ['category', 'date'], CATEGORY_COUNTS,
+                       [(category_id, day, count) for (category_id, day), count in per_category.items()], using)
+        increment_rows(LeadDailyStat, ['date'], LEAD_COUNTS,
+                       [(day, inquiries, sell_request_count) for day, (inquiries, sell_request_count) in per_day.items()],
+                       using)
+
+    return (sum(inquiries for inquiries, _ in per_day.values()),
+            sum(sell_request_count for _, sell_request_count in per_day.values()))
+
+def weekly_leads(weeks, today):
+    """Inquiries and sell requests of the last weeks, oldest first"""
+    start = today - datetime.timedelta(days=today.weekday(), weeks=weeks - 1)
+    buckets = {start + datetime.timedelta(weeks=week): [0, 0] for week in range(weeks)}
+    for day, inquiries, sell_requests in LeadDailyStat.objects.filter(date__gte=start).values_list(
+            'date', 'inquiries', 'sell_requests'):
+        bucket = buckets[day - datetime.timedelta(days=day.weekday())]
+        bucket[0] += inquiries
+        bucket[1] += sell_requests
+    return [{'start': week, 'inquiries': counts[0], 'sell_requests': counts[1]} for week, counts in buckets.items()]
+
+def monthly_leads(months, today):
+    """Inquiries and sell requests of the last months, oldest first"""
+    first_months = []
+    month = today.replace(day=1)
+    for _ in range(months):
+        first_months.insert(0, month)
+        month = (month - datetime.timedelta(days=1)).replace(day=1)
+    buckets = {month: [0, 0] for month in first_months}
+    for day, inquiries, sell_requests in LeadDailyStat.objects.filter(date__gte=first_months[0]).values_list(
+            'date', 'inquiries', 'sell_requests'):
+        bucket = buckets[day.replace(day=1)]
+        bucket[0] += inquiries
+        bucket[1] += sell_requests
+    return [{'start': month, 'inquiries': counts[0], 'sell_requests': counts[1]} for month, counts in buckets.items()]
+
+def dashboard(weeks=12, months=12, days=30, top=10):
+    """Lead trends read from the rollups only: the work depends on the periods shown,
+    not on the number of inquiries and sell requests stored"""
+    today = timezone.localdate()
+    since = today - datetime.timedelta(days=days - 1)
+    top_boats = (
+        BoatDailyStat.objects.filter(date__gte=since)
+        .values('boat_id', 'boat__title')
+        .annotate(inquiries=Sum('inquiries'), views=Sum('views'))
+        .filter(inquiries__gt=0)
+        .order_by('-inquiries', 'boat__title')[:top]
+    )
+    top_categories = (
+        CategoryDailyStat.objects.filter(date__gte=since)
+        .values('category_id', 'category__name')
+        .annotate(inquiries=Sum('inquiries'))
+        .order_by('-inquiries', 'category__name')
+    )
+    return {
+        'weekly': weekly_leads(weeks, today),
+        'monthly': monthly_leads(months, today),
+        'top_boats': list(top_boats),
+        'top_categories': list(top_categories),
+        'days': days,
+    }
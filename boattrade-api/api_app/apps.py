@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ApiAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api_app"
+
+    def ready(self):
+        # Keeps the lead analytics rollups up to date and measures the queries of requests
+        from . import signals  # noqa: F401
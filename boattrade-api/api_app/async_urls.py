@@ -0,0 +1,16 @@
+from django.urls import path
+from . import async_views
+
+# Async versions of the public read endpoints, served in front of api_app.urls
+# when ASYNC_READ_VIEWS is set (see api_project.asgi_urls)
+urlpatterns = [
+    path('boats/', async_views.boat_list, name='async_boat_list'),
+    path('boats/<int:pk>/', async_views.boat_detail, name='async_boat_detail'),
+    path('featured-boats/', async_views.featured_boats, name='async_featured_boats'),
+    path('categories/', async_views.category_list, name='async_category_list'),
+    path('categories/<int:pk>/', async_views.category_detail, name='async_category_detail'),
+    path('testimonials/', async_views.testimonial_list, name='async_testimonial_list'),
+    path('testimonials/<int:pk>/', async_views.testimonial_detail, name='async_testimonial_detail'),
+    path('blog/', async_views.blog_list, name='async_blog_list'),
+    path('blog/<int:pk>/', async_views.blog_detail, name='async_blog_detail'),
+]
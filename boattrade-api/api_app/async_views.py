@@ -0,0 +1,145 @@
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from .counters import record_impressions, record_view
+from .events import event_stream, events_since, format_event, latest_event_id
+from .models import Boat, BoatImage, BoatVideo
+from .serializers import (
+    BoatSerializer, BoatCategorySerializer, PreloadedBoatListSerializer,
+    TestimonialSerializer, BlogPostSerializer
+)
+from .views import (
+    BoatViewSet, BoatCategoryViewSet, TestimonialViewSet, BlogPostViewSet, get_featured_boats,
+    filter_boats, non_atomic_view
+)
+
+# Boat ids per IN (...) query, below the bound parameters limit of SQLite
+ID_BATCH_SIZE = 500
+
+def async_read_view(sync_view):
+    """Serve GET requests with the decorated coroutine. The other methods (HEAD, OPTIONS, 405s)
+    and the browsable API are left to the sync DRF view so responses stay the same."""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if (request.method != 'GET' or 'format' in request.GET
+                    or 'text/html' in request.headers.get('Accept', '')):
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            return await view(request, *args, **kwargs)
+        return non_atomic_view(wrapper)
+    return decorator
+
+def json_response(data, status=200):
+    # Same renderer as the DRF views: decimals as numbers, unescaped unicode
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+def not_found(model):
+    return json_response({'detail': f"No {model._meta.object_name} matches the given query."}, status=404)
+
+async def attach_main_media(boats):
+    """Set main_image_url and main_video_url on the boats like BoatListSerializer looks them up,
+    with a few queries per ID_BATCH_SIZE boats instead of up to four per boat"""
+    image_storage = BoatImage._meta.get_field('image').storage
+    video_storage = BoatVideo._meta.get_field('video_file').storage
+    main_images, first_images, main_videos = {}, {}, {}
+    ids = [boat.pk for boat in boats]
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[start:start + ID_BATCH_SIZE]
+        images = BoatImage.objects.filter(boat_id__in=batch).order_by('boat_id', '-is_main', 'position', 'id')
+        async for boat_id, is_main, image in images.values_list('boat_id', 'is_main', 'image'):
+            if is_main:
+                main_images.setdefault(boat_id, image)
+            else:
+                first_images.setdefault(boat_id, image)
+        videos = BoatVideo.objects.filter(boat_id__in=batch, is_main=True).order_by('boat_id', 'id')
+        async for boat_id, video_file, video_url in videos.values_list('boat_id', 'video_file', 'video_url'):
+            if boat_id not in main_videos:
+                main_videos[boat_id] = video_storage.url(video_file) if video_file else video_url
+
+    for boat in boats:
+        # The main image first, otherwise the first image in position order
+        image = main_images.get(boat.pk) or first_images.get(boat.pk)
+        boat.main_image_url = image_storage.url(image) if image else None
+        boat.main_video_url = main_videos.get(boat.pk)
+
+async def serialize_boats(boats, context=None):
+    await attach_main_media(boats)
+    return PreloadedBoatListSerializer(boats, many=True, context=context or {}).data
+
+@async_read_view(BoatViewSet.as_view({'get': 'list'}))
+async def boat_list(request):
+    queryset = filter_boats(BoatViewSet.queryset.all(), request.GET).select_related('category')
+    boats = [boat async for boat in queryset]
+    data = await serialize_boats(boats, {'request': request})
+    record_impressions([boat['id'] for boat in data])
+    return json_response(data)
+
+@async_read_view(BoatViewSet.as_view({'get': 'retrieve'}))
+async def boat_detail(request, pk):
+    queryset = filter_boats(BoatViewSet.queryset.all(), request.GET).select_related('category').prefetch_related(
+        'images', 'videos', 'amenity_items', 'technical_detail_items'
+    )
+    # Prefetched relations, the serializer runs no query
+    boat = await queryset.filter(pk=pk).afirst()
+    if boat is None:
+        return not_found(Boat)
+    data = BoatSerializer(boat, context={'request': request}).data
+    record_view(data['id'])
+    return json_response(data)
+
+@async_read_view(get_featured_boats)
+async def featured_boats(request):
+    queryset = Boat.objects.filter(is_active=True, is_featured=True).order_by('-created_at').select_related('category')
+    boats = [boat async for boat in queryset]
+    return json_response(await serialize_boats(boats))
+
+def model_views(viewset, serializer_class):
+    """Async list and detail views of a read-only viewset without relations to load"""
+    @async_read_view(viewset.as_view({'get': 'list'}))
+    async def list_view(request):
+        objects = [obj async for obj in viewset.queryset.all()]
+        return json_response(serializer_class(objects, many=True, context={'request': request}).data)
+
+    @async_read_view(viewset.as_view({'get': 'retrieve'}))
+    async def detail_view(request, pk):
+        obj = await viewset.queryset.filter(pk=pk).afirst()
+        if obj is None:
+            return not_found(viewset.queryset.model)
+        return json_response(serializer_class(obj, context={'request': request}).data)
+
+    return list_view, detail_view
+
+category_list, category_detail = model_views(BoatCategoryViewSet, BoatCategorySerializer)
+testimonial_list, testimonial_detail = model_views(TestimonialViewSet, TestimonialSerializer)
+blog_list, blog_detail = model_views(BlogPostViewSet, BlogPostSerializer)
+
+@non_atomic_view
+async def catalog_events(request):
+    """Server-Sent Events stream of the catalog changes, resumable with Last-Event-ID"""
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.GET['last_event_id'])
+    except (KeyError, ValueError):
+        last_event_id = None
+
+    if not isinstance(request, ASGIRequest):
+        # An endless stream would hold a WSGI worker: the events so far are sent and the
+        # client reconnects after CATALOG_EVENTS_RETRY_MS, like polling
+        chunks = [f"retry: {settings.CATALOG_EVENTS_RETRY_MS}\n\n"]
+        if last_event_id is None:
+            chunks.append(f"id: {await latest_event_id()}\n\n")
+        else:
+            backlog, complete = await events_since(last_event_id)
+            if not complete:
+                chunks.append("event: reset\ndata: {}\n\n")
+            chunks += [format_event(event) for event in backlog]
+        response = HttpResponse(''.join(chunks), content_type='text/event-stream')
+    else:
+        response = StreamingHttpResponse(event_stream(last_event_id), content_type='text/event-stream')
+        # Proxies must pass the events on as they come
+        response['X-Accel-Buffering'] = 'no'
+    response['Cache-Control'] = 'no-cache'
+    return response
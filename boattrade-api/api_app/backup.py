@@ -0,0 +1,67 @@
+import os
+import gzip
+import time
+import shutil
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BackupRestarted(Exception):
+    pass
+
+def online_backup(source_path, target_path, pages=1024, pause=0.05, max_restarts=3):
+    """Copy a live SQLite database with the online backup API, `pages` at a time.
+
+    Sleeping `pause` seconds between steps releases the read lock so live
+    requests are not stalled while the snapshot is taken. A write to the source
+    restarts the copy, after `max_restarts` restarts the database is copied in a
+    single step so sustained writes cannot keep the backup from finishing.
+    """
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        # Every step copies `pages` pages, no progress means the copy started over
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise BackupRestarted
+        last_remaining = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except BackupRestarted:
+            logger.warning(f"Backup of {source_path} restarted {restarts} times by writes, copying it in one step")
+            # Holds the read lock until done, the writers wait up to their busy timeout
+            source.backup(target, pages=-1)
+    finally:
+        target.close()
+        source.close()
+
+def check_integrity(path):
+    """Raise ValueError unless PRAGMA integrity_check reports the database as ok"""
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        connection.close()
+    if rows != [('ok',)]:
+        raise ValueError(f"Integrity check failed for {path}: {'; '.join(row[0] for row in rows)}")
+
+def compress_file(source_path, target_path, chunk_size=1024 * 1024):
+    """Gzip `source_path` into `target_path` chunk by chunk, the target only appears once complete"""
+    partial_path = f"{target_path}.part"
+    try:
+        with open(source_path, 'rb') as source, gzip.open(partial_path, 'wb') as target:
+            shutil.copyfileobj(source, target, chunk_size)
+        os.replace(partial_path, target_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
@@ -0,0 +1,153 @@
+import os
+import gzip
+import json
+import uuid
+import zlib
+import hashlib
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_SUFFIX = '.json.gz'
+# Fixed-size blocks hashed per thread task by store_blocks
+BLOCKS_PER_TASK = 256
+# Media formats zlib cannot shrink, their chunks are stored at level 0 (about 20x faster than 6)
+COMPRESSED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp4', '.mov', '.webm', '.zip', '.gz'}
+
+class ChunkStore:
+    """Stores each unique chunk once under chunks/<sha256[:2]>/<sha256>, zlib compressed,
+    plus one manifest per backup run listing the chunks of every backed up file"""
+    
+    def __init__(self, root, avg_chunk_size=64 * 1024):
+        self.root = root
+        self.avg_chunk_size = avg_chunk_size
+        self.chunks_dir = os.path.join(root, 'chunks')
+        self.manifests_dir = os.path.join(root, 'manifests')
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+
+    def chunk_path(self, chunk_id):
+        return os.path.join(self.chunks_dir, chunk_id[:2], chunk_id)
+
+    def has_chunk(self, chunk_id):
+        return os.path.exists(self.chunk_path(chunk_id))
+
+    def write_chunk(self, data, chunk_id=None, level=6):
+        """Store a chunk unless it already exists, returns its id"""
+        chunk_id = chunk_id or hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(chunk_id)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Unique temporary name: parallel workers may write the same chunk
+            partial_path = f"{path}.{uuid.uuid4().hex}.part"
+            with open(partial_path, 'wb') as chunk_file:
+                chunk_file.write(zlib.compress(data, level))
+            os.replace(partial_path, path)
+        return chunk_id
+
+    def read_chunk(self, chunk_id):
+        with open(self.chunk_path(chunk_id), 'rb') as chunk_file:
+            data = zlib.decompress(chunk_file.read())
+        if hashlib.sha256(data).hexdigest() != chunk_id:
+            raise ValueError(f"Chunk {chunk_id} is corrupted")
+        return data
+
+    def store_file(self, path):
+        """Store a file as blocks of avg_chunk_size, returns the list of their chunk ids.
+
+        Media files are written once under a name carrying their digest and never edited in
+        place, content-defined chunking would find nothing more to share between them.
+        """
+        level = 0 if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS else 6
+        with open(path, 'rb') as source:
+            return [self.write_chunk(data, level=level)
+                    for data in iter(lambda: source.read(self.avg_chunk_size), b'')]
+
+    def store_blocks(self, path, block_size, workers=1):
+        """Store a file as fixed-size blocks, returns the list of their chunk ids.
+
+        Meant for SQLite files: pages are rewritten in place and never shift, so
+        blocks aligned on pages deduplicate as well as content-defined chunks.
+        Hashing runs at C speed on `workers` threads (hashlib and zlib release
+        the GIL) and only the blocks missing from the store are compressed.
+        """
+        def store_segment(start):
+            chunk_ids = []
+            with open(path, 'rb') as source:
+                source.seek(start)
+                for _ in range(BLOCKS_PER_TASK):
+                    data = source.read(block_size)
+                    if not data:
+                        break
+                    chunk_ids.append(self.write_chunk(data, hashlib.sha256(data).hexdigest()))
+            return chunk_ids
+
+        starts = range(0, os.path.getsize(path), block_size * BLOCKS_PER_TASK)
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            return [chunk_id for chunk_ids in executor.map(store_segment, starts) for chunk_id in chunk_ids]
+
+    def restore_file(self, chunk_ids, target_path, mtime_ns=None):
+        os.makedirs(os.path.dirname(target_path) or '.', exist_ok=True)
+        partial_path = f"{target_path}.part"
+        with open(partial_path, 'wb') as target:
+            for chunk_id in chunk_ids:
+                target.write(self.read_chunk(chunk_id))
+        os.replace(partial_path, target_path)
+        if mtime_ns is not None:
+            os.utime(target_path, ns=(mtime_ns, mtime_ns))
+
+    def manifest_names(self):
+        """Manifest names, oldest first"""
+        return sorted(
+            name[:-len(MANIFEST_SUFFIX)] for name in os.listdir(self.manifests_dir)
+            if name.endswith(MANIFEST_SUFFIX)
+        )
+
+    def write_manifest(self, manifest):
+        name = datetime.datetime.fromisoformat(manifest['created_at']).strftime('%Y%m%d_%H%M%S_%f')
+        path = os.path.join(self.manifests_dir, name + MANIFEST_SUFFIX)
+        with gzip.open(f"{path}.part", 'wt', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(f"{path}.part", path)
+        return name
+
+    def read_manifest(self, name):
+        path = os.path.join(self.manifests_dir, name + MANIFEST_SUFFIX)
+        with gzip.open(path, 'rt', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+
+    def latest_manifest(self, before=None):
+        """Most recent manifest, optionally the last one taken at or before `before`"""
+        for name in reversed(self.manifest_names()):
+            manifest = self.read_manifest(name)
+            if before is None or datetime.datetime.fromisoformat(manifest['created_at']) <= before:
+                return manifest
+        return None
+
+    def prune(self, cutoff):
+        """Delete manifests older than cutoff (always keeping the latest) and unreferenced chunks"""
+        names = self.manifest_names()
+        removed_manifests = 0
+        referenced = set()
+        for name in names:
+            manifest = self.read_manifest(name)
+            created_at = datetime.datetime.fromisoformat(manifest['created_at'])
+            if created_at < cutoff and name != names[-1]:
+                os.remove(os.path.join(self.manifests_dir, name + MANIFEST_SUFFIX))
+                removed_manifests += 1
+                continue
+            referenced.update(manifest['database']['chunks'])
+            for entry in manifest['media'].values():
+                referenced.update(entry['chunks'])
+
+        removed_chunks = 0
+        for prefix in os.listdir(self.chunks_dir):
+            prefix_dir = os.path.join(self.chunks_dir, prefix)
+            for chunk_id in os.listdir(prefix_dir):
+                if chunk_id not in referenced:
+                    os.remove(os.path.join(prefix_dir, chunk_id))
+                    removed_chunks += 1
+        return removed_manifests, removed_chunks
+
+def store_file_in(root, avg_chunk_size, path):
+    """Process pool entry point: chunk one file into the store at `root`"""
+    return ChunkStore(root, avg_chunk_size).store_file(path)
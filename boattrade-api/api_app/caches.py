@@ -0,0 +1,38 @@
+from django.core.cache.backends import filebased, locmem, redis
+
+from .metrics import CACHE_REQUESTS
+
+_missing = object()
+
+class CacheMetricsMixin:
+    """Counts the hits and misses of get() for the /metrics endpoint, labelled with the
+    METRICS_NAME of the cache configuration. The default get_many() calls get() per key."""
+
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        self.metrics_name = params.get('METRICS_NAME', 'default')
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            CACHE_REQUESTS.inc((self.metrics_name, 'miss'))
+            return default
+        CACHE_REQUESTS.inc((self.metrics_name, 'hit'))
+        return value
+
+class LocMemCache(CacheMetricsMixin, locmem.LocMemCache):
+    pass
+
+class FileBasedCache(CacheMetricsMixin, filebased.FileBasedCache):
+    pass
+
+class RedisCache(CacheMetricsMixin, redis.RedisCache):
+    # Fetches all the keys in one round trip instead of calling get()
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        if values:
+            CACHE_REQUESTS.inc((self.metrics_name, 'hit'), len(values))
+        if len(keys) > len(values):
+            CACHE_REQUESTS.inc((self.metrics_name, 'miss'), len(keys) - len(values))
+        return values
@@ -0,0 +1,202 @@
+import atexit
+import json
+import threading
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+import logging
+
+from .models import BlogPost, Boat, BoatCategory, Testimonial
+
+logger = logging.getLogger(__name__)
+
+# Surrogate keys of the objects serialized for the current request, None outside of CdnCacheMiddleware
+current_surrogate_keys = ContextVar('current_surrogate_keys', default=None)
+
+KEY_PREFIXES = {Boat: 'boat', BoatCategory: 'category', Testimonial: 'testimonial', BlogPost: 'blog'}
+
+# url name -> (policy of CDN_CACHE_POLICIES, keys of every response of the endpoint).
+# Lists carry the key of their collection, purged when an object enters or leaves it.
+ENDPOINTS = {name: (policy, keys) for names, policy, keys in [
+    (('boat-list', 'async_boat_list', 'featured_boats', 'async_featured_boats'), 'catalog', ('boats',)),
+    (('boat-detail', 'async_boat_detail', 'seo_boat_page'), 'catalog', ()),
+    (('boatcategory-list', 'async_category_list'), 'content', ('categories',)),
+    (('boatcategory-detail', 'async_category_detail'), 'content', ()),
+    (('testimonial-list', 'async_testimonial_list'), 'content', ('testimonials',)),
+    (('testimonial-detail', 'async_testimonial_detail'), 'content', ()),
+    (('blogpost-list', 'async_blog_list'), 'content', ('blog',)),
+    (('blogpost-detail', 'async_blog_detail'), 'content', ()),
+    (('django.contrib.sitemaps.views.sitemap',), 'sitemap', ('boats',)),
+] for name in names}
+
+def object_key(model, pk):
+    return f"{KEY_PREFIXES[model]}-{pk}"
+
+def add_surrogate_keys(*keys):
+    """Name objects in the Surrogate-Key header of the current response"""
+    collected = current_surrogate_keys.get()
+    if collected is not None:
+        collected.update(keys)
+
+def surrogate_keys(endpoint_keys, object_keys):
+    """Header keys, the boat keys of long lists are left out to fit CDN_MAX_SURROGATE_KEYS:
+    the lists are purged through their collection key"""
+    keys = sorted(object_keys)
+    if len(endpoint_keys) + len(keys) > settings.CDN_MAX_SURROGATE_KEYS:
+        keys = [key for key in keys if not key.startswith('boat-')]
+    return [*endpoint_keys, *keys][:settings.CDN_MAX_SURROGATE_KEYS]
+
+# Purges
+
+_pending = set()
+_lock = threading.Lock()
+_sender = None
+
+def purge(*keys):
+    """Purge the responses carrying keys from the CDN once the current transaction commits"""
+    if settings.CDN_PURGE_BACKEND and keys:
+        transaction.on_commit(lambda: _queue(keys), robust=True)
+
+def _queue(keys):
+    if not settings.CDN_PURGE_INTERVAL:
+        send_purges(keys)
+        return
+    with _lock:
+        _pending.update(keys)
+    _start_sender()
+
+def _start_sender():
+    global _sender
+    if _sender is not None:
+        return
+    with _lock:
+        if _sender is None:
+            _sender = threading.Thread(target=_send_loop, name='cdn-purges', daemon=True)
+            _sender.start()
+            # Do not leave stale responses in the CDN when the process stops
+            atexit.register(flush_purges)
+
+def _send_loop():
+    while True:
+        time.sleep(settings.CDN_PURGE_INTERVAL)
+        flush_purges()
+
+def flush_purges():
+    """Send the keys queued since the last call in as few requests as the backend allows"""
+    global _pending
+    with _lock:
+        keys, _pending = _pending, set()
+    if keys and not send_purges(keys):
+        # Sent again with the next batch
+        with _lock:
+            _pending |= keys
+
+def send_purges(keys):
+    backend = import_string(settings.CDN_PURGE_BACKEND)()
+    keys = sorted(keys)
+    try:
+        for start in range(0, len(keys), backend.max_keys):
+            backend.purge(keys[start:start + backend.max_keys])
+    except Exception as e:
+        logger.error(f"CDN purge failed: {str(e)}")
+        return False
+    return True
+
+class BasePurgeBackend:
+    # Keys per purge request
+    max_keys = 256
+
+    def purge(self, keys):
+        raise NotImplementedError
+
+    def post(self, url, body=None, headers=None):
+        request = Request(url, data=body, headers=headers or {}, method='POST')
+        with urlopen(request, timeout=settings.CDN_PURGE_TIMEOUT) as response:
+            return response.read()
+
+class HttpPurgeBackend(BasePurgeBackend):
+    """Posts {"keys": [...]} to CDN_PURGE_URL, with CDN_PURGE_TOKEN as bearer token when set.
+    Fits a purge relay in front of Varnish or nginx, and LocalPurgeServer."""
+
+    def purge(self, keys):
+        headers = {'Content-Type': 'application/json'}
+        if settings.CDN_PURGE_TOKEN:
+            headers['Authorization'] = f"Bearer {settings.CDN_PURGE_TOKEN}"
+        self.post(settings.CDN_PURGE_URL, json.dumps({'keys': keys}).encode(), headers)
+
+class FastlyPurgeBackend(BasePurgeBackend):
+    """Purges the keys from the Fastly service CDN_PURGE_SERVICE_ID with the API token CDN_PURGE_TOKEN"""
+
+    def purge(self, keys):
+        self.post(
+            f"https://api.fastly.com/service/{settings.CDN_PURGE_SERVICE_ID}/purge",
+            headers={'Fastly-Key': settings.CDN_PURGE_TOKEN, 'Surrogate-Key': ' '.join(keys)},
+        )
+
+class CloudflarePurgeBackend(BasePurgeBackend):
+    """Purges the Cache-Tag keys from the Cloudflare zone CDN_PURGE_SERVICE_ID with the API token
+    CDN_PURGE_TOKEN"""
+    max_keys = 30
+
+    def purge(self, keys):
+        self.post(
+            f"https://api.cloudflare.com/client/v4/zones/{settings.CDN_PURGE_SERVICE_ID}/purge_cache",
+            json.dumps({'tags': keys}).encode(),
+            {'Authorization': f"Bearer {settings.CDN_PURGE_TOKEN}", 'Content-Type': 'application/json'},
+        )
+
+class LocalPurgeServer:
+    """Local HTTP stand-in of a CDN purge API for HttpPurgeBackend, keeps the purge requests
+    it receives in `requests`. Used by the tests and to try the purges without a CDN."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.requests = []
+        requests = self.requests
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                requests.append({
+                    'path': self.path,
+                    'authorization': self.headers.get('Authorization'),
+                    'keys': json.loads(body)['keys'],
+                })
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/purge"
+
+    @property
+    def purged(self):
+        return [key for request in self.requests for key in request['keys']]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='purge-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
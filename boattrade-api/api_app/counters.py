@@ -0,0 +1,130 @@
+import atexit
+import datetime
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Case, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+import logging
+
+from .models import Boat, BoatDailyStat
+
+logger = logging.getLogger(__name__)
+
+# (boat_id, date) -> [views, impressions] counted since the last flush
+_buffer = defaultdict(lambda: [0, 0])
+_lock = threading.Lock()
+_flusher = None
+
+def record_view(boat_id):
+    """Count a visit of a boat detail page"""
+    _record([boat_id], 0)
+
+def record_impressions(boat_ids):
+    """Count the boats shown as cards in a list"""
+    _record(boat_ids, 1)
+
+def _record(boat_ids, column):
+    # Without the background flush nothing would ever write the buffer
+    if not settings.VIEW_COUNTER_FLUSH_INTERVAL:
+        return
+    today = timezone.localdate()
+    with _lock:
+        for boat_id in boat_ids:
+            _buffer[(boat_id, today)][column] += 1
+    _start_flusher()
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='view-counters', daemon=True)
+            _flusher.start()
+            # Do not lose the last counts when the worker stops
+            atexit.register(flush_counters)
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.VIEW_COUNTER_FLUSH_INTERVAL)
+        try:
+            flush_counters()
+        finally:
+            connections.close_all()
+
+def increment_rows(model, key_fields, count_fields, rows, using):
+    """Insert rows of (*keys, *counts) or add their counts to the existing rows with the same keys.
+    Supported by SQLite >= 3.24 and PostgreSQL, the increment happens in the database so
+    concurrent writers of the same row do not overwrite each other."""
+    if not rows:
+        return
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = [model._meta.get_field(name).column for name in key_fields + count_fields]
+    keys = ', '.join(quote(column) for column in columns[:len(key_fields)])
+    updates = ', '.join(
+        f"{quote(column)} = {table}.{quote(column)} + excluded.{quote(column)}"
+        for column in columns[len(key_fields):]
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(quote(column) for column in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({keys}) DO UPDATE SET {updates}",
+            rows,
+        )
+
+def flush_counters():
+    """Add the buffered counts to the daily rollup in one batched upsert, returns the rows written"""
+    global _buffer
+    with _lock:
+        pending, _buffer = _buffer, defaultdict(lambda: [0, 0])
+    if not pending:
+        return 0
+
+    using = router.db_for_write(BoatDailyStat)
+    try:
+        with transaction.atomic(using=using):
+            # Boats deleted since they were counted would break the foreign key
+            existing = set(Boat.objects.using(using).filter(
+                pk__in={boat_id for boat_id, _ in pending}
+            ).values_list('pk', flat=True))
+            rows = [
+                (boat_id, day, views, impressions, 0)
+                for (boat_id, day), (views, impressions) in pending.items() if boat_id in existing
+            ]
+            increment_rows(BoatDailyStat, ['boat', 'date'], ['views', 'impressions', 'inquiries'], rows, using)
+    except Exception as e:
+        # Keep the counts for the next flush
+        with _lock:
+            for key, (views, impressions) in pending.items():
+                _buffer[key][0] += views
+                _buffer[key][1] += impressions
+        logger.error(f"Flushing view counters failed: {str(e)}")
+        return 0
+    return len(rows)
+
+def popularity():
+    """Expression scoring boats by their recent views and impressions, each day weighing
+    half as much every POPULARITY_HALF_LIFE_DAYS days"""
+    today = timezone.localdate()
+    days = settings.POPULARITY_WINDOW_DAYS
+    weights = [
+        When(date=today - datetime.timedelta(days=age), then=Value(0.5 ** (age / settings.POPULARITY_HALF_LIFE_DAYS)))
+        for age in range(days)
+    ]
+    hits = F('views') + F('impressions') * Value(settings.POPULARITY_IMPRESSION_WEIGHT)
+    # Correlated subquery over the window only, a join would read every past day of each boat
+    recent = (
+        BoatDailyStat.objects.filter(boat=OuterRef('pk'), date__gt=today - datetime.timedelta(days=days))
+        .values('boat')
+        .annotate(score=Sum(Case(*weights, default=Value(0.0), output_field=FloatField()) * hits,
+                            output_field=FloatField()))
+        .values('score')
+    )
+    return Coalesce(Subquery(recent, output_field=FloatField()), Value(0.0))
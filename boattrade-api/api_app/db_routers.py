@@ -0,0 +1,32 @@
+import random
+from contextvars import ContextVar
+from django.conf import settings
+
+# Set by ReplicaRoutingMiddleware for the requests allowed to read from a replica
+read_from_replica = ContextVar('read_from_replica', default=False)
+
+# A lagging replica would not know a session or login just written and serve the client as
+# anonymous: sessions and users are read from the primary, like the user model of AUTH_USER_MODEL
+PRIMARY_APP_LABELS = {'sessions', 'auth'}
+
+class ReplicaRouter:
+    """Sends reads to a random replica of DATABASE_REPLICAS when the current request allows it,
+    everything else (writes, admin, management commands, sessions and users) goes to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APP_LABELS or model._meta.label == settings.AUTH_USER_MODEL:
+            return 'default'
+        if read_from_replica.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary, they are never migrated directly
+        return db == 'default'
@@ -0,0 +1,113 @@
+import datetime
+import time
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+import logging
+
+from .metrics import EMAIL_DURATION, EMAIL_FAILURES, EMAILS_SENT
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+def queue_email(subject, message, recipients=None, from_email=None):
+    """Store an email in the outbox, it is sent later by the send_queued_emails command"""
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=recipients or [settings.ADMIN_EMAIL],
+    )
+
+def retry_delay(attempts):
+    """Delay before the next attempt, doubled after every failure"""
+    return datetime.timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+def record_failure(email, error, now):
+    EMAIL_FAILURES.inc()
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboundEmail.STATUS_FAILED
+    else:
+        email.next_attempt_at = now + retry_delay(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+    logger.error(f"Email #{email.pk} delivery failed (attempt {email.attempts}): {error}")
+
+def claim_due_emails(now, batch_size):
+    """Claim up to batch_size due emails for this worker by pushing their next attempt past
+    EMAIL_OUTBOX_CLAIM_TIMEOUT. An email is only claimed if its next attempt is still the one
+    read, so concurrent workers never send the same email twice."""
+    due = list(
+        OutboundEmail.objects.filter(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id')[:batch_size]
+    )
+    claimed_until = now + datetime.timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT)
+    claimed = []
+    # One write transaction for the whole batch
+    with transaction.atomic():
+        for email in due:
+            if OutboundEmail.objects.filter(
+                pk=email.pk, status=OutboundEmail.STATUS_PENDING, next_attempt_at=email.next_attempt_at
+            ).update(next_attempt_at=claimed_until):
+                email.next_attempt_at = claimed_until
+                claimed.append(email)
+    return claimed
+
+def deliver_queued_emails(batch_size=None):
+    """Send the due emails of the outbox over a single connection, returns (sent, failed) counts"""
+    now = timezone.now()
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    due = claim_due_emails(now, batch_size)
+    if not due:
+        return 0, 0
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # The server is unreachable, every email of the batch is retried later
+        for email in due:
+            record_failure(email, e, now)
+        return 0, len(due)
+
+    sent = failed = 0
+    try:
+        for index, email in enumerate(due):
+            start = time.perf_counter()
+            try:
+                EmailMessage(
+                    email.subject,
+                    email.body,
+                    email.from_email,
+                    email.recipients,
+                    connection=connection,
+                ).send()
+            except Exception as e:
+                EMAIL_DURATION.observe(time.perf_counter() - start)
+                record_failure(email, e, now)
+                failed += 1
+                # The connection may be unusable after an error, reopen it for the rest of the batch
+                connection.close()
+                try:
+                    connection.open()
+                except Exception as e:
+                    for email in due[index + 1:]:
+                        record_failure(email, e, now)
+                    failed += len(due) - index - 1
+                    break
+                continue
+            EMAIL_DURATION.observe(time.perf_counter() - start)
+            EMAILS_SENT.inc()
+
+            email.status = OutboundEmail.STATUS_SENT
+            email.attempts += 1
+            email.sent_at = timezone.now()
+            email.last_error = ''
+            email.save(update_fields=['status', 'attempts', 'sent_at', 'last_error'])
+            sent += 1
+    finally:
+        connection.close()
+
+    return sent, failed
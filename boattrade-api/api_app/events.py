@@ -0,0 +1,159 @@
+import asyncio
+import contextvars
+import json
+from decimal import Decimal
+from django.conf import settings
+from django.db import router, transaction
+import logging
+
+from .models import CatalogEvent
+
+logger = logging.getLogger(__name__)
+
+def boat_change_kind(previous, boat):
+    """Event kind of a boat saved over its `previous` state (price and is_active, None when new),
+    None when the change is not public"""
+    if previous is None or not previous['is_active']:
+        # A boat entering the catalog, new or reactivated
+        return CatalogEvent.KIND_CREATED if boat.is_active else None
+    if not boat.is_active:
+        return CatalogEvent.KIND_DEACTIVATED
+    if Decimal(str(boat.price)) != previous['price']:
+        return CatalogEvent.KIND_PRICE_CHANGED
+    return CatalogEvent.KIND_UPDATED
+
+def record_boat_change(previous, boat):
+    kind = boat_change_kind(previous, boat)
+    if kind == CatalogEvent.KIND_PRICE_CHANGED:
+        record_event(kind, boat.pk, price=float(boat.price), previous_price=float(previous['price']))
+    elif kind:
+        record_event(kind, boat.pk)
+
+def record_event(kind, boat_id, **data):
+    """Append a boat change to the event log once the current transaction commits"""
+    using = router.db_for_write(CatalogEvent)
+    transaction.on_commit(lambda: write_event(kind, boat_id, data, using), using=using, robust=True)
+
+def write_event(kind, boat_id, data, using):
+    event = CatalogEvent.objects.using(using).create(kind=kind, boat_id=boat_id, data=data)
+    # Trimmed every 100 events rather than on each write
+    if event.pk % 100 == 0:
+        CatalogEvent.objects.using(using).filter(pk__lte=event.pk - settings.CATALOG_EVENTS_LOG_SIZE).delete()
+    broadcaster.wake()
+
+def coalesce(events):
+    """Drop the boat.updated events followed by another event of the same boat,
+    an admin saving a boat and its photos sends one update"""
+    seen, kept = set(), []
+    for event in reversed(events):
+        if event.kind == CatalogEvent.KIND_UPDATED and event.boat_id in seen:
+            continue
+        seen.add(event.boat_id)
+        kept.append(event)
+    return kept[::-1]
+
+def format_event(event):
+    data = json.dumps({'boat': event.boat_id, **event.data}, separators=(',', ':'))
+    return f"id: {event.pk}\nevent: {event.kind}\ndata: {data}\n\n"
+
+async def latest_event_id():
+    return await CatalogEvent.objects.order_by('-pk').values_list('pk', flat=True).afirst() or 0
+
+async def events_since(last_id):
+    """Events after last_id, and whether the log still holds every one of them"""
+    events = [event async for event in CatalogEvent.objects.filter(pk__gt=last_id).order_by('pk')]
+    oldest = await CatalogEvent.objects.order_by('pk').values_list('pk', flat=True).afirst()
+    return coalesce(events), oldest is None or oldest <= last_id + 1
+
+class Broadcaster:
+    """Reads the event log once per process and fans the new events out to the connected
+    streams: the database sees one query per CATALOG_EVENTS_POLL_INTERVAL whatever the
+    number of clients, and events committed by this process are sent right away."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.loop = None
+        self.task = None
+        self.wakeup = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=settings.CATALOG_EVENTS_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.loop is not loop:
+            self.loop = loop
+            self.wakeup = asyncio.Event()
+            # Not in the context of the subscribing request (metrics, replica routing)
+            self.task = loop.create_task(self.run(), context=contextvars.Context())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def wake(self):
+        """Poll right away, called from the thread that committed an event"""
+        loop, wakeup = self.loop, self.wakeup
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def run(self):
+        last_id = await latest_event_id()
+        while self.subscribers:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), settings.CATALOG_EVENTS_POLL_INTERVAL)
+            except TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                events = [event async for event in CatalogEvent.objects.filter(pk__gt=last_id).order_by('pk')]
+            except Exception as e:
+                logger.error(f"Reading the catalog events failed: {str(e)}")
+                continue
+            if not events:
+                continue
+            last_id = events[-1].pk
+            for event in coalesce(events):
+                for queue in list(self.subscribers):
+                    try:
+                        queue.put_nowait(event)
+                    except asyncio.QueueFull:
+                        # Too slow a client: its stream ends, it resumes with Last-Event-ID
+                        self.subscribers.discard(queue)
+                        while not queue.empty():
+                            queue.get_nowait()
+                        queue.put_nowait(None)
+
+broadcaster = Broadcaster()
+
+async def event_stream(last_event_id):
+    """Server-Sent Events of the boat changes after last_event_id (None for new clients)"""
+    queue = broadcaster.subscribe()
+    try:
+        yield f"retry: {settings.CATALOG_EVENTS_RETRY_MS}\n\n"
+        if last_event_id is None:
+            # Lets the client resume from here after a disconnection
+            last_event_id = await latest_event_id()
+            yield f"id: {last_event_id}\n\n"
+        else:
+            backlog, complete = await events_since(last_event_id)
+            if not complete:
+                # Events were trimmed from the log, the client reloads the catalog
+                yield "event: reset\ndata: {}\n\n"
+            for event in backlog:
+                last_event_id = event.pk
+                yield format_event(event)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), settings.CATALOG_EVENTS_KEEPALIVE)
+            except TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                return
+            if event.pk <= last_event_id:
+                continue
+            last_event_id = event.pk
+            yield format_event(event)
+    finally:
+        broadcaster.unsubscribe(queue)
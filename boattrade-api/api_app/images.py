@@ -0,0 +1,195 @@
+import io
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.move import file_move_safe
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.db import connection, transaction
+from django.db.models import Max
+from PIL import Image, ImageOps, UnidentifiedImageError
+import logging
+
+from .metrics import UPLOAD_BYTES
+from .models import BoatImage
+
+logger = logging.getLogger(__name__)
+
+# Formats Pillow re-encodes, anything else (HEIC, ...) is stored untouched
+SUPPORTED_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF'}
+
+_executor = None
+
+def get_executor():
+    """Process wide pool running the image jobs outside of the request"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix='image-processing',
+        )
+    return _executor
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """Streams every uploaded file to disk and stops the upload once a size cap is exceeded"""
+
+    def __init__(self, request=None, max_file_size=None, max_total_size=None):
+        super().__init__(request)
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+        self.total_size = 0
+        self.error = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file_size += len(raw_data)
+        self.total_size += len(raw_data)
+        if self.max_file_size and self.file_size > self.max_file_size:
+            self.error = (f"Le fichier {self.file_name} dépasse la taille maximale de "
+                          f"{self.max_file_size / (1024 * 1024):.0f} MB.")
+            raise StopUpload(connection_reset=False)
+        if self.max_total_size and self.total_size > self.max_total_size:
+            self.error = (f"Les fichiers envoyés dépassent la taille totale maximale de "
+                          f"{self.max_total_size / (1024 * 1024):.0f} MB.")
+            raise StopUpload(connection_reset=False)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        match = getattr(self.request, 'resolver_match', None)
+        UPLOAD_BYTES.inc((match.view_name if match else 'unmatched',), file_size)
+        return super().file_complete(file_size)
+
+def stage_uploads(files, prefix):
+    """Move uploaded files into a private staging directory so they outlive the request"""
+    staging_dir = os.path.join(settings.UPLOAD_STAGING_DIR, f"{prefix}_{uuid.uuid4().hex}")
+    os.makedirs(staging_dir, exist_ok=True)
+    for index, uploaded_file in enumerate(files):
+        # Keep the upload order and the original name for the final file
+        name = f"{index:03d}_{os.path.basename(uploaded_file.name)}"
+        path = os.path.join(staging_dir, name)
+        if hasattr(uploaded_file, 'temporary_file_path'):
+            # Already streamed to disk by the upload handler, renamed rather than copied again
+            # (file_move_safe only copies when the temporary directory is on another filesystem)
+            file_move_safe(uploaded_file.temporary_file_path(), path)
+            continue
+        with open(path, 'wb') as destination:
+            for chunk in uploaded_file.chunks():
+                destination.write(chunk)
+    return staging_dir
+
+def staged_files(staging_dir):
+    """List (path, original name) of a staging directory in upload order"""
+    return [
+        (os.path.join(staging_dir, name), name.split('_', 1)[1])
+        for name in sorted(os.listdir(staging_dir))
+    ]
+
+def process_image(path, max_dimension=None):
+    """Return the image at `path` upright, without metadata and fitting in max_dimension.
+
+    Animated GIF and WebP images are returned untouched, resizing them would keep the first frame only.
+    """
+    max_dimension = max_dimension or settings.IMAGE_MAX_DIMENSION
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            if image_format not in SUPPORTED_FORMATS:
+                raise UnidentifiedImageError(image_format)
+            if getattr(image, 'is_animated', False):
+                return read_untouched(path)
+
+            icc_profile = image.info.get('icc_profile')
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            # Drop EXIF, XMP and comments, only the color profile is kept
+            image.info = {}
+
+            save_kwargs = {'format': image_format}
+            if icc_profile:
+                save_kwargs['icc_profile'] = icc_profile
+            if image_format == 'JPEG':
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                save_kwargs.update(quality=settings.IMAGE_JPEG_QUALITY, optimize=True)
+
+            output = io.BytesIO()
+            image.save(output, **save_kwargs)
+            return ContentFile(output.getvalue())
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning(f"Storing {path} without processing: {str(e)}")
+        return read_untouched(path)
+
+def read_untouched(path):
+    with open(path, 'rb') as source:
+        return ContentFile(source.read())
+
+def number_after_existing(model, instances, position_field, instance_fields):
+    """Number just inserted instances in order after the rows already sharing instance_fields.
+
+    Runs in the transaction of the insert: on SQLite the insert holds the write lock, elsewhere
+    the parent row is locked, so concurrent batches of one parent never get the same positions.
+    """
+    for name, value in instance_fields.items():
+        field = model._meta.get_field(name)
+        if field.is_relation:
+            list(field.related_model.objects.select_for_update().filter(pk=value).values_list('pk', flat=True))
+    last = (
+        model.objects.filter(**instance_fields)
+        .exclude(pk__in=[instance.pk for instance in instances])
+        .aggregate(last=Max(position_field))['last']
+    )
+    start = 0 if last is None else last + 1
+    for offset, instance in enumerate(instances):
+        setattr(instance, position_field, start + offset)
+    model.objects.bulk_update(instances, [position_field])
+
+def save_processed_images(model, field_name, staging_dir, position_field=None, **instance_fields):
+    """Process the staged images, store them with the field upload_to and bulk insert the rows.
+
+    With a position_field the images are numbered in upload order after the existing ones.
+    """
+    field = model._meta.get_field(field_name)
+    instances = []
+    try:
+        for path, original_name in staged_files(staging_dir):
+            instance = model(**instance_fields)
+            name = field.generate_filename(instance, original_name)
+            name = field.storage.save(name, process_image(path), max_length=field.max_length)
+            setattr(instance, field_name, name)
+            instances.append(instance)
+
+        with transaction.atomic():
+            model.objects.bulk_create(instances)
+            if position_field:
+                number_after_existing(model, instances, position_field, instance_fields)
+            if model is BoatImage:
+                # Imported here, the signal handlers import the views which import this module
+                from .signals import publish_images_change
+                publish_images_change(instance_fields['boat_id'])
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    except Exception as e:
+        # The staging directory is kept so process_staged_uploads can retry it
+        for instance in instances:
+            field.storage.delete(getattr(instance, field_name).name)
+        logger.error(f"Image processing failed for {staging_dir}: {str(e)}")
+        raise
+    return instances
+
+def _process_in_worker(*args, **kwargs):
+    """save_processed_images run by a pool thread, which closes the database connection it opened"""
+    try:
+        return save_processed_images(*args, **kwargs)
+    finally:
+        connection.close()
+
+def schedule_image_processing(model, field_name, staging_dir, position_field=None, **instance_fields):
+    """Hand the staged images to the worker pool, or process them inline when the pool is disabled"""
+    if not settings.IMAGE_PROCESSING_WORKERS:
+        return save_processed_images(model, field_name, staging_dir, position_field, **instance_fields)
+    return get_executor().submit(_process_in_worker, model, field_name, staging_dir,
+                                 position_field, **instance_fields)
@@ -0,0 +1,338 @@
+import io
+import os
+import csv
+import json
+import shutil
+import tempfile
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+import logging
+
+from .events import record_boat_change
+from .images import process_image
+from . import snapshots
+from .cdn import object_key, purge
+from .models import Boat, BoatCategory, BoatImage, AmenityItem, TechnicalDetailItem
+
+logger = logging.getLogger(__name__)
+
+BOAT_FIELDS = [
+    'title', 'description', 'price', 'length', 'width', 'year_built',
+    'engine_power', 'fuel_type', 'location', 'is_active', 'is_featured',
+]
+LIST_SEPARATOR = '|'
+
+def read_rows(data_file, file_format=None):
+    """Read the boats of a CSV or JSON file (format guessed from the file name by default)"""
+    name = getattr(data_file, 'name', '') or ''
+    file_format = file_format or ('json' if name.lower().endswith('.json') else 'csv')
+    content = data_file.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+
+    if file_format == 'json':
+        rows = json.loads(content)
+        if isinstance(rows, dict):
+            rows = rows.get('boats', [])
+        return rows
+    return list(csv.DictReader(io.StringIO(content)))
+
+def split_list(value):
+    if isinstance(value, list):
+        return value
+    return [item.strip() for item in (value or '').split(LIST_SEPARATOR) if item.strip()]
+
+def parse_amenities(row):
+    """Amenities as (category, name) pairs, from JSON {"interior": [...]} or CSV amenities_<category> columns"""
+    amenities = row.get('amenities')
+    if not isinstance(amenities, dict):
+        amenities = {category: row.get(f'amenities_{category}') for category, _ in AmenityItem.CATEGORY_CHOICES}
+    return [(category, name) for category, names in amenities.items() for name in split_list(names)]
+
+def parse_technical_details(row):
+    """Details as (category, name, value), from JSON {"electronics": [{"name", "value"}]}
+    or a CSV column of category:name=value items"""
+    details = row.get('technical_details')
+    if isinstance(details, dict):
+        return [(category, item['name'], item['value']) for category, items in details.items() for item in items]
+
+    result = []
+    for item in split_list(details):
+        try:
+            category, rest = item.split(':', 1)
+            name, value = rest.split('=', 1)
+        except ValueError:
+            raise ValidationError(f"Détail technique invalide « {item} », format attendu categorie:nom=valeur")
+        result.append((category.strip(), name.strip(), value.strip()))
+    return result
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.images = 0
+        self.errors = []
+
+    def add_error(self, row_number, message):
+        self.errors.append((row_number, message))
+
+class BoatImporter:
+    """Upserts boats by external_ref, with their amenities, technical details and photos.
+
+    Rows are validated one by one (invalid rows are reported and skipped) and
+    written in batches with bulk_create/bulk_update, one transaction per batch.
+    Photos are read from a ZIP archive and processed by a thread pool before the
+    batch transaction, so the database lock is only held for the inserts.
+    """
+
+    def __init__(self, archive=None, batch_size=200, workers=4, replace_images=False):
+        self.archive = zipfile.ZipFile(archive) if archive else None
+        # Photos are named by their path in the archive, or by their file name alone when no other member has it
+        self.archive_paths = set()
+        self.archive_members = {}
+        if self.archive:
+            for info in self.archive.infolist():
+                if not info.is_dir():
+                    self.archive_paths.add(info.filename)
+                    self.archive_members.setdefault(os.path.basename(info.filename), []).append(info.filename)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.replace_images = replace_images
+        self.categories = {category.name.lower(): category for category in BoatCategory.objects.all()}
+
+    def run(self, rows):
+        result = ImportResult()
+        batch = []
+        seen = set()
+        for row_number, row in enumerate(rows, start=1):
+            try:
+                item = self.parse(row)
+                if item['boat'].external_ref in seen:
+                    raise ValidationError(f"Référence externe « {item['boat'].external_ref} » en double dans le fichier")
+                seen.add(item['boat'].external_ref)
+                batch.append((row_number, item))
+            except ValidationError as e:
+                result.add_error(row_number, '; '.join(e.messages))
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                result.add_error(row_number, f"Ligne mal formée : {str(e)}")
+            if len(batch) >= self.batch_size:
+                self.save_batch(batch, result)
+                batch = []
+        if batch:
+            self.save_batch(batch, result)
+        result.errors.sort(key=lambda error: error[0])
+        return result
+
+    def with_new_categories(self, batch):
+        """Known categories by lower-cased name, plus the ones the batch names created.
+        Called in the batch transaction, so rejected rows and failed batches create none."""
+        categories = dict(self.categories)
+        for _, item in batch:
+            name = item['category']
+            if name and name.lower() not in categories:
+                categories[name.lower()] = BoatCategory.objects.create(name=name)
+        return categories
+
+    def parse(self, row):
+        """Validate a row, returns the unsaved boat and its related items.
+
+        Empty or missing columns are left out: a new boat gets the model defaults and an
+        existing one keeps its current values, amenities and technical details.
+        """
+        external_ref = str(row.get('external_ref') or '').strip()
+        if not external_ref:
+            raise ValidationError("Référence externe (external_ref) manquante")
+
+        values = {}
+        for field in BOAT_FIELDS:
+            value = row.get(field)
+            if isinstance(value, str):
+                value = value.strip()
+            if value not in ('', None):
+                values[field] = value
+
+        boat = Boat(external_ref=external_ref, **values)
+        # Required fields are only checked for new boats, by save_batch
+        boat.full_clean(exclude=['category'] + [field for field in BOAT_FIELDS if field not in values],
+                        validate_unique=False)
+        category_name = str(row.get('category') or '').strip() or None
+
+        amenity_categories = dict(AmenityItem.CATEGORY_CHOICES)
+        detail_categories = dict(TechnicalDetailItem.CATEGORY_CHOICES)
+        amenities = parse_amenities(row)
+        details = parse_technical_details(row)
+        for category, _ in amenities:
+            if category not in amenity_categories:
+                raise ValidationError(f"Catégorie d'équipement inconnue « {category} »")
+        for category, _, _ in details:
+            if category not in detail_categories:
+                raise ValidationError(f"Catégorie de détail technique inconnue « {category} »")
+
+        images, missing = [], []
+        for name in split_list(row.get('images')):
+            members = [name] if name in self.archive_paths else self.archive_members.get(os.path.basename(name), [])
+            if len(members) > 1:
+                raise ValidationError(f"Image « {name} » ambiguë, l'archive contient {', '.join(sorted(members))}")
+            if members:
+                images.append(members[0])
+            else:
+                missing.append(name)
+        if missing:
+            raise ValidationError(f"Images absentes de l'archive : {', '.join(missing)}")
+
+        return {'boat': boat, 'fields': list(values), 'category': category_name,
+                'amenities': amenities, 'details': details, 'images': images}
+
+    def save_batch(self, batch, result):
+        existing = Boat.objects.in_bulk([item['boat'].external_ref for _, item in batch], field_name='external_ref')
+        batch = [(row_number, item) for row_number, item in batch if self.check_new_boat(row_number, item, existing, result)]
+        if not batch:
+            return
+        with_images = set()
+        if not self.replace_images:
+            with_images = set(BoatImage.objects.filter(boat__in=existing.values()).values_list('boat_id', flat=True))
+
+        # Photos are written first, outside of the transaction
+        image_jobs = []
+        for _, item in batch:
+            current = existing.get(item['boat'].external_ref)
+            if current and current.pk in with_images:
+                # Re-importing keeps the photos already attached to the boat
+                item['images'] = []
+            image_jobs += [(item, position, name) for position, name in enumerate(item['images'])]
+
+        try:
+            stored = self.store_images(image_jobs)
+        except Exception as e:
+            logger.error(f"Boat import images failed: {str(e)}")
+            for row_number, _ in batch:
+                result.add_error(row_number, f"Erreur de traitement des images du lot : {str(e)}")
+            return
+
+        try:
+            with transaction.atomic():
+                to_create, to_update, previous = [], [], {}
+                now = timezone.now()
+                categories = self.with_new_categories(batch)
+                for _, item in batch:
+                    boat = item['boat']
+                    category = categories.get((item['category'] or '').lower())
+                    current = existing.get(boat.external_ref)
+                    if current:
+                        # Only the columns given in the row change, the others keep their current value
+                        previous[current.pk] = {'price': current.price, 'is_active': current.is_active,
+                                                'is_featured': current.is_featured}
+                        for field in item['fields']:
+                            setattr(current, field, getattr(boat, field))
+                        current.category = category or current.category
+                        current.updated_at = now
+                        item['boat'] = current
+                        to_update.append(current)
+                    else:
+                        boat.category = category
+                        to_create.append(boat)
+
+                Boat.objects.bulk_create(to_create)
+                Boat.objects.bulk_update(to_update, BOAT_FIELDS + ['category', 'updated_at'])
+
+                # Related items listed in the row replace the current ones
+                AmenityItem.objects.filter(boat__in=[item['boat'] for _, item in batch if item['amenities']]).delete()
+                TechnicalDetailItem.objects.filter(boat__in=[item['boat'] for _, item in batch if item['details']]).delete()
+                AmenityItem.objects.bulk_create([
+                    AmenityItem(boat=item['boat'], category=category, name=name)
+                    for _, item in batch for category, name in item['amenities']
+                ])
+                TechnicalDetailItem.objects.bulk_create([
+                    TechnicalDetailItem(boat=item['boat'], category=category, name=name, value=value)
+                    for _, item in batch for category, name, value in item['details']
+                ])
+
+                if stored:
+                    replaced = {id(item) for item, _, _ in image_jobs}
+                    if self.replace_images:
+                        replaced_images = BoatImage.objects.filter(
+                            boat__in=[item['boat'] for _, item in batch if id(item) in replaced]
+                        )
+                        replaced_names = list(replaced_images.values_list('image', flat=True))
+                        replaced_images.delete()
+                        # The files of the replaced photos are removed once their rows are gone for good
+                        transaction.on_commit(lambda: self.delete_files(replaced_names), robust=True)
+                    BoatImage.objects.bulk_create([
+                        BoatImage(boat=item['boat'], image=name, is_main=position == 0, position=position)
+                        for (item, position, _), name in zip(image_jobs, stored)
+                    ])
+
+                # Bulk writes send no signals, the catalog events, snapshots and CDN purges are recorded here
+                keys = set()
+                for boat in to_create:
+                    record_boat_change(None, boat)
+                    keys.update(snapshots.boat_keys(None, boat))
+                for boat in to_update:
+                    record_boat_change(previous[boat.pk], boat)
+                    keys.update(snapshots.boat_keys(previous[boat.pk], boat))
+                if keys:
+                    snapshots.schedule(*keys)
+                    purge('boats', *(object_key(Boat, key[1]) for key in keys if isinstance(key, tuple)))
+        except Exception as e:
+            for name in stored:
+                BoatImage._meta.get_field('image').storage.delete(name)
+            logger.error(f"Boat import batch failed: {str(e)}")
+            for row_number, _ in batch:
+                result.add_error(row_number, f"Erreur d'enregistrement du lot : {str(e)}")
+            return
+
+        self.categories = categories
+        result.created += len(to_create)
+        result.updated += len(to_update)
+        result.images += len(stored)
+
+    def check_new_boat(self, row_number, item, existing, result):
+        """Whether the row is an update or a new boat with every required field, reports it otherwise"""
+        if item['boat'].external_ref in existing:
+            return True
+        try:
+            if item['category'] is None:
+                raise ValidationError("Catégorie manquante")
+            item['boat'].full_clean(exclude=['category'], validate_unique=False)
+        except ValidationError as e:
+            result.add_error(row_number, '; '.join(e.messages))
+            return False
+        return True
+
+    def delete_files(self, names):
+        storage = BoatImage._meta.get_field('image').storage
+        for name in names:
+            storage.delete(name)
+
+    def store_images(self, jobs):
+        """Extract, normalize and store the photos of the jobs in parallel, returns the stored names"""
+        if not jobs:
+            return []
+        field = BoatImage._meta.get_field('image')
+        staging_dir = tempfile.mkdtemp(prefix='boat_import_')
+
+        def store(job):
+            _, _, member = job
+            path = os.path.join(staging_dir, f"{uuid.uuid4().hex}_{os.path.basename(member)}")
+            with self.archive.open(member) as source, open(path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            target_name = field.generate_filename(BoatImage(), os.path.basename(member))
+            return field.storage.save(target_name, process_image(path), max_length=field.max_length)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(store, job) for job in jobs]
+            errors = [future.exception() for future in futures if future.exception()]
+            if errors:
+                # Do not leave the photos of a failed batch behind
+                for future in futures:
+                    if not future.exception():
+                        field.storage.delete(future.result())
+                raise errors[0]
+            return [future.result() for future in futures]
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
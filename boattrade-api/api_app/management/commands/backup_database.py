@@ -1,18 +1,26 @@
 import os
-import time
-import shutil
 import datetime
 from pathlib import Path
 from django.core.management.base import BaseCommand
 from django.conf import settings
 import logging
 
+from api_app.backup import online_backup, check_integrity, compress_file
+
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = 'Backup SQLite database'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=settings.BACKUP_PAGES_PER_STEP,
+                            help='Database pages copied per backup step')
+        parser.add_argument('--pause', type=float, default=settings.BACKUP_STEP_PAUSE,
+                            help='Seconds to yield to live traffic between two steps')
+        parser.add_argument('--max-restarts', type=int, default=settings.BACKUP_MAX_RESTARTS,
+                            help='Restarts caused by writes before the database is copied in one step')
+
+    def handle(self, *args, **options):
         try:
             # Get database file path from settings
             db_path = settings.DATABASES['default']['NAME']
@@ -25,14 +33,19 @@ class Command(BaseCommand):
             # Format timestamp
             timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
             db_filename = os.path.basename(db_path)
-            backup_name = f"{db_filename}_{timestamp}.bak"
+            backup_name = f"{db_filename}_{timestamp}.bak.gz"
             backup_path = os.path.join(settings.SQLITE_BACKUP_DIR, backup_name)
+            snapshot_path = os.path.join(settings.SQLITE_BACKUP_DIR, f".{db_filename}_{timestamp}.snapshot")
             
-            # Wait for any potential database transactions to complete
-            time.sleep(1)
-            
-            # Create a copy of the database
-            shutil.copy2(db_path, backup_path)
+            try:
+                # Consistent snapshot of the live database, taken in small steps
+                online_backup(db_path, snapshot_path, pages=options['pages'], pause=options['pause'],
+                              max_restarts=options['max_restarts'])
+                check_integrity(snapshot_path)
+                compress_file(snapshot_path, backup_path)
+            finally:
+                if os.path.exists(snapshot_path):
+                    os.remove(snapshot_path)
             
             self.stdout.write(self.style.SUCCESS(f"Successfully backed up database to {backup_path}"))
             
@@ -51,7 +64,8 @@ class Command(BaseCommand):
         backup_dir = Path(settings.SQLITE_BACKUP_DIR)
         count = 0
         
-        for backup_file in backup_dir.glob('*.bak'):
+        backup_files = list(backup_dir.glob('*.bak')) + list(backup_dir.glob('*.bak.gz'))
+        for backup_file in backup_files:
             file_modified = datetime.datetime.fromtimestamp(os.path.getmtime(backup_file))
             if file_modified < cutoff_date:
                 os.remove(backup_file)
@@ -0,0 +1,115 @@
+import os
+import datetime
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+import logging
+
+from api_app.backup import online_backup, check_integrity
+from api_app.backup_store import ChunkStore, store_file_in
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Incremental, deduplicated backup of the SQLite database and MEDIA_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.BACKUP_WORKERS,
+                            help='Processes chunking the media files, threads hashing the database')
+        parser.add_argument('--pages', type=int, default=settings.BACKUP_PAGES_PER_STEP,
+                            help='Database pages copied per online backup step')
+        parser.add_argument('--pause', type=float, default=settings.BACKUP_STEP_PAUSE,
+                            help='Seconds to yield to live traffic between two backup steps')
+        parser.add_argument('--no-prune', action='store_true',
+                            help='Keep manifests older than BACKUP_RETENTION_DAYS')
+
+    def handle(self, *args, **options):
+        store = ChunkStore(settings.BACKUP_STORE_DIR, settings.BACKUP_CHUNK_SIZE_KB * 1024)
+        created_at = timezone.now()
+        previous = store.latest_manifest()
+
+        db_path = str(settings.DATABASES['default']['NAME'])
+        snapshot_path = os.path.join(store.root, f".snapshot_{created_at:%Y%m%d_%H%M%S}.sqlite3")
+
+        try:
+            online_backup(db_path, snapshot_path, pages=options['pages'], pause=options['pause'],
+                          max_restarts=settings.BACKUP_MAX_RESTARTS)
+            check_integrity(snapshot_path)
+
+            media, changed = self.scan_media(store, previous)
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                # Only the new or changed media files are chunked
+                futures = {
+                    relative_path: executor.submit(store_file_in, store.root, store.avg_chunk_size,
+                                                   os.path.join(settings.MEDIA_ROOT, relative_path))
+                    for relative_path in changed
+                }
+                # Meanwhile the snapshot is hashed in page-aligned blocks, the unchanged pages
+                # are already in the store and are not compressed again
+                database_chunks = store.store_blocks(
+                    snapshot_path, self.database_block_size(snapshot_path, store.avg_chunk_size),
+                    workers=options['workers'],
+                )
+                for relative_path, future in futures.items():
+                    media[relative_path]['chunks'] = future.result()
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Backup failed: {str(e)}"))
+            logger.error(f"Incremental backup failed: {str(e)}")
+            return
+        finally:
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+
+        name = store.write_manifest({
+            'created_at': created_at.isoformat(),
+            'database': {
+                'name': os.path.basename(db_path),
+                'chunks': database_chunks,
+            },
+            'media': media,
+        })
+        self.stdout.write(self.style.SUCCESS(
+            f"Backup {name}: {len(media)} media file(s), {len(changed)} new or changed"
+        ))
+
+        if not options['no_prune']:
+            cutoff = created_at - datetime.timedelta(days=settings.BACKUP_RETENTION_DAYS)
+            removed_manifests, removed_chunks = store.prune(cutoff)
+            if removed_manifests or removed_chunks:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Removed {removed_manifests} old backup(s) and {removed_chunks} unused chunk(s)"
+                ))
+
+    def database_block_size(self, path, avg_size):
+        """Chunk size rounded to whole database pages"""
+        connection = sqlite3.connect(path)
+        try:
+            page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        finally:
+            connection.close()
+        return max(avg_size // page_size, 1) * page_size
+
+    def scan_media(self, store, previous):
+        """Walk MEDIA_ROOT, reusing the chunks of files whose size and mtime did not change"""
+        previous_media = previous['media'] if previous else {}
+        media = {}
+        changed = []
+
+        for directory, _, filenames in os.walk(settings.MEDIA_ROOT):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                relative_path = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+                stat = os.stat(path)
+                entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'chunks': []}
+
+                known = previous_media.get(relative_path)
+                if (known and known['size'] == entry['size'] and known['mtime_ns'] == entry['mtime_ns']
+                        and all(store.has_chunk(chunk_id) for chunk_id in known['chunks'])):
+                    entry['chunks'] = known['chunks']
+                else:
+                    changed.append(relative_path)
+                media[relative_path] = entry
+
+        return media, changed
@@ -0,0 +1,260 @@
+import os
+import json
+import shutil
+import time
+import random
+import platform
+import resource
+import tempfile
+import statistics
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from api_app.models import Boat
+from api_app.synthetic import CatalogGenerator
+
+ENDPOINTS = ['boat_list', 'boat_detail', 'featured', 'search', 'sitemap']
+SEARCH_TERMS = ["Lagoon", "Oceanis", "Zodiac", "Brest", "Diesel", "famille"]
+
+class Command(BaseCommand):
+    help = ('Seed a deterministic synthetic catalog in a throwaway database and measure the API '
+            'latency, queries per request and memory at each catalog size')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--boats', type=int, nargs='+', default=[1000],
+                            help='Catalog sizes to measure, the catalog is topped up between sizes')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic catalog and request mix')
+        parser.add_argument('--requests', type=int, default=100, help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per endpoint')
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+        parser.add_argument('--server', choices=['none', 'wsgi', 'asgi'], default='none',
+                            help='Drive a local server over HTTP instead of the in-process test client, '
+                                 'asgi serves the async read views')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Concurrent HTTP clients in --server mode (the test client runs sequentially)')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['boats'])
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        test_db = None
+        if options['server'] != 'none':
+            # Server threads need their own connections, an in-memory test database is per connection
+            test_db = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False).name
+            for alias in connections:
+                if connections[alias].vendor == 'sqlite':
+                    connections[alias].settings_dict['TEST']['NAME'] = test_db
+
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # The placeholder images do not belong in the real media directory
+        media_root = tempfile.mkdtemp(prefix='benchmark_media_')
+        media_override = override_settings(MEDIA_ROOT=media_root, **(
+            # Like api_project/asgi.py, the ASGI server runs the async read views
+            {'ROOT_URLCONF': 'api_project.asgi_urls'} if options['server'] == 'asgi' else {}
+        ))
+        media_override.enable()
+        server = None
+        try:
+            if options['server'] != 'none':
+                server = self.start_server(options['server'])
+            generator = CatalogGenerator(seed=options['seed'])
+            results = {'meta': self.meta(options), 'sizes': {}}
+            if baseline:
+                differing = [key for key in ('seed', 'requests', 'concurrency', 'database')
+                             if baseline['meta'].get(key) != results['meta'][key]]
+                if differing:
+                    self.stdout.write(self.style.WARNING(
+                        f"The baseline was run with a different {', '.join(differing)}, numbers are not comparable"
+                    ))
+                if baseline['meta'].get('server') != options['server']:
+                    # e.g. --server asgi --compare wsgi.json, sync WSGI against async ASGI
+                    self.stdout.write(f"Comparing --server {options['server']} with a "
+                                      f"--server {baseline['meta'].get('server')} baseline")
+            for size in sizes:
+                start = time.perf_counter()
+                generator.generate(size - generator.existing_count())
+                self.stdout.write(f"Seeded {size} boats in {time.perf_counter() - start:.1f}s")
+                results['sizes'][str(size)] = self.measure(options, server)
+                self.report(size, results['sizes'][str(size)], baseline)
+        finally:
+            if server:
+                server.stop()
+            teardown_databases(old_config, verbosity=0)
+            media_override.disable()
+            shutil.rmtree(media_root, ignore_errors=True)
+            if test_db:
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(test_db + suffix):
+                        os.remove(test_db + suffix)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def meta(self, options):
+        return {
+            'seed': options['seed'],
+            'requests': options['requests'],
+            'server': options['server'],
+            'concurrency': options['concurrency'] if options['server'] != 'none' else 1,
+            'database': connections['default'].vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+    def paths(self, endpoint, count, rng):
+        """Request paths of an endpoint, random boats and terms drawn from a seeded generator"""
+        if endpoint == 'boat_detail':
+            ids = list(Boat.objects.filter(is_active=True).values_list('pk', flat=True))
+            return [f'/boats/{rng.choice(ids)}/' for _ in range(count)]
+        if endpoint == 'search':
+            return [f'/boats/?search={rng.choice(SEARCH_TERMS)}' for _ in range(count)]
+        path = {'boat_list': '/boats/', 'featured': '/featured-boats/', 'sitemap': '/sitemap.xml'}[endpoint]
+        return [path] * count
+
+    def measure(self, options, server):
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        results = {}
+        for endpoint in options['endpoints']:
+            rng = random.Random(f"{options['seed']}-{endpoint}")
+            for path in self.paths(endpoint, options['warmup'], rng):
+                client.get(path, secure=True)
+
+            paths = self.paths(endpoint, options['requests'], rng)
+            # Queries are counted in-process, a server would run them in other threads
+            query_counts, latencies, errors = [], [], 0
+            start = time.perf_counter()
+            for path in paths if server is None else paths[:5]:
+                queries = []
+                with connections['default'].execute_wrapper(lambda execute, *args: queries.append(1) or execute(*args)):
+                    start = time.perf_counter()
+                    response = client.get(path, secure=True)
+                    latency = time.perf_counter() - start
+                query_counts.append(len(queries))
+                if server is None:
+                    latencies.append(latency)
+                    errors += response.status_code != 200
+
+            if server is not None:
+                start = time.perf_counter()
+                latencies, errors = server.run(paths, options['concurrency'])
+            results[endpoint] = self.summary(latencies, query_counts, errors, time.perf_counter() - start)
+        # Linux reports kilobytes
+        results['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        return results
+
+    def summary(self, latencies, query_counts, errors, elapsed):
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'p50_ms': round(percentiles[49] * 1000, 2),
+            'p95_ms': round(percentiles[94] * 1000, 2),
+            'p99_ms': round(percentiles[98] * 1000, 2),
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 2),
+            'queries_per_request': round(statistics.fmean(query_counts), 1),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+        }
+
+    def report(self, size, results, baseline):
+        self.stdout.write(self.style.SUCCESS(f"{size} boats (peak RSS {results['peak_rss_mb']} MB)"))
+        previous = (baseline or {}).get('sizes', {}).get(str(size), {})
+        for endpoint, numbers in results.items():
+            if endpoint == 'peak_rss_mb':
+                continue
+            line = (f"  {endpoint:<12} p50 {numbers['p50_ms']:>8.1f} ms  p95 {numbers['p95_ms']:>8.1f} ms  "
+                    f"p99 {numbers['p99_ms']:>8.1f} ms  queries {numbers['queries_per_request']:>6.1f}  "
+                    f"{numbers['throughput_rps']:>7.1f} req/s  errors {numbers['errors']}")
+            if endpoint in previous and previous[endpoint]['p95_ms']:
+                change = (numbers['p95_ms'] - previous[endpoint]['p95_ms']) / previous[endpoint]['p95_ms'] * 100
+                line += f"  p95 {change:+.0f}% vs baseline"
+                baseline_rps = previous[endpoint].get('throughput_rps')
+                if baseline_rps:
+                    line += f", throughput {(numbers['throughput_rps'] - baseline_rps) / baseline_rps * 100:+.0f}%"
+            self.stdout.write(line)
+
+    def start_server(self, kind):
+        if kind == 'asgi':
+            try:
+                import uvicorn
+            except ImportError:
+                raise CommandError("--server asgi needs uvicorn (pip install uvicorn)")
+            from django.core.asgi import get_asgi_application
+            return LocalServer.asgi(uvicorn, get_asgi_application())
+        from django.core.wsgi import get_wsgi_application
+        return LocalServer.wsgi(get_wsgi_application())
+
+class LocalServer:
+    """An HTTP server on a random local port running in a background thread"""
+
+    def __init__(self, port, stop):
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.stop = stop
+
+    @classmethod
+    def wsgi(cls, application):
+        from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        httpd = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=False)
+        httpd.set_app(application)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+        def stop():
+            httpd.shutdown()
+            httpd.server_close()
+        return cls(httpd.server_address[1], stop)
+
+    @classmethod
+    def asgi(cls, uvicorn, application):
+        import socket
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        server = uvicorn.Server(uvicorn.Config(application, log_level='warning', lifespan='off'))
+        thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        def stop():
+            server.should_exit = True
+            thread.join()
+        return cls(sock.getsockname()[1], stop)
+
+    def get(self, path):
+        request = urllib.request.Request(self.base_url + path, headers={
+            'Host': settings.ALLOWED_HOSTS[0],
+            # Counts as HTTPS behind SECURE_PROXY_SSL_HEADER, no redirect outside DEBUG
+            'X-Forwarded-Proto': 'https',
+        })
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                ok = response.status == 200
+        except urllib.error.URLError:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    def run(self, paths, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(self.get, paths))
+        return [latency for latency, _ in results], sum(not ok for _, ok in results)
@@ -0,0 +1,76 @@
+import time
+import threading
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.test import Client
+from django.urls import resolve
+
+from api_app.models import Boat
+
+ENDPOINTS = ['/boats/', '/categories/', '/blog/', '/featured-boats/', '/sitemap.xml']
+
+class Command(BaseCommand):
+    help = 'Compare read throughput with and without the per-request transaction on the read-only endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent client threads')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds measured per mode')
+        parser.add_argument('--no-writer', action='store_true',
+                            help='Do not run a concurrent writer during the measurement')
+
+    def handle(self, *args, **options):
+        if not Boat.objects.exists():
+            self.stdout.write(self.style.WARNING("No boats in the database, results will not be representative"))
+
+        views = [resolve(path).func for path in ENDPOINTS]
+        opted_out = {view: getattr(view, '_non_atomic_requests', set()) for view in views}
+
+        for mode in ('atomic', 'non-atomic'):
+            # Simulate the previous behaviour by removing the opt-out from the views
+            for view, aliases in opted_out.items():
+                view._non_atomic_requests = set() if mode == 'atomic' else aliases
+            requests, errors = self.run(options)
+            self.stdout.write(
+                f"{mode:<12} requests/s: {requests / options['duration']:>9.1f}   errors: {errors}"
+            )
+
+        for view, aliases in opted_out.items():
+            view._non_atomic_requests = aliases
+
+    def run(self, options):
+        result = {'requests': 0, 'errors': 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+        host = settings.ALLOWED_HOSTS[0]
+
+        def client_thread(offset):
+            client = Client(HTTP_HOST=host)
+            index = offset
+            while not stop.is_set():
+                response = client.get(ENDPOINTS[index % len(ENDPOINTS)], secure=True)
+                index += 1
+                with lock:
+                    result['requests' if response.status_code == 200 else 'errors'] += 1
+            connections.close_all()
+
+        def writer_thread():
+            boat = Boat.objects.order_by('pk').first()
+            while not stop.is_set() and boat:
+                # Short write transactions, like admin edits
+                with transaction.atomic():
+                    Boat.objects.filter(pk=boat.pk).update(is_featured=F('is_featured'))
+                time.sleep(0.01)
+            connections.close_all()
+
+        threads = [threading.Thread(target=client_thread, args=(i,)) for i in range(options['threads'])]
+        if not options['no_writer']:
+            threads.append(threading.Thread(target=writer_thread))
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return result['requests'], result['errors']
@@ -0,0 +1,106 @@
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+class Command(BaseCommand):
+    help = 'Compare concurrent read throughput of the default and production SQLite profiles while a writer is active'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help='Number of concurrent reader threads')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds measured per profile')
+        parser.add_argument('--rows', type=int, default=5000, help='Rows in the benchmark table')
+
+    def handle(self, *args, **options):
+        profiles = [
+            # Django defaults: rollback journal, one connection per request
+            ('default', {}, True),
+            ('production', settings.SQLITE_PRAGMAS, False),
+        ]
+        for name, pragmas, reconnect in profiles:
+            result = self.run_profile(pragmas, reconnect, options)
+            self.stdout.write(
+                f"{name:<12} reads/s: {result['reads'] / options['duration']:>10.1f}   "
+                f"writes/s: {result['writes'] / options['duration']:>8.1f}   "
+                f"lock errors: {result['errors']}"
+            )
+
+    def connect(self, path, pragmas):
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+        for pragma, value in pragmas.items():
+            connection.execute(f"PRAGMA {pragma}={value}")
+        return connection
+
+    def run_profile(self, pragmas, reconnect, options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'benchmark.sqlite3')
+            connection = self.connect(path, pragmas)
+            connection.execute(
+                "CREATE TABLE boat (id INTEGER PRIMARY KEY, title TEXT, price REAL, created_at REAL)"
+            )
+            connection.executemany(
+                "INSERT INTO boat (title, price, created_at) VALUES (?, ?, ?)",
+                ((f"Bateau {i}", i * 100.0, time.time()) for i in range(options['rows'])),
+            )
+            connection.execute("CREATE INDEX boat_created_at ON boat (created_at)")
+            connection.close()
+
+            result = {'reads': 0, 'writes': 0, 'errors': 0}
+            lock = threading.Lock()
+            stop = threading.Event()
+
+            def count(key):
+                with lock:
+                    result[key] += 1
+
+            def writer():
+                connection = self.connect(path, pragmas)
+                while not stop.is_set():
+                    try:
+                        # Same shape as an admin save: a short transaction touching a few rows
+                        connection.execute("BEGIN IMMEDIATE")
+                        connection.execute(
+                            "INSERT INTO boat (title, price, created_at) VALUES ('Nouveau', 1000, ?)", (time.time(),)
+                        )
+                        connection.execute("UPDATE boat SET price = price + 1 WHERE id % 50 = 0")
+                        connection.execute("COMMIT")
+                        count('writes')
+                    except sqlite3.OperationalError:
+                        if connection.in_transaction:
+                            connection.execute("ROLLBACK")
+                        count('errors')
+                connection.close()
+
+            def reader():
+                connection = None if reconnect else self.connect(path, pragmas)
+                while not stop.is_set():
+                    try:
+                        # Without persistent connections every request pays for the connection setup
+                        if reconnect:
+                            connection = self.connect(path, pragmas)
+                        connection.execute(
+                            "SELECT id, title, price FROM boat ORDER BY created_at DESC LIMIT 20"
+                        ).fetchall()
+                        connection.execute("SELECT COUNT(*) FROM boat WHERE price > 5000").fetchone()
+                        count('reads')
+                    except sqlite3.OperationalError:
+                        count('errors')
+                    finally:
+                        if reconnect and connection is not None:
+                            connection.close()
+                if not reconnect:
+                    connection.close()
+
+            threads = [threading.Thread(target=writer)]
+            threads += [threading.Thread(target=reader) for _ in range(options['readers'])]
+            for thread in threads:
+                thread.start()
+            time.sleep(options['duration'])
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+            return result
@@ -0,0 +1,72 @@
+import re
+import itertools
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api_app.models import Boat, BoatCategory
+from api_app.views import BoatViewSet
+
+# Full table scans in SQLite ("SCAN t" without an index) and Postgres plans
+FULL_SCAN_PATTERNS = [
+    re.compile(rf'\bSCAN {Boat._meta.db_table}\b(?! USING)'),
+    re.compile(rf'Seq Scan on {Boat._meta.db_table}\b'),
+]
+
+class Command(BaseCommand):
+    help = "Print the query plan of BoatViewSet for each supported filter combination"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-filters', type=int, default=2,
+                            help='Largest number of filters combined in one query')
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Exit with an error when a query falls back to a full table scan')
+
+    def sample_filters(self):
+        category = BoatCategory.objects.order_by('pk').values_list('pk', flat=True).first() or 1
+        return {
+            'category': category,
+            'min_price': 10000,
+            'max_price': 500000,
+            'min_year': 1990,
+            'max_year': 2020,
+            'featured': 'true',
+            'search': 'voilier',
+        }
+
+    def queryset_for(self, params):
+        request = Request(APIRequestFactory().get('/boats/', params))
+        view = BoatViewSet(request=request, action='list', format_kwarg=None, kwargs={})
+        return view.get_queryset()
+
+    def handle(self, *args, **options):
+        filters = self.sample_filters()
+        names = list(filters)
+        combinations = [()]
+        for size in range(1, options['max_filters'] + 1):
+            combinations += itertools.combinations(names, size)
+
+        scans = []
+        for combination in combinations:
+            params = {name: filters[name] for name in combination}
+            plan = self.queryset_for(params).explain()
+            full_scan = any(pattern.search(plan) for pattern in FULL_SCAN_PATTERNS)
+            # LIKE '%...%' cannot use a b-tree index, a scan is expected for text search
+            expected = 'search' in combination
+
+            label = ', '.join(combination) or '(no filter)'
+            if full_scan and not expected:
+                scans.append(label)
+                self.stdout.write(self.style.ERROR(f"{label}: FULL TABLE SCAN"))
+            else:
+                self.stdout.write(self.style.SUCCESS(label))
+            for line in plan.splitlines():
+                self.stdout.write(f"    {line}")
+
+        if scans:
+            message = f"{len(scans)} filter combination(s) scan the whole boat table: {'; '.join(scans)}"
+            if options['fail_on_scan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every filter combination uses an index"))
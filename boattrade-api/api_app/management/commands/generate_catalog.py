@@ -0,0 +1,123 @@
+import io
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from PIL import Image
+
+from api_app.analytics import rebuild_rollups
+from api_app.models import Boat, BoatImage, SellRequest, sharded_upload_path
+from api_app.synthetic import REF_PREFIX, CatalogGenerator
+
+# Placeholder colors, each generated photo is a hard link to one of them
+PLACEHOLDER_COLORS = [(30, 90, 140), (200, 200, 190), (20, 60, 90), (120, 160, 190), (230, 220, 200), (60, 110, 80)]
+
+class HardLinkedImages:
+    """Writes the placeholder photos once, then gives every image row its own file name
+    hard-linked to a placeholder: the media tree looks real without the disk usage"""
+
+    def __init__(self, storage, seed):
+        self.storage = storage
+        self.seed = seed
+        self.created_dirs = set()
+        self.sources = []
+        for number, color in enumerate(PLACEHOLDER_COLORS):
+            name = f"boats/synthetic/placeholder-{number}.jpg"
+            if not storage.exists(name):
+                output = io.BytesIO()
+                Image.new('RGB', (640, 480), color).save(output, format='JPEG', quality=70)
+                os.makedirs(os.path.dirname(storage.path(name)), exist_ok=True)
+                with open(storage.path(name), 'wb') as f:
+                    f.write(output.getvalue())
+            self.sources.append(storage.path(name))
+
+    def __call__(self, index, position):
+        name = sharded_upload_path('boats/', f"syn-{self.seed}-{index:07d}-{position}.jpg")
+        path = self.storage.path(name)
+        directory = os.path.dirname(path)
+        if directory not in self.created_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self.created_dirs.add(directory)
+        try:
+            os.link(self.sources[(index + position) % len(self.sources)], path)
+        except FileExistsError:
+            pass
+        return name
+
+class Command(BaseCommand):
+    help = 'Generate a large synthetic French-language catalog (boats, photos, equipment, leads) for load rehearsals'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--boats', type=int, required=True,
+                            help='Size of the synthetic catalog, only the missing boats are generated')
+        parser.add_argument('--seed', type=int, default=0, help='Catalog seed, each seed is a separate catalog')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Boats inserted per transaction')
+        parser.add_argument('--images-per-boat', type=int, default=3)
+        parser.add_argument('--inquiries-per-boat', type=int, default=2, help='Average number of inquiries')
+        parser.add_argument('--shared-images', action='store_true',
+                            help='Point every image row at one placeholder instead of hard-linked files')
+        parser.add_argument('--reset', action='store_true',
+                            help='Delete the synthetic boats of this seed and their photos first')
+        parser.add_argument('--skip-rollups', action='store_true',
+                            help='Do not rebuild the lead rollups afterwards')
+        parser.add_argument('--force', action='store_true',
+                            help='Allow generating data when DEBUG is off')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("DEBUG is off, this may be a production database. Pass --force to generate anyway.")
+
+        storage = BoatImage._meta.get_field('image').storage
+        image_names = None
+        if not options['shared_images']:
+            try:
+                storage.path('boats/')
+                image_names = HardLinkedImages(storage, options['seed'])
+            except NotImplementedError:
+                self.stdout.write(self.style.WARNING("The media storage has no local path, photos are shared instead"))
+
+        if options['reset']:
+            self.reset(options['seed'], storage)
+
+        generator = CatalogGenerator(
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            images_per_boat=options['images_per_boat'],
+            inquiries_per_boat=options['inquiries_per_boat'],
+            image_names=image_names,
+        )
+        existing = generator.existing_count()
+        missing = options['boats'] - existing
+        if missing <= 0:
+            self.stdout.write(self.style.SUCCESS(f"The catalog already has {existing} synthetic boats"))
+            return
+
+        start = time.perf_counter()
+        counts = generator.generate(missing, start=existing, progress=lambda done, total: self.stdout.write(
+            f"  {done}/{total} boats ({time.perf_counter() - start:.1f}s)"
+        ))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {counts['boats']} boats in {elapsed:.1f}s ({counts['boats'] / elapsed:.0f} boats/s): "
+            + ', '.join(f"{count} {name}" for name, count in counts.items() if name != 'boats')
+        ))
+
+        if not options['skip_rollups']:
+            # Rows were inserted without signals, the lead rollups are recomputed once
+            inquiries, sell_requests = rebuild_rollups()
+            self.stdout.write(f"Lead rollups rebuilt ({inquiries} inquiries, {sell_requests} sell requests)")
+
+    def reset(self, seed, storage):
+        prefix = f"{REF_PREFIX}-{seed}-"
+        boats = Boat.objects.filter(external_ref__startswith=prefix)
+        for name in BoatImage.objects.filter(boat__in=boats).values_list('image', flat=True).iterator():
+            # Only the generated links, never a placeholder shared with other seeds
+            if os.path.basename(name).startswith(f"syn-{seed}-"):
+                storage.delete(name)
+        deleted, _ = boats.delete()
+        # Sell requests have no link to the boats, those of the seed carry its marker in their comment
+        sell_requests, _ = SellRequest.objects.filter(
+            comment__endswith=CatalogGenerator(seed=seed).sell_request_marker(), email__endswith='@example.com'
+        ).delete()
+        deleted += sell_requests
+        self.stdout.write(f"Deleted {deleted} synthetic rows of seed {seed}")
@@ -0,0 +1,12 @@
+from django.core.files import File
+
+from api_app.management.commands.shard_media import Command as ShardMediaCommand
+from api_app.storage import hashed_name
+
+class Command(ShardMediaCommand):
+    help = 'Rename the media files stored before content hashing to their hashed name and rewrite their stored paths'
+
+    def target_name(self, field, name, path):
+        # Names already carrying the digest of their content are kept
+        with open(path, 'rb') as content:
+            return hashed_name(name, File(content))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api_app.importers import BoatImporter, read_rows
+
+class Command(BaseCommand):
+    help = 'Import or update boats from a CSV/JSON file and a ZIP archive of photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('data_file', help='CSV or JSON file, one boat per row identified by external_ref')
+        parser.add_argument('--images', help='ZIP archive containing the photos named in the images column')
+        parser.add_argument('--format', choices=['csv', 'json'], help='File format (default: from the extension)')
+        parser.add_argument('--batch-size', type=int, default=200, help='Boats written per transaction')
+        parser.add_argument('--workers', type=int, default=4, help='Threads extracting and resizing photos')
+        parser.add_argument('--replace-images', action='store_true',
+                            help='Replace the photos of boats that already have some')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['data_file'], 'rb') as data_file:
+                rows = read_rows(data_file, options['format'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {options['data_file']}: {str(e)}")
+
+        importer = BoatImporter(
+            archive=options['images'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            replace_images=options['replace_images'],
+        )
+        result = importer.run(rows)
+
+        for row_number, message in result.errors:
+            self.stdout.write(self.style.ERROR(f"Row {row_number}: {message}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"{result.created} boat(s) created, {result.updated} updated, {result.images} photo(s) imported, "
+            f"{len(result.errors)} row(s) rejected"
+        ))
@@ -0,0 +1,55 @@
+import os
+import time
+import shutil
+from django.core.management.base import BaseCommand
+from django.conf import settings
+import logging
+
+from api_app.images import save_processed_images
+from api_app.models import Boat, BoatImage, SellRequest, SellRequestImage
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Process uploads left in the staging directory (e.g. after a worker restart)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=30,
+                            help='Only process staging directories older than this many minutes')
+
+    def handle(self, *args, **options):
+        staging_root = settings.UPLOAD_STAGING_DIR
+        if not os.path.isdir(staging_root):
+            return
+
+        cutoff = time.time() - options['min_age'] * 60
+        for name in sorted(os.listdir(staging_root)):
+            staging_dir = os.path.join(staging_root, name)
+            if not os.path.isdir(staging_dir) or os.path.getmtime(staging_dir) > cutoff:
+                continue
+
+            # Directories are named <prefix>_<id>_<uuid>
+            prefix, _, _ = name.rpartition('_')
+            target = self.target_for(prefix)
+            if target is None:
+                continue
+            parent_model, model, instance_fields, position_field = target
+
+            if not parent_model.objects.filter(pk=next(iter(instance_fields.values()))).exists():
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                self.stdout.write(self.style.WARNING(f"Removed {name}: {parent_model._meta.verbose_name} no longer exists"))
+                continue
+
+            try:
+                images = save_processed_images(model, 'image', staging_dir, position_field, **instance_fields)
+                self.stdout.write(self.style.SUCCESS(f"Processed {len(images)} image(s) from {name}"))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Processing {name} failed: {str(e)}"))
+
+    def target_for(self, prefix):
+        """Parent model, image model, image fields and position field of a staging prefix"""
+        if prefix.startswith('sell_request_'):
+            return SellRequest, SellRequestImage, {'sell_request_id': prefix[len('sell_request_'):]}, None
+        if prefix.startswith('boat_'):
+            return Boat, BoatImage, {'boat_id': prefix[len('boat_'):]}, 'position'
+        return None
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api_app.snapshots import publish_all
+
+class Command(BaseCommand):
+    help = 'Write the static JSON snapshots of the public catalog under SNAPSHOT_DIR'
+
+    def handle(self, *args, **options):
+        if not settings.SNAPSHOT_DIR:
+            raise CommandError("SNAPSHOT_DIR is not set")
+        written = publish_all()
+        self.stdout.write(self.style.SUCCESS(f"{written} snapshot(s) written or removed in {settings.SNAPSHOT_DIR}"))
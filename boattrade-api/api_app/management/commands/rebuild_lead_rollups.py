@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api_app.analytics import rebuild_rollups
+
+class Command(BaseCommand):
+    help = 'Recompute the inquiry and sell request rollups of the admin dashboard from the full history'
+
+    def handle(self, *args, **options):
+        inquiries, sell_requests = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rollups rebuilt from {inquiries} inquiry(ies) and {sell_requests} sell request(s)"
+        ))
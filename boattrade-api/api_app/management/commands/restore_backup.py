@@ -0,0 +1,67 @@
+import os
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from api_app.backup import check_integrity
+from api_app.backup_store import ChunkStore
+
+class Command(BaseCommand):
+    help = 'Rebuild the database and media files of an incremental backup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--list', action='store_true', help='List the available backups')
+        parser.add_argument('--backup', help='Name of the backup to restore (default: the latest)')
+        parser.add_argument('--at', help='Restore the last backup taken at or before this ISO date/time')
+        parser.add_argument('--database', help='Path where the database file is written')
+        parser.add_argument('--media', help='Directory where the media files are written')
+
+    def handle(self, *args, **options):
+        store = ChunkStore(settings.BACKUP_STORE_DIR)
+
+        if options['list']:
+            for name in store.manifest_names():
+                manifest = store.read_manifest(name)
+                self.stdout.write(f"{name}  {manifest['created_at']}  {len(manifest['media'])} media file(s)")
+            return
+
+        if not options['database'] and not options['media']:
+            raise CommandError("Give --database and/or --media as restore targets")
+        for target in (options['database'], options['media']):
+            # Never overwrite the live data by accident
+            if target and os.path.abspath(target) in (
+                os.path.abspath(settings.DATABASES['default']['NAME']), os.path.abspath(settings.MEDIA_ROOT)
+            ):
+                raise CommandError(f"Refusing to restore over the live {target}, restore elsewhere and swap")
+
+        manifest = self.find_manifest(store, options)
+
+        if options['database']:
+            store.restore_file(manifest['database']['chunks'], options['database'])
+            check_integrity(options['database'])
+            self.stdout.write(self.style.SUCCESS(f"Database restored to {options['database']}"))
+
+        if options['media']:
+            for relative_path, entry in manifest['media'].items():
+                target_path = os.path.join(options['media'], *relative_path.split('/'))
+                store.restore_file(entry['chunks'], target_path, mtime_ns=entry['mtime_ns'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{len(manifest['media'])} media file(s) restored to {options['media']}"
+            ))
+
+    def find_manifest(self, store, options):
+        if options['backup']:
+            if options['backup'] not in store.manifest_names():
+                raise CommandError(f"Backup {options['backup']} not found")
+            return store.read_manifest(options['backup'])
+
+        before = None
+        if options['at']:
+            before = datetime.datetime.fromisoformat(options['at'])
+            if before.tzinfo is None:
+                before = before.replace(tzinfo=datetime.timezone.utc)
+
+        manifest = store.latest_manifest(before)
+        if manifest is None:
+            raise CommandError("No backup available")
+        return manifest
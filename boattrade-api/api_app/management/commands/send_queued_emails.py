@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+import logging
+
+from api_app.emails import deliver_queued_emails
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Deliver the notification emails waiting in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Maximum number of emails sent over one connection (default: EMAIL_OUTBOX_BATCH_SIZE)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and poll the outbox instead of exiting after one pass')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between two polls in --loop mode')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                # Drain everything that is due before waiting for the next poll
+                while True:
+                    sent, failed = deliver_queued_emails(options['batch_size'])
+                    if sent or failed:
+                        self.stdout.write(f"Sent {sent} email(s), {failed} failure(s)")
+                    if not sent:
+                        break
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Outbox delivery failed: {str(e)}"))
+                logger.error(f"Outbox delivery failed: {str(e)}")
+
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,99 @@
+import os
+import datetime
+from django.core.management.base import BaseCommand
+from django.apps import apps
+from django.db import models, transaction
+from django.utils import timezone
+import logging
+
+from api_app.models import ShardedUploadTo, sharded_upload_path
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Move existing media files into the sharded upload layout and rewrite their stored paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of files moved per database transaction')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only print the moves that would be made')
+
+    def handle(self, *args, **options):
+        moved = 0
+        for model, field in self.sharded_fields():
+            moved += self.shard_field(model, field, options['batch_size'], options['dry_run'])
+
+        verb = "Would move" if options['dry_run'] else "Moved"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} file(s)"))
+
+    def sharded_fields(self):
+        """Yield every (model, field) pair of api_app using a sharded upload_to"""
+        for model in apps.get_app_config('api_app').get_models():
+            for field in model._meta.get_fields():
+                if isinstance(field, models.FileField) and isinstance(field.upload_to, ShardedUploadTo):
+                    yield model, field
+
+    def target_name(self, field, name, path):
+        """Compute where a stored file belongs under the current sharding strategy"""
+        # Files uploaded before sharding have no upload date, use their modification time instead
+        when = datetime.datetime.fromtimestamp(os.path.getmtime(path), tz=datetime.timezone.utc)
+        return sharded_upload_path(field.upload_to.prefix, name, when=timezone.localtime(when))
+
+    def shard_field(self, model, field, batch_size, dry_run):
+        storage = field.storage
+        queryset = (
+            model.objects.exclude(**{field.name: ''})
+            .exclude(**{f'{field.name}__isnull': True})
+            .order_by('pk')
+            .values_list('pk', field.name)
+        )
+
+        moved = 0
+        batch = []
+        for pk, name in queryset.iterator(chunk_size=batch_size):
+            path = storage.path(name)
+            if not os.path.exists(path):
+                self.stdout.write(self.style.WARNING(f"Missing file for {model.__name__} #{pk}: {name}"))
+                continue
+
+            target = self.target_name(field, name, path)
+            if target == name:
+                continue
+
+            batch.append((pk, name, target))
+            if len(batch) >= batch_size:
+                moved += self.move_batch(model, field, batch, dry_run)
+                batch = []
+
+        if batch:
+            moved += self.move_batch(model, field, batch, dry_run)
+        return moved
+
+    def move_batch(self, model, field, batch, dry_run):
+        """Move a batch of files and rewrite their paths, undoing the moves if the database update fails"""
+        storage = field.storage
+
+        if dry_run:
+            for pk, name, target in batch:
+                self.stdout.write(f"{model.__name__} #{pk}: {name} -> {target}")
+            return len(batch)
+
+        done = []
+        try:
+            with transaction.atomic():
+                for pk, name, target in batch:
+                    # Another file may already use the target name, let the storage pick a free one
+                    target = storage.get_available_name(target)
+                    target_path = storage.path(target)
+                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                    os.replace(storage.path(name), target_path)
+                    done.append((storage.path(name), target_path))
+                    model.objects.filter(pk=pk).update(**{field.name: target})
+        except Exception as e:
+            for source_path, target_path in reversed(done):
+                os.replace(target_path, source_path)
+            logger.error(f"Media sharding failed for {model.__name__}.{field.name}: {str(e)}")
+            raise
+
+        return len(done)
@@ -0,0 +1,45 @@
+import time
+from django.core.management.base import BaseCommand
+from django.conf import settings
+import logging
+
+from api_app.backup import online_backup
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database into the SQLite read replicas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=settings.BACKUP_PAGES_PER_STEP,
+                            help='Database pages copied per backup step')
+        parser.add_argument('--pause', type=float, default=settings.BACKUP_STEP_PAUSE,
+                            help='Seconds to yield to live traffic between two steps')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and refresh the replicas every --interval seconds')
+        parser.add_argument('--interval', type=float, default=10,
+                            help='Seconds between two refreshes in --loop mode')
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            self.stdout.write(self.style.WARNING("The primary is not SQLite, replication is left to the database server"))
+            return
+
+        while True:
+            for alias in settings.DATABASE_REPLICAS:
+                replica = settings.DATABASES[alias]
+                if replica['ENGINE'] != 'django.db.backends.sqlite3':
+                    continue
+                try:
+                    # The backup API writes the replica in one transaction, readers keep
+                    # seeing the previous copy until it is complete
+                    online_backup(primary['NAME'], replica['NAME'], pages=options['pages'], pause=options['pause'])
+                    self.stdout.write(self.style.SUCCESS(f"Replica {alias} synced"))
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"Syncing replica {alias} failed: {str(e)}"))
+                    logger.error(f"Syncing replica {alias} failed: {str(e)}")
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
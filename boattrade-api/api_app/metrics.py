@@ -0,0 +1,227 @@
+import atexit
+import bisect
+import glob
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Metrics by name, in declaration order
+_metrics = {}
+_lock = threading.Lock()
+_flusher = None
+# File of this process in METRICS_MULTIPROC_DIR, unique even when a pid is reused
+_process_file = f"metrics_{os.getpid()}_{uuid.uuid4().hex[:8]}.json"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HTTP_METHODS = {'GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+class Metric:
+    """A named metric whose values are kept per tuple of label values in the process"""
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        _metrics[name] = self
+
+    def merge(self, current, value):
+        raise NotImplementedError
+
+    def samples(self, values):
+        raise NotImplementedError
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+        _start_flusher()
+
+    def merge(self, current, value):
+        return (current or 0) + value
+
+    def samples(self, values):
+        for labels, value in values.items():
+            yield f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+
+class Histogram(Metric):
+    """Observations counted in buckets, stored as [count per bucket..., count above the last bucket, sum]"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+        _start_flusher()
+
+    def merge(self, current, value):
+        if len(value) != len(self.buckets) + 2:
+            # Written by a process running other buckets, e.g. before a deploy
+            return current
+        if current is None:
+            return list(value)
+        return [a + b for a, b in zip(current, value)]
+
+    def samples(self, values):
+        for labels, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts[:-1]):
+                cumulative += count
+                le = format_labels(self.labels + ('le',), labels + (format_value(bound),))
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(counts[-1])}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}"
+
+class CallbackGauge(Metric):
+    """Gauge read when the metrics are scraped: `callback` returns {label values: value}"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels, callback):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def samples(self, values):
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error(f"Reading the {self.name} gauge failed: {str(e)}")
+            return
+        for labels, value in values.items():
+            yield f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+def snapshot():
+    """Values of the counters and histograms of this process, as JSON-compatible lists"""
+    with _lock:
+        return {
+            metric.name: [[list(labels), value if not isinstance(value, list) else list(value)]
+                          for labels, value in metric.values.items()]
+            for metric in _metrics.values() if metric.values
+        }
+
+def write_process_file():
+    """Publish the values of this process for the other workers, replaced atomically"""
+    directory = settings.METRICS_MULTIPROC_DIR
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _process_file)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+def collect():
+    """Counter and histogram values by metric name and label values. With METRICS_MULTIPROC_DIR
+    they are summed over the files of every worker process, dead ones included so that
+    counters never go backwards: empty the directory when the service is restarted."""
+    if not settings.METRICS_MULTIPROC_DIR:
+        paths = []
+        data = [snapshot()]
+    else:
+        write_process_file()
+        paths = glob.glob(os.path.join(settings.METRICS_MULTIPROC_DIR, 'metrics_*.json'))
+        data = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                data.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+
+    totals = {}
+    for values in data:
+        for name, entries in values.items():
+            metric = _metrics.get(name)
+            if metric is None:
+                continue
+            merged = totals.setdefault(name, {})
+            for labels, value in entries:
+                labels = tuple(labels)
+                merged[labels] = metric.merge(merged.get(labels), value)
+    return totals
+
+def exposition():
+    """Every metric in the Prometheus text exposition format"""
+    values = collect()
+    lines = []
+    for metric in _metrics.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples(values.get(metric.name, {})))
+    return '\n'.join(lines) + '\n'
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None or not settings.METRICS_MULTIPROC_DIR:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='metrics', daemon=True)
+            _flusher.start()
+            atexit.register(write_process_file)
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            write_process_file()
+        except Exception as e:
+            logger.error(f"Writing the metrics file failed: {str(e)}")
+
+def record_request(method, view, status, duration, queries):
+    """Count a handled request, `queries` maps database aliases to the queries it ran"""
+    method = method if method in HTTP_METHODS else 'other'
+    REQUESTS.inc((method, view, str(status)))
+    REQUEST_DURATION.observe(duration, (method, view))
+    REQUEST_QUERIES.observe(sum(queries.values()), (view,))
+    for alias, count in queries.items():
+        if count:
+            DB_QUERIES.inc((alias,), count)
+
+def media_disk_bytes():
+    from .models import get_storage_info
+    info = get_storage_info()
+    return {(kind,): int(info[f'{kind}_gb'] * 1024 ** 3) for kind in ('total', 'used', 'free')}
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests handled, by view and status', ['method', 'view', 'status'])
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time spent handling requests', ['method', 'view'])
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'Database queries run per request', ['view'],
+                            buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+DB_QUERIES = Counter('db_queries_total', 'Database queries run by requests', ['alias'])
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups, by cache and hit or miss', ['cache', 'result'])
+EMAILS_SENT = Counter('emails_sent_total', 'Emails of the outbox delivered')
+EMAIL_FAILURES = Counter('email_send_failures_total', 'Email delivery attempts that failed')
+EMAIL_DURATION = Histogram('email_send_duration_seconds', 'Time spent sending one email')
+UPLOAD_BYTES = Counter('upload_bytes_total', 'Bytes of uploaded files received', ['view'])
+MEDIA_DISK = CallbackGauge('media_disk_bytes', 'Disk space of the filesystem holding MEDIA_ROOT', ['kind'],
+                           media_disk_bytes)
@@ -0,0 +1,270 @@
+import json
+import time
+import random
+from collections import defaultdict
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_cache_control
+import logging
+
+from . import metrics
+from .cdn import ENDPOINTS, current_surrogate_keys, surrogate_keys
+from .db_routers import read_from_replica
+from .timing import RequestTiming, current_query_counts, current_timing
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+def has_credentials(request):
+    return settings.SESSION_COOKIE_NAME in request.COOKIES or 'Authorization' in request.headers
+
+class AsyncCapableMiddleware:
+    """Base of the middleware running in the mode of the handler: under ASGI they are
+    awaited directly instead of costing a thread hop around every request"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        raise NotImplementedError
+
+class ReplicaRoutingMiddleware(AsyncCapableMiddleware):
+    """Lets safe-method requests read from a replica, except admin pages and clients that
+    wrote recently: those read from the primary for REPLICA_STICKY_SECONDS to see their write"""
+
+    def use_replica(self, request):
+        if request.method not in SAFE_METHODS:
+            return False
+        if any(request.path.startswith(prefix) for prefix in settings.REPLICA_EXCLUDED_PATHS):
+            return False
+        try:
+            sticky_until = float(request.COOKIES.get(settings.REPLICA_STICKY_COOKIE, 0))
+        except ValueError:
+            sticky_until = 0
+        return sticky_until < time.time()
+
+    def handle(self, request):
+        token = read_from_replica.set(self.use_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
+        return self.stick_to_primary(request, response)
+
+    async def __acall__(self, request):
+        token = read_from_replica.set(self.use_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
+        return self.stick_to_primary(request, response)
+
+    def stick_to_primary(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                settings.REPLICA_STICKY_COOKIE,
+                str(time.time() + settings.REPLICA_STICKY_SECONDS),
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite='Lax',
+                secure=not settings.DEBUG,
+            )
+        return response
+
+class RequestTimingMiddleware(AsyncCapableMiddleware):
+    """Measures queries, SQL time, serialization and render time of each request.
+
+    The numbers are sent as a Server-Timing header and logged as JSON for staff
+    callers (session or JWT) and for a REQUEST_TIMING_SAMPLE_RATE share of the
+    other requests. Requests over REQUEST_TIMING_QUERY_WARNING queries are always
+    logged as warnings. Disabled unless REQUEST_TIMING_ENABLED is set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def handle(self, request):
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        return self.report(request, response, timing, time.perf_counter() - start, self.is_staff(request))
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        total = time.perf_counter() - start
+        # Loading the user may query the database, only done for requests carrying credentials
+        staff = has_credentials(request) and await sync_to_async(self.is_staff)(request)
+        return self.report(request, response, timing, total, staff)
+
+    def is_staff(self, request):
+        if not has_credentials(request):
+            return False
+        # DRF sets the JWT user on the underlying request during authentication
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_authenticated and user.is_staff)
+
+    def report(self, request, response, timing, total, exposed):
+        sampled = exposed or random.random() < settings.REQUEST_TIMING_SAMPLE_RATE
+        too_many_queries = timing.queries > settings.REQUEST_TIMING_QUERY_WARNING
+        if not (sampled or too_many_queries):
+            return response
+
+        durations = self.durations(timing, total)
+        if sampled:
+            entries = [f'{name};dur={duration * 1000:.1f}' for name, duration in durations.items()]
+            entries.append(f'queries;desc="{timing.queries}"')
+            response['Server-Timing'] = ', '.join(entries)
+
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'route': match.route if match else None,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': timing.queries,
+            **{f'{name}_ms': round(duration * 1000, 1) for name, duration in durations.items()},
+        }
+        if too_many_queries:
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+        return response
+
+    def process_template_response(self, request, response):
+        # Called right before rendering, DRF responses are rendered after the view returned
+        timing = current_timing.get()
+        if timing is not None:
+            start, sql_time = time.perf_counter(), timing.sql_time
+            response.add_post_render_callback(
+                lambda response: timing.add_excluding_sql('render', start, sql_time)
+            )
+        return response
+
+    def durations(self, timing, total):
+        """Durations in seconds, 'app' is the time spent outside SQL, serialization and rendering.
+        The queries run while serializing or rendering only count in 'db', the spans do not overlap."""
+        serialize = timing.durations['serialize']
+        render = timing.durations['render']
+        return {
+            'db': timing.sql_time,
+            'serialize': serialize,
+            'render': render,
+            'app': total - timing.sql_time - serialize - render,
+            'total': total,
+        }
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """Counts requests, their duration and their database queries per view for the
+    /metrics endpoint. Disabled unless METRICS_ENABLED is set."""
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def handle(self, request):
+        queries = defaultdict(int)
+        token = current_query_counts.set(queries)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_counts.reset(token)
+        return self.record(request, response, time.perf_counter() - start, queries)
+
+    async def __acall__(self, request):
+        queries = defaultdict(int)
+        token = current_query_counts.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_counts.reset(token)
+        return self.record(request, response, time.perf_counter() - start, queries)
+
+    def record(self, request, response, duration, queries):
+        # View names rather than paths keep the number of series bounded
+        match = request.resolver_match
+        metrics.record_request(request.method, match.view_name if match else 'unmatched',
+                               response.status_code, duration, queries)
+        return response
+
+class CdnCacheMiddleware(AsyncCapableMiddleware):
+    """Adds the Cache-Control policy of CDN_CACHE_POLICIES to the successful GETs of the
+    public endpoints, and Surrogate-Key / Cache-Tag headers naming the serialized objects
+    so api_app.cdn.purge can evict them. Disabled unless CDN_CACHE_ENABLED is set."""
+
+    def __init__(self, get_response):
+        if not settings.CDN_CACHE_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def handle(self, request):
+        keys = set()
+        token = current_surrogate_keys.set(keys)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_surrogate_keys.reset(token)
+        return self.add_headers(request, response, keys)
+
+    async def __acall__(self, request):
+        keys = set()
+        token = current_surrogate_keys.set(keys)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_surrogate_keys.reset(token)
+        return self.add_headers(request, response, keys)
+
+    def add_headers(self, request, response, keys):
+        match = request.resolver_match
+        endpoint = ENDPOINTS.get(match.url_name) if match else None
+        if endpoint is None or request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return response
+        if has_credentials(request):
+            # Kept out of shared caches
+            patch_cache_control(response, private=True, max_age=0)
+            return response
+
+        policy, endpoint_keys = endpoint
+        policy = settings.CDN_CACHE_POLICIES[policy]
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=policy['max_age'],
+            s_maxage=policy['s_maxage'],
+            stale_while_revalidate=policy['stale_while_revalidate'],
+        )
+        keys = surrogate_keys(endpoint_keys, keys)
+        if keys:
+            # Fastly reads space separated keys, Cloudflare comma separated tags
+            response['Surrogate-Key'] = ' '.join(keys)
+            response['Cache-Tag'] = ','.join(keys)
+        return response
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:33
+
+import api_app.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0012_boat_is_featured'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blogpost',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to=api_app.models.ShardedUploadTo('blog/'), verbose_name='Image'),
+        ),
+        migrations.AlterField(
+            model_name='boatcategory',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to=api_app.models.ShardedUploadTo('categories/'), verbose_name='Image'),
+        ),
+        migrations.AlterField(
+            model_name='boatimage',
+            name='image',
+            field=models.ImageField(upload_to=api_app.models.ShardedUploadTo('boats/'), verbose_name='Image'),
+        ),
+        migrations.AlterField(
+            model_name='boatvideo',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to=api_app.models.ShardedUploadTo('boat_video_thumbnails/'), verbose_name='Miniature'),
+        ),
+        migrations.AlterField(
+            model_name='boatvideo',
+            name='video_file',
+            field=models.FileField(blank=True, help_text='Téléchargez directement un fichier vidéo (recommandé < 100 MB)', null=True, upload_to=api_app.models.ShardedUploadTo('boat_videos/'), verbose_name='Fichier Vidéo'),
+        ),
+        migrations.AlterField(
+            model_name='sellrequestimage',
+            name='image',
+            field=models.ImageField(upload_to=api_app.models.ShardedUploadTo('sell_requests/'), verbose_name='Image'),
+        ),
+        migrations.AlterField(
+            model_name='testimonial',
+            name='avatar',
+            field=models.ImageField(upload_to=api_app.models.ShardedUploadTo('testimonials/'), verbose_name='Avatar'),
+        ),
+    ]
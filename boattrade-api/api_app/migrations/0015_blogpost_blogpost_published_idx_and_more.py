@@ -0,0 +1,57 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0014_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blogpost',
+            index=models.Index(fields=['-published_date'], name='blogpost_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blogpost',
+            index=models.Index(fields=['is_active', '-published_date'], name='blogpost_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boat',
+            index=models.Index(fields=['is_active'], name='boat_is_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boat',
+            index=models.Index(fields=['is_featured'], name='boat_is_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boat',
+            index=models.Index(fields=['year_built'], name='boat_year_built_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inquiry',
+            index=models.Index(fields=['-created_at'], name='inquiry_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inquiry',
+            index=models.Index(fields=['is_processed', '-created_at'], name='inquiry_processed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboundemail',
+            index=models.Index(fields=['-created_at'], name='outbox_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sellrequest',
+            index=models.Index(fields=['-created_at'], name='sellrequest_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sellrequest',
+            index=models.Index(fields=['is_processed', '-created_at'], name='sellrequest_processed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testimonial',
+            index=models.Index(fields=['rating'], name='testimonial_rating_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0015_blogpost_blogpost_published_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='boat',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='boat_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boat',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', '-created_at'], name='boat_active_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boat',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_featured', True)), fields=['-created_at'], name='boat_featured_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boat',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['price'], name='boat_active_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boat',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['year_built'], name='boat_active_year_idx'),
+        ),
+    ]
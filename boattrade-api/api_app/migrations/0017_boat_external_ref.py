@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0016_boat_boat_active_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boat',
+            name='external_ref',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True, verbose_name='Référence externe'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:47
+
+from django.db import migrations, models
+
+
+def number_existing_images(apps, schema_editor):
+    # Keep the main image first, then the upload order
+    BoatImage = apps.get_model('api_app', 'BoatImage')
+    images = list(BoatImage.objects.order_by('boat_id', '-is_main', 'id'))
+    positions = {}
+    for image in images:
+        image.position = positions.get(image.boat_id, 0)
+        positions[image.boat_id] = image.position + 1
+    BoatImage.objects.bulk_update(images, ['position'], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0017_boat_external_ref'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='boatimage',
+            options={'ordering': ['position', 'id'], 'verbose_name': 'Image de bateau', 'verbose_name_plural': 'Images de bateaux'},
+        ),
+        migrations.AddField(
+            model_name='boatimage',
+            name='position',
+            field=models.PositiveIntegerField(default=0, verbose_name='Position'),
+        ),
+        migrations.AddIndex(
+            model_name='boatimage',
+            index=models.Index(fields=['boat', 'position'], name='boatimage_position_idx'),
+        ),
+        migrations.RunPython(number_existing_images, migrations.RunPython.noop),
+    ]
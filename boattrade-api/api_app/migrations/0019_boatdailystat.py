@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0018_boatimage_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoatDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Vues')),
+                ('impressions', models.PositiveIntegerField(default=0, verbose_name='Affichages en liste')),
+                ('boat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='api_app.boat', verbose_name='Bateau')),
+            ],
+            options={
+                'verbose_name': 'Statistique journalière',
+                'verbose_name_plural': 'Statistiques journalières',
+                'indexes': [models.Index(fields=['date', 'boat'], name='boatdailystat_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('boat', 'date'), name='boatdailystat_boat_date_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0019_boatdailystat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Date')),
+                ('inquiries', models.PositiveIntegerField(default=0, verbose_name="Demandes d'information")),
+                ('sell_requests', models.PositiveIntegerField(default=0, verbose_name='Demandes de mise en vente')),
+            ],
+            options={
+                'verbose_name': 'Statistique journalière des demandes',
+                'verbose_name_plural': 'Statistiques journalières des demandes',
+            },
+        ),
+        migrations.AddField(
+            model_name='boatdailystat',
+            name='inquiries',
+            field=models.PositiveIntegerField(default=0, verbose_name="Demandes d'information"),
+        ),
+        migrations.CreateModel(
+            name='CategoryDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('inquiries', models.PositiveIntegerField(default=0, verbose_name="Demandes d'information")),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='api_app.boatcategory', verbose_name='Catégorie')),
+            ],
+            options={
+                'verbose_name': 'Statistique journalière par catégorie',
+                'verbose_name_plural': 'Statistiques journalières par catégorie',
+                'constraints': [models.UniqueConstraint(fields=('category', 'date'), name='categorydailystat_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0020_lead_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('boat.created', 'Bateau ajouté'), ('boat.updated', 'Bateau modifié'), ('boat.price_changed', 'Prix modifié'), ('boat.deactivated', 'Bateau désactivé'), ('boat.deleted', 'Bateau supprimé')], max_length=30, verbose_name='Type')),
+                ('boat_id', models.BigIntegerField(verbose_name='Bateau')),
+                ('data', models.JSONField(blank=True, default=dict, verbose_name='Données')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date')),
+            ],
+            options={
+                'verbose_name': 'Événement du catalogue',
+                'verbose_name_plural': 'Événements du catalogue',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:37
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0021_catalogevent'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='boat',
+            name='boat_is_active_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='boat',
+            name='boat_is_featured_idx',
+        ),
+    ]
@@ -4,9 +4,14 @@ from django.core.exceptions import ValidationError
 from django.forms import ValidationError as FormValidationError
 from django.db.models import JSONField  # Import JSONField for complex data structures
 from django.contrib import messages
+from django.utils.deconstruct import deconstructible
+import hashlib
 import os
+import posixpath
 import shutil
 
+from .storage import original_name
+
 def get_file_size_mb(file):
     """Return file size in MB"""
     if hasattr(file, 'size'):
@@ -43,10 +48,41 @@ def get_storage_info():
             'error': str(e)
         }
 
+def sharded_upload_path(prefix, filename, strategy=None, when=None):
+    """Build the storage path of an upload below `prefix` according to the sharding strategy"""
+    from django.conf import settings
+    strategy = strategy or settings.MEDIA_UPLOAD_SHARDING
+    basename = posixpath.basename(filename.replace('\\', '/'))
+    
+    if strategy == 'hash':
+        # Spread files over 256^depth directories using the file name digest. The name given by the
+        # storage is reduced to the uploaded one so shard_media finds stored files where they were put
+        digest = hashlib.md5(original_name(basename).encode('utf-8')).hexdigest()
+        parts = [digest[i * 2:i * 2 + 2] for i in range(settings.MEDIA_UPLOAD_SHARD_DEPTH)]
+    elif strategy == 'date':
+        when = when or timezone.localtime()
+        parts = [when.strftime('%Y'), when.strftime('%m'), when.strftime('%d')]
+    elif strategy == 'flat':
+        parts = []
+    else:
+        raise ValueError(f"Unknown media sharding strategy: {strategy}")
+    
+    return posixpath.join(prefix.strip('/'), *parts, basename)
+
+@deconstructible
+class ShardedUploadTo:
+    """upload_to callable placing files in hashed or dated subdirectories of `prefix`"""
+    
+    def __init__(self, prefix):
+        self.prefix = prefix
+    
+    def __call__(self, instance, filename):
+        return sharded_upload_path(self.prefix, filename)
+
 class BoatCategory(models.Model):
     name = models.CharField(max_length=100, verbose_name="Nom")
     description = models.TextField(blank=True, verbose_name="Description")
-    image = models.ImageField(upload_to='categories/', blank=True, null=True, verbose_name="Image")
+    image = models.ImageField(upload_to=ShardedUploadTo('categories/'), blank=True, null=True, verbose_name="Image")
     
     def __str__(self):
         return self.name
@@ -75,6 +111,9 @@ class Boat(models.Model):
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Date de mise à jour de l'annonce")
     is_active = models.BooleanField(default=True, verbose_name="Actif")
     is_featured = models.BooleanField(default=False, verbose_name="Mise en avant")
+    # Broker reference used to update the boat on later imports (import_boats)
+    external_ref = models.CharField(max_length=100, unique=True, null=True, blank=True,
+                                    verbose_name="Référence externe")
     
     def __str__(self):
         return self.title
@@ -82,6 +121,22 @@ class Boat(models.Model):
     class Meta:
         verbose_name = "Bateau"
         verbose_name_plural = "Bateaux"
+        indexes = [
+            # Admin list filters. The is_active and is_featured filters are served by the
+            # partial indexes below, a lone boolean column is too unselective to index.
+            models.Index(fields=['year_built'], name='boat_year_built_idx'),
+            # BoatViewSet query shapes, all restricted to active boats (see explain_boat_queries)
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True),
+                         name='boat_active_created_idx'),
+            models.Index(fields=['category', '-created_at'], condition=models.Q(is_active=True),
+                         name='boat_active_category_idx'),
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True, is_featured=True),
+                         name='boat_featured_created_idx'),
+            models.Index(fields=['price'], condition=models.Q(is_active=True),
+                         name='boat_active_price_idx'),
+            models.Index(fields=['year_built'], condition=models.Q(is_active=True),
+                         name='boat_active_year_idx'),
+        ]
 
 # New models for amenities and technical details - fully optional
 class AmenityItem(models.Model):
@@ -122,24 +177,40 @@ class TechnicalDetailItem(models.Model):
 
 class BoatImage(models.Model):
     boat = models.ForeignKey(Boat, on_delete=models.CASCADE, related_name='images', verbose_name="Bateau")
-    image = models.ImageField(upload_to='boats/', verbose_name="Image")
+    image = models.ImageField(upload_to=ShardedUploadTo('boats/'), verbose_name="Image")
     is_main = models.BooleanField(default=False, verbose_name="Image principale")
     caption = models.CharField(max_length=200, blank=True, verbose_name="Légende")
+    position = models.PositiveIntegerField(default=0, verbose_name="Position")
     
     def __str__(self):
         return f"Image for {self.boat.title}"
+    
+    def save(self, *args, **kwargs):
+        # New images go after the existing ones
+        if self._state.adding and not self.position and self.boat_id:
+            self.position = next_image_position(self.boat_id)
+        super().save(*args, **kwargs)
         
     class Meta:
         verbose_name = "Image de bateau"
         verbose_name_plural = "Images de bateaux"
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['boat', 'position'], name='boatimage_position_idx'),
+        ]
+
+def next_image_position(boat_id):
+    """Position following the last image of a boat"""
+    last = BoatImage.objects.filter(boat_id=boat_id).aggregate(last=models.Max('position'))['last']
+    return 0 if last is None else last + 1
 
 class BoatVideo(models.Model):
     boat = models.ForeignKey(Boat, on_delete=models.CASCADE, related_name='videos', verbose_name="Bateau")
     title = models.CharField(max_length=200, blank=True, verbose_name="Titre")
     video_url = models.URLField(verbose_name="URL Vidéo", help_text="YouTube ou Vimeo URL", blank=True, null=True)
-    video_file = models.FileField(upload_to='boat_videos/', blank=True, null=True, verbose_name="Fichier Vidéo",
+    video_file = models.FileField(upload_to=ShardedUploadTo('boat_videos/'), blank=True, null=True, verbose_name="Fichier Vidéo",
                                  help_text="Téléchargez directement un fichier vidéo (recommandé < 100 MB)")
-    thumbnail = models.ImageField(upload_to='boat_video_thumbnails/', blank=True, null=True, verbose_name="Miniature")
+    thumbnail = models.ImageField(upload_to=ShardedUploadTo('boat_video_thumbnails/'), blank=True, null=True, verbose_name="Miniature")
     is_main = models.BooleanField(default=False, verbose_name="Vidéo principale")
     file_size_mb = models.FloatField(blank=True, null=True, editable=False, verbose_name="Taille du fichier (MB)")
     warning_message = models.TextField(blank=True, null=True, editable=False, 
@@ -205,6 +276,59 @@ class BoatVideo(models.Model):
         verbose_name = "Vidéo de bateau"
         verbose_name_plural = "Vidéos de bateaux"
 
+class BoatDailyStat(models.Model):
+    """Views of the detail page, impressions in lists and inquiries, per boat and per day.
+    Views and impressions are filled by api_app.counters from in-memory buffers,
+    inquiries by api_app.analytics when an inquiry is created."""
+    boat = models.ForeignKey(Boat, on_delete=models.CASCADE, related_name='daily_stats', verbose_name="Bateau")
+    date = models.DateField(verbose_name="Date")
+    views = models.PositiveIntegerField(default=0, verbose_name="Vues")
+    impressions = models.PositiveIntegerField(default=0, verbose_name="Affichages en liste")
+    inquiries = models.PositiveIntegerField(default=0, verbose_name="Demandes d'information")
+    
+    def __str__(self):
+        return f"{self.boat_id} - {self.date}: {self.views} vues"
+    
+    class Meta:
+        verbose_name = "Statistique journalière"
+        verbose_name_plural = "Statistiques journalières"
+        constraints = [
+            models.UniqueConstraint(fields=['boat', 'date'], name='boatdailystat_boat_date_uniq'),
+        ]
+        indexes = [
+            # Popularity ordering only reads the recent days
+            models.Index(fields=['date', 'boat'], name='boatdailystat_date_idx'),
+        ]
+
+class CategoryDailyStat(models.Model):
+    """Inquiries per boat category and per day, maintained by api_app.analytics"""
+    category = models.ForeignKey(BoatCategory, on_delete=models.CASCADE, related_name='daily_stats', verbose_name="Catégorie")
+    date = models.DateField(verbose_name="Date")
+    inquiries = models.PositiveIntegerField(default=0, verbose_name="Demandes d'information")
+    
+    def __str__(self):
+        return f"{self.category_id} - {self.date}: {self.inquiries} demandes"
+    
+    class Meta:
+        verbose_name = "Statistique journalière par catégorie"
+        verbose_name_plural = "Statistiques journalières par catégorie"
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'date'], name='categorydailystat_uniq'),
+        ]
+
+class LeadDailyStat(models.Model):
+    """Inquiries and sell requests received per day, maintained by api_app.analytics"""
+    date = models.DateField(unique=True, verbose_name="Date")
+    inquiries = models.PositiveIntegerField(default=0, verbose_name="Demandes d'information")
+    sell_requests = models.PositiveIntegerField(default=0, verbose_name="Demandes de mise en vente")
+    
+    def __str__(self):
+        return f"{self.date}: {self.inquiries} demandes, {self.sell_requests} mises en vente"
+    
+    class Meta:
+        verbose_name = "Statistique journalière des demandes"
+        verbose_name_plural = "Statistiques journalières des demandes"
+
 class Inquiry(models.Model):
     """For users interested in a specific boat"""
     boat = models.ForeignKey(Boat, on_delete=models.CASCADE, related_name='inquiries', verbose_name="Bateau")
@@ -222,6 +346,11 @@ class Inquiry(models.Model):
     class Meta:
         verbose_name = "Demande d'information"
         verbose_name_plural = "Demandes d'information"
+        indexes = [
+            # Admin list filters and date ordering
+            models.Index(fields=['-created_at'], name='inquiry_created_idx'),
+            models.Index(fields=['is_processed', '-created_at'], name='inquiry_processed_idx'),
+        ]
 
 class SellRequest(models.Model):
     """For users wanting to sell their boat"""
@@ -240,10 +369,15 @@ class SellRequest(models.Model):
     class Meta:
         verbose_name = "Demande de mise en vente"
         verbose_name_plural = "Demandes de mise en vente"
+        indexes = [
+            # Admin list filters and date ordering
+            models.Index(fields=['-created_at'], name='sellrequest_created_idx'),
+            models.Index(fields=['is_processed', '-created_at'], name='sellrequest_processed_idx'),
+        ]
 
 class SellRequestImage(models.Model):
     sell_request = models.ForeignKey(SellRequest, on_delete=models.CASCADE, related_name='images', verbose_name="Demande de vente")
-    image = models.ImageField(upload_to='sell_requests/', verbose_name="Image")
+    image = models.ImageField(upload_to=ShardedUploadTo('sell_requests/'), verbose_name="Image")
     
     def __str__(self):
         return f"Image for sell request #{self.sell_request.id}"
@@ -255,7 +389,7 @@ class SellRequestImage(models.Model):
 class Testimonial(models.Model):
     name = models.CharField(max_length=100, verbose_name="Nom")
     role = models.CharField(max_length=100, verbose_name="Rôle")
-    avatar = models.ImageField(upload_to='testimonials/', verbose_name="Avatar")
+    avatar = models.ImageField(upload_to=ShardedUploadTo('testimonials/'), verbose_name="Avatar")
     quote = models.TextField(verbose_name="Citation")
     rating = models.IntegerField(
         verbose_name="Note", 
@@ -269,11 +403,14 @@ class Testimonial(models.Model):
     class Meta:
         verbose_name = "Témoignage"
         verbose_name_plural = "Témoignages"
+        indexes = [
+            models.Index(fields=['rating'], name='testimonial_rating_idx'),
+        ]
 
 class BlogPost(models.Model):
     title = models.CharField(max_length=200, verbose_name="Titre")
     content = models.TextField(verbose_name="Contenu")
-    image = models.ImageField(upload_to='blog/', blank=True, null=True, verbose_name="Image")
+    image = models.ImageField(upload_to=ShardedUploadTo('blog/'), blank=True, null=True, verbose_name="Image")
     published_date = models.DateTimeField(default=timezone.now, verbose_name="Date de publication")
     is_active = models.BooleanField(default=True, verbose_name="Publié")
     
@@ -283,4 +420,72 @@ class BlogPost(models.Model):
     class Meta:
         verbose_name = "Article de blog"
         verbose_name_plural = "Articles de blog"
-        ordering = ['-published_date']
\ No newline at end of file
+        ordering = ['-published_date']
+        indexes = [
+            models.Index(fields=['-published_date'], name='blogpost_published_idx'),
+            models.Index(fields=['is_active', '-published_date'], name='blogpost_active_idx'),
+        ]
+
+class OutboundEmail(models.Model):
+    """Notification email kept in the outbox until the send_queued_emails worker delivers it"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'En attente'),
+        (STATUS_SENT, 'Envoyé'),
+        (STATUS_FAILED, 'Échec'),
+    ]
+    
+    subject = models.CharField(max_length=255, verbose_name="Sujet")
+    body = models.TextField(verbose_name="Message")
+    from_email = models.CharField(max_length=255, verbose_name="Expéditeur")
+    recipients = JSONField(default=list, verbose_name="Destinataires")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="Statut")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Tentatives")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Prochaine tentative")
+    last_error = models.TextField(blank=True, verbose_name="Dernière erreur")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Date de création")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Date d'envoi")
+    
+    def __str__(self):
+        return f"{self.subject} ({self.get_status_display()})"
+    
+    class Meta:
+        verbose_name = "Email sortant"
+        verbose_name_plural = "Emails sortants"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+            models.Index(fields=['-created_at'], name='outbox_created_idx'),
+        ]
+
+class CatalogEvent(models.Model):
+    """Change of a boat published to the catalog event stream, the table only keeps
+    the last CATALOG_EVENTS_LOG_SIZE events for clients resuming with Last-Event-ID"""
+    KIND_CREATED = 'boat.created'
+    KIND_UPDATED = 'boat.updated'
+    KIND_PRICE_CHANGED = 'boat.price_changed'
+    KIND_DEACTIVATED = 'boat.deactivated'
+    KIND_DELETED = 'boat.deleted'
+    KIND_CHOICES = [
+        (KIND_CREATED, 'Bateau ajouté'),
+        (KIND_UPDATED, 'Bateau modifié'),
+        (KIND_PRICE_CHANGED, 'Prix modifié'),
+        (KIND_DEACTIVATED, 'Bateau désactivé'),
+        (KIND_DELETED, 'Bateau supprimé'),
+    ]
+    
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES, verbose_name="Type")
+    # Not a foreign key, the events of deleted boats stay in the log
+    boat_id = models.BigIntegerField(verbose_name="Bateau")
+    data = JSONField(default=dict, blank=True, verbose_name="Données")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Date")
+    
+    def __str__(self):
+        return f"#{self.pk} {self.kind} {self.boat_id}"
+    
+    class Meta:
+        verbose_name = "Événement du catalogue"
+        verbose_name_plural = "Événements du catalogue"
+        ordering = ['id']
@@ -0,0 +1,97 @@
+import os
+import re
+import uuid
+from urllib.parse import urljoin
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.template.loader import get_template
+
+from .models import Boat, BoatImage
+
+# Tags of the frontend index.html replaced by the ones of the boat
+REPLACED_TAGS = re.compile(
+    r'\s*(?:<title>.*?</title>'
+    r'|<meta\s+(?:name|property)="(?:title|description|og:type|og:url|og:title|og:description|og:image'
+    r'|twitter:url|twitter:title|twitter:description|twitter:image)"[^>]*>'
+    r'|<link\s+rel="canonical"[^>]*>)',
+    re.DOTALL,
+)
+
+# path -> (version, head before the boat tags, rest of the page, unchanged page)
+_index_cache = {}
+
+def load_index():
+    """The frontend index.html split around the boat tags, read again when the file changes
+    (a deploy changes its asset names)"""
+    path = settings.FRONTEND_INDEX_PATH
+    try:
+        version = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        raise ImproperlyConfigured(f"FRONTEND_INDEX_PATH {path} does not exist, build the frontend first")
+    cached = _index_cache.get(path)
+    if cached is None or cached[0] != version:
+        with open(path, encoding='utf-8') as index_file:
+            index = index_file.read()
+        html = REPLACED_TAGS.sub('', index)
+        head_end = html.index('</head>')
+        cached = _index_cache[path] = (version, html[:head_end], html[head_end:], index)
+    return cached
+
+def cache_key(pk):
+    return f'seo:boat:{pk}'
+
+def version_key(pk):
+    return f'seo:boat:{pk}:version'
+
+def format_price(price):
+    # Like Intl.NumberFormat('fr-FR', {style: 'currency', currency: 'EUR'}) in the frontend
+    return f"{price:,.2f}".replace(',', ' ').replace('.', ',') + ' €'
+
+def render_boat_page(pk):
+    """index.html with the title, description, og:, twitter: and canonical tags of the boat,
+    None when the boat is not listed.
+
+    Pages are cached along with the updated_at of their boat, which any process saving the
+    boat changes, and the version forget_boat_page gives them when its photos or equipment change.
+    """
+    version, head, rest, _ = load_index()
+    updated_at = Boat.objects.filter(pk=pk, is_active=True).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    cached = cache.get_many([cache_key(pk), version_key(pk)])
+    page_version = (version, updated_at, cached.get(version_key(pk)))
+    if cache_key(pk) in cached and cached[cache_key(pk)][:3] == page_version:
+        return cached[cache_key(pk)][3]
+
+    boat = Boat.objects.filter(pk=pk).only('title', 'description', 'price', 'year_built', 'location').first()
+    if boat is None:
+        return None
+    # The main image, otherwise the first one, like the boat page
+    image = BoatImage.objects.filter(boat_id=pk).order_by('-is_main', 'position', 'id').values_list(
+        'image', flat=True
+    ).first()
+
+    title = f"{boat.title} - {boat.year_built} - BoatTrade Consulting"
+    meta = get_template('seo/boat_meta.html').render({
+        'boat': boat,
+        'title': title,
+        'description': (f"{boat.title} - {boat.year_built} - {format_price(boat.price)} - {boat.location}. "
+                        f"{boat.description[:150]}..."),
+        'url': f"{settings.FRONTEND_URL.rstrip('/')}/boats/{boat.pk}",
+        'image': urljoin(settings.SITE_URL, BoatImage._meta.get_field('image').storage.url(image)) if image else None,
+    })
+    page = f"{head}\n    {meta}  {rest}"
+    cache.set(cache_key(pk), (*page_version, page), settings.SEO_PAGE_CACHE_TIMEOUT)
+    return page
+
+def forget_boat_page(*pks):
+    """Outdate the cached pages of boats changed without a save of the boat (photos, equipment,
+    update_fields saves). They get a new version once committed, a page rendered before would
+    be cached with the old values."""
+    if not pks:
+        return
+    transaction.on_commit(lambda: cache.set_many(
+        {version_key(pk): uuid.uuid4().hex for pk in pks}, settings.SEO_PAGE_CACHE_TIMEOUT
+    ), robust=True)
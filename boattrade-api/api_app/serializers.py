@@ -4,16 +4,42 @@ from .models import (
     SellRequest, SellRequestImage, AmenityItem, TechnicalDetailItem,
     Testimonial, BlogPost
 )
+from .cdn import add_surrogate_keys, object_key
+from .timing import timed
 
-class BoatCategorySerializer(serializers.ModelSerializer):
+class TimedListSerializer(serializers.ListSerializer):
+    """Reports the time spent serializing a list to the request timing"""
+    
+    @property
+    def data(self):
+        with timed('serialize'):
+            return super().data
+
+class TimedSerializerMixin:
+    """Reports the time spent serializing one object to the request timing"""
+    
+    @property
+    def data(self):
+        with timed('serialize'):
+            return super().data
+
+class SurrogateKeyMixin:
+    """Names each serialized object in the Surrogate-Key header of the response"""
+    
+    def to_representation(self, instance):
+        add_surrogate_keys(object_key(instance._meta.concrete_model, instance.pk))
+        return super().to_representation(instance)
+
+class BoatCategorySerializer(SurrogateKeyMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = BoatCategory
+        list_serializer_class = TimedListSerializer
         fields = ['id', 'name', 'description', 'image']
 
 class BoatImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = BoatImage
-        fields = ['id', 'image', 'is_main', 'caption']
+        fields = ['id', 'image', 'is_main', 'caption', 'position']
 
 class BoatVideoSerializer(serializers.ModelSerializer):
     video_file_url = serializers.SerializerMethodField()
@@ -27,7 +53,7 @@ class BoatVideoSerializer(serializers.ModelSerializer):
             return obj.video_file.url
         return None
 
-class BoatSerializer(serializers.ModelSerializer):
+class BoatSerializer(SurrogateKeyMixin, TimedSerializerMixin, serializers.ModelSerializer):
     images = BoatImageSerializer(many=True, read_only=True)
     videos = BoatVideoSerializer(many=True, read_only=True)
     category_detail = BoatCategorySerializer(source='category', read_only=True)
@@ -96,13 +122,14 @@ class BoatSerializer(serializers.ModelSerializer):
                 
         return result
 
-class BoatListSerializer(serializers.ModelSerializer):
+class BoatListSerializer(SurrogateKeyMixin, TimedSerializerMixin, serializers.ModelSerializer):
     category_detail = BoatCategorySerializer(source='category', read_only=True)
     main_image = serializers.SerializerMethodField()
     main_video = serializers.SerializerMethodField()
     
     class Meta:
         model = Boat
+        list_serializer_class = TimedListSerializer
         fields = [
             'id', 'title', 'category', 'category_detail', 'price', 
             'year_built', 'main_image', 'main_video', 'location'
@@ -124,6 +151,16 @@ class BoatListSerializer(serializers.ModelSerializer):
             return main_video.video_url
         return None
 
+class PreloadedBoatListSerializer(BoatListSerializer):
+    """BoatListSerializer reading the main image and video URLs attached to the boats beforehand,
+    it runs no query and can serialize in async views"""
+    
+    def get_main_image(self, obj):
+        return obj.main_image_url
+    
+    def get_main_video(self, obj):
+        return obj.main_video_url
+
 class InquirySerializer(serializers.ModelSerializer):
     class Meta:
         model = Inquiry
@@ -149,12 +186,14 @@ class SellRequestSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'is_processed', 'images']
 
-class TestimonialSerializer(serializers.ModelSerializer):
+class TestimonialSerializer(SurrogateKeyMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Testimonial
+        list_serializer_class = TimedListSerializer
         fields = ['id', 'name', 'role', 'avatar', 'quote', 'rating']
 
-class BlogPostSerializer(serializers.ModelSerializer):
+class BlogPostSerializer(SurrogateKeyMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = BlogPost
+        list_serializer_class = TimedListSerializer
         fields = ['id', 'title', 'content', 'image', 'published_date', 'is_active']
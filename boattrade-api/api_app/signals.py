@@ -0,0 +1,109 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .analytics import record_inquiry, record_sell_request
+from .cdn import object_key, purge
+from .events import record_boat_change, record_event
+from .models import (
+    AmenityItem, BlogPost, Boat, BoatCategory, BoatImage, BoatVideo, CatalogEvent, Inquiry, SellRequest,
+    TechnicalDetailItem, Testimonial
+)
+from . import snapshots
+from .seo import forget_boat_page
+from .timing import measure_query
+
+@receiver(connection_created)
+def install_query_measure(sender, connection, **kwargs):
+    # Stays installed when the connection is reopened, the wrapper does nothing outside measured requests
+    if measure_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(measure_query)
+
+# The rollups are updated in the transaction creating the lead, a rolled back
+# request leaves them untouched. Deletions are not tracked, rebuild_lead_rollups
+# recomputes the counts from the remaining leads.
+
+@receiver(post_save, sender=Inquiry)
+def count_inquiry(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_inquiry(instance)
+
+@receiver(post_save, sender=SellRequest)
+def count_sell_request(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_sell_request(instance)
+
+# Catalog events are written once the change is committed. Bulk writes send no signals:
+# import_boats publishes its own events, the bulk image manager and the staged uploads
+# call publish_images_change. Deleted photos and equipment are not published, the admin
+# saves the boat itself along with them.
+
+@receiver(pre_save, sender=Boat)
+def remember_boat_state(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        instance._previous_state = Boat.objects.filter(pk=instance.pk).values('price', 'is_active', 'is_featured').first()
+
+@receiver(post_save, sender=Boat)
+def publish_boat_change(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if not raw:
+        previous = None if created else getattr(instance, '_previous_state', None)
+        record_boat_change(previous, instance)
+        keys = snapshots.boat_keys(previous, instance)
+        if keys:
+            snapshots.schedule(*keys)
+            purge(object_key(Boat, instance.pk), 'boats')
+        # A full save bumps updated_at, which outdates the cached SEO page in every process
+        if update_fields and 'updated_at' not in update_fields:
+            forget_boat_page(instance.pk)
+
+@receiver(post_delete, sender=Boat)
+def publish_boat_deletion(sender, instance, **kwargs):
+    record_event(CatalogEvent.KIND_DELETED, instance.pk)
+    snapshots.schedule(('boat', instance.pk), 'boats', 'featured-boats')
+    purge(object_key(Boat, instance.pk), 'boats')
+
+def publish_parent_change(sender, instance, raw=False, **kwargs):
+    if not raw and instance.boat.is_active:
+        record_event(CatalogEvent.KIND_UPDATED, instance.boat_id)
+        if sender in (BoatImage, BoatVideo):
+            # The lists show the main image and video
+            snapshots.schedule(('boat', instance.boat_id), 'boats', 'featured-boats')
+            purge(object_key(Boat, instance.boat_id), 'boats')
+            forget_boat_page(instance.boat_id)
+        else:
+            snapshots.schedule(('boat', instance.boat_id))
+            purge(object_key(Boat, instance.boat_id))
+
+def publish_images_change(boat_id):
+    """Publish photos of a boat added, reordered or made main with bulk writes"""
+    if Boat.objects.filter(pk=boat_id, is_active=True).exists():
+        record_event(CatalogEvent.KIND_UPDATED, boat_id)
+        # The lists show the main image
+        snapshots.schedule(('boat', boat_id), 'boats', 'featured-boats')
+        purge(object_key(Boat, boat_id), 'boats')
+        # og:image
+        forget_boat_page(boat_id)
+
+for model in (BoatImage, BoatVideo, AmenityItem, TechnicalDetailItem):
+    post_save.connect(publish_parent_change, sender=model, dispatch_uid=f'publish_{model.__name__}_change')
+
+# Snapshots and CDN purges of the other public payloads
+
+@receiver([post_save, post_delete], sender=BoatCategory)
+def publish_category_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # The boats embed their category
+        snapshots.schedule('categories', 'boats', 'featured-boats', ('category', instance.pk))
+        purge(object_key(BoatCategory, instance.pk), 'categories')
+
+@receiver([post_save, post_delete], sender=Testimonial)
+def publish_testimonial_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        snapshots.schedule('testimonials')
+        purge(object_key(Testimonial, instance.pk), 'testimonials')
+
+@receiver([post_save, post_delete], sender=BlogPost)
+def publish_blog_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        snapshots.schedule('blog')
+        purge(object_key(BlogPost, instance.pk), 'blog')
@@ -1,6 +1,9 @@
+from collections import defaultdict
+from urllib.parse import urljoin
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
 from django.urls import reverse
-from .models import Boat
+from .models import Boat, BoatImage
 
 class BoatSitemap(Sitemap):
     changefreq = "weekly"
@@ -8,7 +11,7 @@ class BoatSitemap(Sitemap):
 
     def items(self):
         # Added order_by to fix the unordered object list warning
-        return Boat.objects.filter(is_active=True).order_by('id')
+        return Boat.objects.filter(is_active=True).order_by('id').only('id', 'updated_at')
     
     def lastmod(self, obj):
         return obj.updated_at
@@ -18,6 +21,27 @@ class BoatSitemap(Sitemap):
         # For absolute URLs, you might want to include your domain
         return f"/boats/{obj.id}/"
 
+    def get_urls(self, page=1, site=None, protocol=None):
+        urls = super().get_urls(page, site, protocol)
+        if urls:
+            # The boats of a page are a range of ids
+            images = self.images(urls[0]['item'].pk, urls[-1]['item'].pk)
+            for url in urls:
+                url['images'] = images.get(url['item'].pk, [])
+        return urls
+
+    def images(self, first_id, last_id):
+        """image:image entries of the listed boats between first_id and last_id, main image first,
+        read with one query joined to the boats"""
+        storage = BoatImage._meta.get_field('image').storage
+        rows = BoatImage.objects.filter(
+            boat__is_active=True, boat_id__gte=first_id, boat_id__lte=last_id
+        ).order_by('boat_id', '-is_main', 'position', 'id').values_list('boat_id', 'image', 'caption')
+        images = defaultdict(list)
+        for boat_id, name, caption in rows.iterator(chunk_size=2000):
+            images[boat_id].append({'location': urljoin(settings.SITE_URL, storage.url(name)), 'caption': caption})
+        return images
+
 class StaticViewSitemap(Sitemap):
     priority = 0.5
     changefreq = "monthly"
@@ -0,0 +1,222 @@
+import atexit
+import gzip
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urljoin
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connections, transaction
+from rest_framework.renderers import JSONRenderer
+import logging
+
+from .async_views import serialize_boats
+from .models import Boat
+from .serializers import BoatSerializer, BoatCategorySerializer, TestimonialSerializer, BlogPostSerializer
+from .views import BoatViewSet, BoatCategoryViewSet, TestimonialViewSet, BlogPostViewSet
+
+logger = logging.getLogger(__name__)
+
+# Payloads of the public endpoints written under SNAPSHOT_DIR at the path of their URL,
+# the boat details as boats/<id>/index.json
+LISTS = ('boats', 'featured-boats', 'categories', 'testimonials', 'blog')
+
+# Boats per query when the details are published
+BATCH_SIZE = 500
+
+# Snapshot keys changed since the last publication: list names, ('boat', id) and ('category', id)
+_pending = set()
+_changed = threading.Condition()
+_first_change = _last_change = None
+_publisher = None
+
+class SnapshotRequest:
+    """Stands in for the request in the serializer context, file URLs are made absolute
+    against SITE_URL like the API does against the requested host"""
+
+    def build_absolute_uri(self, location):
+        return urljoin(settings.SITE_URL, location)
+
+def schedule(*keys):
+    """Publish the snapshots of keys once the current transaction commits"""
+    if settings.SNAPSHOT_DIR and keys:
+        transaction.on_commit(lambda: _add(keys), robust=True)
+
+def boat_keys(previous, boat):
+    """Snapshots showing a boat saved over its `previous` state (is_active and is_featured,
+    None when new)"""
+    was_active = previous is not None and previous['is_active']
+    if not (boat.is_active or was_active):
+        return ()
+    keys = [('boat', boat.pk), 'boats']
+    if (boat.is_active and boat.is_featured) or (was_active and previous.get('is_featured')):
+        keys.append('featured-boats')
+    return keys
+
+def _add(keys):
+    global _first_change, _last_change
+    if not settings.SNAPSHOT_DEBOUNCE_SECONDS:
+        # No background publisher, the snapshots are written right after the commit
+        with _changed:
+            _pending.update(keys)
+        publish_pending()
+        return
+    with _changed:
+        _pending.update(keys)
+        _last_change = time.monotonic()
+        if _first_change is None:
+            _first_change = _last_change
+        _changed.notify()
+    _start_publisher()
+
+def _start_publisher():
+    global _publisher
+    if _publisher is not None:
+        return
+    with _changed:
+        if _publisher is None:
+            _publisher = threading.Thread(target=_publish_loop, name='snapshots', daemon=True)
+            _publisher.start()
+            # Do not leave stale files when the process stops before the delay
+            atexit.register(publish_pending)
+
+def _publish_loop():
+    while True:
+        with _changed:
+            while not _pending:
+                _changed.wait()
+            # Wait for SNAPSHOT_DEBOUNCE_SECONDS without change, SNAPSHOT_MAX_DELAY at most
+            while True:
+                deadline = min(_last_change + settings.SNAPSHOT_DEBOUNCE_SECONDS,
+                               _first_change + settings.SNAPSHOT_MAX_DELAY)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                _changed.wait(remaining)
+        try:
+            publish_pending()
+        finally:
+            connections.close_all()
+
+def publish_pending():
+    """Publish the snapshots changed since the last call, returns the files written or removed"""
+    global _pending, _first_change, _last_change
+    with _changed:
+        keys, _pending = _pending, set()
+        _first_change = _last_change = None
+    if not keys:
+        return 0
+    try:
+        return publish(keys)
+    except Exception as e:
+        # Published again with the next change
+        with _changed:
+            _pending |= keys
+        logger.error(f"Publishing the catalog snapshots failed: {str(e)}")
+        return 0
+
+def publish(keys):
+    boat_ids = {key[1] for key in keys if isinstance(key, tuple) and key[0] == 'boat'}
+    category_ids = {key[1] for key in keys if isinstance(key, tuple) and key[0] == 'category'}
+    if category_ids:
+        # The boat details embed their category
+        boat_ids |= set(BoatViewSet.queryset.filter(category__in=category_ids).values_list('pk', flat=True))
+    written = publish_boats(boat_ids)
+    for name in LISTS:
+        if name in keys:
+            written += write_snapshot(name, render_list(name))
+    return written
+
+def publish_all():
+    """Publish every snapshot and remove the ones of the boats no longer listed"""
+    published = set(BoatViewSet.queryset.values_list('pk', flat=True))
+    boats_dir = os.path.join(settings.SNAPSHOT_DIR, 'boats')
+    stale = set()
+    if os.path.isdir(boats_dir):
+        stale = {int(name) for name in os.listdir(boats_dir) if name.isdigit()} - published
+    return publish(set(LISTS) | {('boat', pk) for pk in published | stale})
+
+def render_list(name):
+    context = {'request': SnapshotRequest()}
+    if name == 'boats':
+        return render_boat_cards(BoatViewSet.queryset.select_related('category'), context)
+    if name == 'featured-boats':
+        # The featured boats view has no request in its context
+        featured = Boat.objects.filter(is_active=True, is_featured=True).order_by('-created_at')
+        return render_boat_cards(featured.select_related('category'), {})
+    viewset, serializer_class = {
+        'categories': (BoatCategoryViewSet, BoatCategorySerializer),
+        'testimonials': (TestimonialViewSet, TestimonialSerializer),
+        'blog': (BlogPostViewSet, BlogPostSerializer),
+    }[name]
+    return render(serializer_class(viewset.queryset.all(), many=True, context=context).data)
+
+def render_boat_cards(queryset, context):
+    # Main images and videos loaded a batch of boats at a time
+    return render(async_to_sync(serialize_boats)(list(queryset), context))
+
+def publish_boats(boat_ids):
+    """Write the detail snapshots of the listed boats among boat_ids, remove the others"""
+    written = 0
+    boat_ids = sorted(boat_ids)
+    queryset = BoatViewSet.queryset.select_related('category').prefetch_related(
+        'images', 'videos', 'amenity_items', 'technical_detail_items'
+    )
+    context = {'request': SnapshotRequest()}
+    for start in range(0, len(boat_ids), BATCH_SIZE):
+        batch = boat_ids[start:start + BATCH_SIZE]
+        boats = {boat.pk: boat for boat in queryset.filter(pk__in=batch)}
+        for pk in batch:
+            name = os.path.join('boats', str(pk))
+            if pk in boats:
+                written += write_snapshot(name, render(BoatSerializer(boats[pk], context=context).data))
+            else:
+                written += remove_snapshot(name)
+    return written
+
+def render(data):
+    # Same renderer as the API views
+    return JSONRenderer().render(data)
+
+def snapshot_path(name):
+    return os.path.join(settings.SNAPSHOT_DIR, name, 'index.json')
+
+def write_snapshot(name, content):
+    """Atomically replace the JSON file of name and its gzip copy, unless unchanged.
+    Returns 1 when the files were written."""
+    path = snapshot_path(name)
+    try:
+        with open(path, 'rb') as existing:
+            if existing.read() == content:
+                return 0
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # The compressed copy first, served by nginx (gzip_static) to most clients
+    replace_file(path + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+    replace_file(path, content)
+    return 1
+
+def remove_snapshot(name):
+    path = snapshot_path(name)
+    removed = 0
+    for file_path in (path, path + '.gz'):
+        try:
+            os.remove(file_path)
+            removed = 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def replace_file(path, content):
+    # Written next to the destination so the rename stays on the same filesystem
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(content)
+        # Readable by the web server, mkstemp creates the file as 0600
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
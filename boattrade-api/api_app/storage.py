@@ -0,0 +1,50 @@
+import hashlib
+import posixpath
+import re
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+# Hex digits of the content digest in the file names
+HASH_LENGTH = 12
+HASHED_NAME = re.compile(r'^(?P<stem>.*)\.(?P<digest>[0-9a-f]{%d})(?P<ext>\.[^./]+)?$' % HASH_LENGTH)
+# Name as chosen by the uploader, before the suffixes the storage adds to taken names and the digest
+ORIGINAL_NAME = re.compile(r'^(?P<stem>.*?)(?:_[A-Za-z0-9]{7})*(?:\.[0-9a-f]{%d})?(?P<ext>\.[^./]+)?$' % HASH_LENGTH)
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+def hashed_name(name, content):
+    """name with the digest of content before its extension: boats/ab/photo.jpg becomes
+    boats/ab/photo.<digest>.jpg, an outdated digest is replaced"""
+    directory, file_name = posixpath.split(str(name).replace('\\', '/'))
+    stem, ext = posixpath.splitext(file_name)
+    match = HASHED_NAME.match(file_name)
+    if match:
+        stem, ext = match['stem'], match['ext'] or ''
+    return posixpath.join(directory, f"{stem}.{content_hash(content)}{ext}")
+
+def original_name(file_name):
+    """file_name without the digest added by hashed_name nor the _xxxxxxx suffixes of taken names:
+    photo.jpg, photo.<digest>.jpg and photo_Ab3dE5f.<digest>.jpg all give photo.jpg"""
+    match = ORIGINAL_NAME.match(file_name)
+    if match and match['stem']:
+        return f"{match['stem']}{match['ext'] or ''}"
+    return file_name
+
+def is_hashed_name(name):
+    return HASHED_NAME.match(posixpath.basename(name)) is not None
+
+class HashedFileSystemStorage(FileSystemStorage):
+    """Stores every file under a name carrying the digest of its content, computed once when
+    saved. Replacing a file gives it a new URL, so the media can be cached as immutable."""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        # The storage shortens the part before the digest when max_length requires it
+        return super().save(hashed_name(name, content), content, max_length)
@@ -0,0 +1,205 @@
+import io
+import datetime
+import random
+from django.core.files.base import ContentFile
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import F, Max
+from PIL import Image
+
+from .storage import hashed_name
+from .models import (
+    Boat, BoatCategory, BoatImage, BoatVideo, AmenityItem, TechnicalDetailItem,
+    Inquiry, SellRequest
+)
+
+# Boats of a synthetic catalog are recognised by this external_ref prefix
+REF_PREFIX = 'SYN'
+
+CATEGORIES = {
+    "Voiliers": ["Bénéteau Oceanis", "Jeanneau Sun Odyssey", "Dufour Grand Large", "Bavaria Cruiser", "Hanse", "Pogo"],
+    "Bateaux à moteur": ["Jeanneau Merry Fisher", "Bénéteau Antares", "Quicksilver Activ", "Bayliner VR5", "Sea Ray"],
+    "Catamarans": ["Lagoon", "Fountaine Pajot", "Leopard", "Nautitech", "Bali"],
+    "Semi-rigides": ["Zodiac Medline", "Bombard Sunrider", "3D Tender", "Joker Boat Clubman"],
+    "Vedettes": ["Princess", "Fairline Targa", "Sunseeker Manhattan", "Azimut"],
+}
+PORTS = [
+    "La Rochelle", "Marseille", "Brest", "Saint-Malo", "Antibes", "Lorient", "Toulon",
+    "Arcachon", "Les Sables-d'Olonne", "Bastia", "La Trinité-sur-Mer", "Cherbourg", "Sète",
+]
+CONDITIONS = [
+    "Très bon état général, entretien suivi par un chantier.",
+    "Bateau bien équipé, idéal pour la croisière en famille.",
+    "Première main, hivernage à terre chaque année.",
+    "Quelques travaux de cosmétique à prévoir, moteur révisé.",
+    "Carène refaite l'an dernier, voiles récentes.",
+]
+FIRST_NAMES = ["Jean", "Marie", "Pierre", "Sophie", "Luc", "Camille", "Nicolas", "Julie", "Antoine", "Claire"]
+LAST_NAMES = ["Martin", "Bernard", "Dubois", "Durand", "Lefèvre", "Moreau", "Laurent", "Simon", "Michel", "Garcia"]
+INTERIOR = ["Cuisine équipée", "Douche", "Réfrigérateur", "Chauffage", "Eau chaude", "Four", "Carré transformable"]
+EXTERIOR = ["Bimini", "Capote de descente", "Douche de pont", "Plateforme de bain", "Guindeau électrique", "Annexe"]
+DETAILS = {
+    'electricity_equipment': [("Batteries", ["2 x 110 Ah", "3 x 140 Ah"]), ("Panneaux solaires", ["100 W", "200 W"])],
+    'rigging_sails': [("Grand-voile", ["Lattée", "Enrouleur"]), ("Génois", ["Enrouleur", "Autovireur"])],
+    'electronics': [("GPS", ["Garmin", "Raymarine"]), ("Pilote automatique", ["Raymarine", "B&G"]), ("VHF", ["Navicom"])],
+}
+FUEL_TYPES = ["Diesel", "Essence", "Électrique"]
+
+# Listings are spread backwards from this date, the catalog does not depend on the day it is generated
+EPOCH = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+def placeholder_image(storage, name='boats/synthetic/placeholder.jpg'):
+    """Store a small JPEG once and return its name, shared by the synthetic image rows"""
+    output = io.BytesIO()
+    Image.new('RGB', (64, 48), (30, 90, 140)).save(output, format='JPEG')
+    content = ContentFile(output.getvalue())
+    # The storage saves the file under its hashed name, look for that one
+    stored_name = hashed_name(name, content)
+    if not storage.exists(stored_name):
+        stored_name = storage.save(name, content)
+    return stored_name
+
+class CatalogGenerator:
+    """Deterministic synthetic catalog: boat number N is the same for a given seed whatever
+    the batch it is generated in, so catalogs can be topped up and benchmark runs compared.
+
+    Rows are inserted with bulk_create, one transaction per batch of boats.
+    """
+
+    def __init__(self, seed=0, batch_size=5000, images_per_boat=3, inquiries_per_boat=2, image_names=None,
+                 using='default'):
+        self.seed = seed
+        self.batch_size = batch_size
+        self.images_per_boat = images_per_boat
+        self.inquiries_per_boat = inquiries_per_boat
+        # Callable (boat index, image index) -> stored image name
+        self.image_names = image_names or self.shared_placeholder
+        self.using = using
+
+    def shared_placeholder(self, index, image_index):
+        if not hasattr(self, '_placeholder'):
+            self._placeholder = placeholder_image(BoatImage._meta.get_field('image').storage)
+        return self._placeholder
+
+    def ref(self, index):
+        return f"{REF_PREFIX}-{self.seed}-{index:07d}"
+
+    def sell_request_marker(self):
+        """End of the comment of the sell requests of this seed, which have no external_ref"""
+        return f"({REF_PREFIX}-{self.seed})"
+
+    def existing_count(self):
+        """Number of boats of this seed already generated"""
+        return Boat.objects.using(self.using).filter(external_ref__startswith=f"{REF_PREFIX}-{self.seed}-").count()
+
+    def categories(self):
+        return {name: BoatCategory.objects.using(self.using).get_or_create(name=name)[0].pk for name in CATEGORIES}
+
+    def generate(self, count, start=None, progress=None):
+        """Add boats start..start+count-1 with their related rows, returns the counts created"""
+        start = self.existing_count() if start is None else start
+        categories = self.categories()
+        totals = dict.fromkeys(['boats', 'images', 'videos', 'amenities', 'details', 'inquiries', 'sell_requests'], 0)
+        for batch_start in range(start, start + count, self.batch_size):
+            batch_end = min(batch_start + self.batch_size, start + count)
+            counts = self.generate_batch(range(batch_start, batch_end), categories)
+            for key, value in counts.items():
+                totals[key] += value
+            if progress:
+                progress(batch_end - start, count)
+
+        connection = connections[self.using]
+        if count and connection.vendor == 'postgresql':
+            # Boat ids were assigned here, move the sequence past them
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Boat]):
+                    cursor.execute(sql)
+        return totals
+
+    def generate_batch(self, indexes, categories):
+        with transaction.atomic(using=self.using):
+            next_id = (Boat.objects.using(self.using).aggregate(last=Max('id'))['last'] or 0) + 1
+            boats, images, videos, amenities, details, inquiries = [], [], [], [], [], []
+            for boat_id, index in enumerate(indexes, start=next_id):
+                rng = random.Random(f"{self.seed}-{index}")
+                boat = self.boat(index, rng, categories)
+                boats.append(Boat(id=boat_id, **boat))
+                images += [
+                    BoatImage(boat_id=boat_id, image=self.image_names(index, position), is_main=position == 0,
+                              position=position)
+                    for position in range(self.images_per_boat)
+                ]
+                if rng.random() < 0.1:
+                    videos.append(BoatVideo(boat_id=boat_id, title="Visite du bateau",
+                                            video_url=f"https://www.youtube.com/watch?v=syn{index:07d}", is_main=True))
+                amenities += [AmenityItem(boat_id=boat_id, category='interior', name=name)
+                              for name in rng.sample(INTERIOR, rng.randint(2, 5))]
+                amenities += [AmenityItem(boat_id=boat_id, category='exterior', name=name)
+                              for name in rng.sample(EXTERIOR, rng.randint(1, 4))]
+                for category, items in DETAILS.items():
+                    for name, values in rng.sample(items, rng.randint(1, len(items))):
+                        details.append(TechnicalDetailItem(boat_id=boat_id, category=category, name=name,
+                                                           value=rng.choice(values)))
+                inquiries += [self.inquiry(boat_id, boat['created_at'], rng)
+                              for _ in range(rng.randint(0, 2 * self.inquiries_per_boat))]
+            sell_requests = [self.sell_request(random.Random(f"{self.seed}-sell-{index}"))
+                             for index in indexes if index % 10 == 0]
+
+            for model, rows in ((Boat, boats), (BoatImage, images), (BoatVideo, videos), (AmenityItem, amenities),
+                                (TechnicalDetailItem, details), (Inquiry, inquiries), (SellRequest, sell_requests)):
+                model.objects.using(self.using).bulk_create(rows, batch_size=self.batch_size)
+            # updated_at is set to now by bulk_create (auto_now), the listings were last updated when created
+            Boat.objects.using(self.using).filter(id__gte=next_id).update(updated_at=F('created_at'))
+        return {
+            'boats': len(boats), 'images': len(images), 'videos': len(videos), 'amenities': len(amenities),
+            'details': len(details), 'inquiries': len(inquiries), 'sell_requests': len(sell_requests),
+        }
+
+    def boat(self, index, rng, categories):
+        category = rng.choice(list(CATEGORIES))
+        model = rng.choice(CATEGORIES[category])
+        length = round(rng.uniform(4, 20), 2)
+        year = rng.randint(1975, 2024)
+        port = rng.choice(PORTS)
+        created_at = EPOCH - datetime.timedelta(minutes=index * 7 + rng.randint(0, 6))
+        return {
+            'title': f"{model} {round(length * 3.28)}",
+            'category_id': categories[category],
+            'description': f"{model} de {year} basé à {port}. {rng.choice(CONDITIONS)}",
+            'price': int(round(rng.lognormvariate(11, 0.9), -2)),
+            'length': length,
+            'width': round(length * rng.uniform(0.3, 0.45), 2),
+            'year_built': year,
+            'engine_power': f"{rng.choice([10, 20, 30, 40, 60, 90, 150, 250, 400])} CV",
+            'fuel_type': rng.choice(FUEL_TYPES),
+            'location': port,
+            'created_at': created_at,
+            'is_active': rng.random() < 0.9,
+            'is_featured': rng.random() < 0.02,
+            'external_ref': self.ref(index),
+        }
+
+    def person(self, rng):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        email = f"{first_name}.{last_name}{rng.randint(1, 999)}@example.com".lower()
+        return first_name, last_name, email, f"06{rng.randint(0, 99999999):08d}"
+
+    def inquiry(self, boat_id, boat_created_at, rng):
+        created_at = boat_created_at + datetime.timedelta(days=rng.randint(1, 120))
+        first_name, last_name, email, phone = self.person(rng)
+        return Inquiry(
+            boat_id=boat_id, first_name=first_name, last_name=last_name, email=email, phone=phone,
+            comment="Bonjour, ce bateau est-il toujours disponible ? Je souhaiterais le visiter.",
+            created_at=created_at, is_processed=rng.random() < 0.7,
+        )
+
+    def sell_request(self, rng):
+        category = rng.choice(list(CATEGORIES))
+        created_at = EPOCH - datetime.timedelta(days=rng.randint(0, 900))
+        first_name, last_name, email, phone = self.person(rng)
+        return SellRequest(
+            first_name=first_name, last_name=last_name, email=email, phone=phone,
+            boat_details=f"{rng.choice(CATEGORIES[category])} de {rng.randint(1980, 2023)}, visible à {rng.choice(PORTS)}.",
+            comment=f"Merci de me recontacter pour une estimation. {self.sell_request_marker()}",
+            created_at=created_at, is_processed=rng.random() < 0.5,
+        )
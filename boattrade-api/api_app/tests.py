@@ -1,3 +1,1530 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.contrib.sessions.models import Session
+from django.db import connection, router
+from django.db.utils import ConnectionHandler
+from django.db.models import QuerySet, Sum
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.urls import resolve
+from django.utils import timezone
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from . import cdn, counters, metrics, snapshots
+from .analytics import rebuild_rollups
+from .backup import check_integrity, online_backup
+from .backup_store import ChunkStore
+from .images import _process_in_worker, process_image, save_processed_images, stage_uploads, staged_files
+from .emails import claim_due_emails, deliver_queued_emails
+from .synthetic import CatalogGenerator
+from .middleware import ReplicaRoutingMiddleware, RequestTimingMiddleware
+from .timing import RequestTiming, current_timing, timed
+from .views import serve_media
+from .admin import EstimatedCountPaginator, InquiryAdmin
+from .importers import BoatImporter, read_rows
+from .models import ShardedUploadTo, sharded_upload_path
+from .models import AmenityItem, Boat, BoatCategory, BoatDailyStat, BoatImage, BoatVideo, CategoryDailyStat, LeadDailyStat, Inquiry, OutboundEmail, SellRequest, SellRequestImage, BlogPost, Testimonial, CatalogEvent
+
+
+def create_boat(**kwargs):
+    category = kwargs.pop('category', None) or BoatCategory.objects.create(name="Voiliers")
+    defaults = {'title': "Bateau test", 'description': "Description", 'price': 10000}
+    defaults.update(kwargs)
+    return Boat.objects.create(category=category, **defaults)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', ADMIN_EMAIL='admin@example.com')
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.boat = create_boat()
+
+    def submit_inquiry(self):
+        return self.client.post('/inquiries/', {
+            'boat': self.boat.pk,
+            'first_name': "Jean",
+            'last_name': "Dupont",
+            'email': "jean@example.com",
+            'comment': "Intéressé",
+        }, secure=True)
+
+    def test_inquiry_is_queued_not_sent(self):
+        response = self.submit_inquiry()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.status, OutboundEmail.STATUS_PENDING)
+        self.assertEqual(email.recipients, ['admin@example.com'])
+        self.assertIn(self.boat.title, email.subject)
+
+    def test_worker_sends_batch_over_one_connection(self):
+        self.submit_inquiry()
+        self.submit_inquiry()
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            call_command('send_queued_emails', stdout=mock.MagicMock())
+
+        self.assertEqual(open_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.STATUS_SENT).exists())
+
+    def test_connection_is_reopened_once_after_a_failure(self):
+        for _ in range(3):
+            self.submit_inquiry()
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection, \
+                mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                           side_effect=[SMTPException("boom"), 1, 1]), \
+                self.assertLogs('api_app.emails', 'ERROR'):
+            self.assertEqual(deliver_queued_emails(), (2, 1))
+
+        # Reopened right after the failure, the last two emails share that connection
+        self.assertEqual(open_connection.call_count, 2)
+
+    @override_settings(EMAIL_OUTBOX_CLAIM_TIMEOUT=300)
+    def test_claimed_emails_are_not_sent_by_another_worker(self):
+        self.submit_inquiry()
+        self.submit_inquiry()
+        now = timezone.now()
+
+        self.assertEqual(len(claim_due_emails(now, 10)), 2)
+        # A concurrent worker finds nothing left to send
+        self.assertEqual(claim_due_emails(now, 10), [])
+        # Claims of a worker that died are released after the timeout
+        self.assertEqual(len(claim_due_emails(now + datetime.timedelta(seconds=301), 10)), 2)
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2, EMAIL_OUTBOX_RETRY_DELAY=60)
+    def test_failures_are_retried_with_backoff(self):
+        self.submit_inquiry()
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=SMTPException("boom")), self.assertLogs('api_app.emails', 'ERROR'):
+            self.assertEqual(deliver_queued_emails(), (0, 1))
+            email = OutboundEmail.objects.get()
+            self.assertEqual(email.status, OutboundEmail.STATUS_PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertGreater(email.next_attempt_at, email.created_at)
+
+            # Not due yet, nothing is attempted
+            self.assertEqual(deliver_queued_emails(), (0, 0))
+
+            OutboundEmail.objects.update(next_attempt_at=email.created_at)
+            deliver_queued_emails()
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.STATUS_FAILED)
+        self.assertEqual(email.last_error, "boom")
+
+
+class SellRequestImageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            UPLOAD_STAGING_DIR=f"{self.media_root}/staging",
+            IMAGE_PROCESSING_WORKERS=0,
+            IMAGE_MAX_DIMENSION=100,
+            SELL_REQUEST_MAX_IMAGE_MB=1,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def jpeg(self, name, size=(400, 200)):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90° clockwise
+        output = io.BytesIO()
+        Image.new('RGB', size, 'blue').save(output, format='JPEG', exif=exif)
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+    def submit(self, images):
+        return self.client.post('/sell-requests/', {
+            'first_name': "Jean",
+            'last_name': "Dupont",
+            'email': "jean@example.com",
+            'boat_details': "Voilier 10m",
+            'images': images,
+        }, secure=True)
+
+    def test_images_are_normalized_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.submit([self.jpeg("a.jpg"), self.jpeg("b.jpg")])
+
+        self.assertEqual(response.status_code, 201)
+        images = SellRequestImage.objects.filter(sell_request_id=response.data['id'])
+        self.assertEqual(images.count(), 2)
+        for sell_request_image in images:
+            with Image.open(sell_request_image.image.path) as image:
+                self.assertEqual(image.size, (50, 100))
+                self.assertNotIn('exif', image.info)
+
+    def test_oversized_upload_is_rejected(self):
+        big = SimpleUploadedFile("big.jpg", b"x" * (2 * 1024 * 1024), content_type='image/jpeg')
+
+        response = self.submit([big])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('images', response.data)
+        self.assertFalse(SellRequest.objects.exists())
+
+    def test_streamed_uploads_are_moved_into_staging(self):
+        uploaded = TemporaryUploadedFile("a.jpg", 'image/jpeg', 0, None)
+        uploaded.write(b"contenu")
+        uploaded.flush()
+        temporary_path = uploaded.temporary_file_path()
+
+        staging_dir = stage_uploads([uploaded, SimpleUploadedFile("b.jpg", b"memoire")], 'sell_request')
+        uploaded.close()
+
+        self.assertFalse(os.path.exists(temporary_path))
+        self.assertEqual([name for path, name in staged_files(staging_dir)], ["a.jpg", "b.jpg"])
+        with open(staged_files(staging_dir)[0][0], 'rb') as staged:
+            self.assertEqual(staged.read(), b"contenu")
+
+    def test_only_pool_threads_close_the_database_connection(self):
+        sell_request = SellRequest.objects.create(first_name="Jean", last_name="Dupont", email="jean@example.com",
+                                                  boat_details="Voilier 10m")
+
+        with override_settings(IMAGE_PROCESSING_WORKERS=2), mock.patch.object(connection, 'close') as close:
+            # Inline, as process_staged_uploads does, the caller's connection stays open
+            save_processed_images(SellRequestImage, 'image', stage_uploads([self.jpeg("a.jpg")], 'sell_request'),
+                                  sell_request_id=sell_request.pk)
+            close.assert_not_called()
+            _process_in_worker(SellRequestImage, 'image', stage_uploads([self.jpeg("b.jpg")], 'sell_request'),
+                               sell_request_id=sell_request.pk)
+            close.assert_called_once_with()
+        self.assertEqual(sell_request.images.count(), 2)
+
+    def test_animated_images_are_kept_as_they_are(self):
+        path = os.path.join(self.media_root, 'anim.gif')
+        frames = [Image.new('RGB', (400, 200), color) for color in ('red', 'blue')]
+        frames[0].save(path, format='GIF', save_all=True, append_images=frames[1:], duration=100, loop=0)
+
+        processed = process_image(path)
+
+        with open(path, 'rb') as original:
+            self.assertEqual(processed.read(), original.read())
+        with Image.open(path) as image:
+            self.assertEqual((image.size, image.n_frames), ((400, 200), 2))
+
+
+class SqliteProfileTests(SimpleTestCase):
+    def test_production_pragmas_are_applied_to_new_connections(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Only the production alias is connected to
+        handler = ConnectionHandler({'default': {}, 'production': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory, 'db.sqlite3'),
+            'OPTIONS': settings.SQLITE_PRODUCTION_OPTIONS,
+        }})
+        production = handler['production']
+        self.addCleanup(production.close)
+
+        with production.cursor() as cursor:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store'):
+                cursor.execute(f"PRAGMA {name}")
+                pragmas[name] = cursor.fetchone()[0]
+
+        # synchronous NORMAL is 1, temp_store MEMORY is 2
+        self.assertEqual(pragmas, {
+            'journal_mode': 'wal',
+            'synchronous': 1,
+            'busy_timeout': settings.SQLITE_PRAGMAS['busy_timeout'],
+            'temp_store': 2,
+        })
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def route(self, request, status=200):
+        """Return the alias used for reads during the request and the response"""
+        used = {}
+
+        def view(request):
+            used['alias'] = router.db_for_read(Boat)
+            return HttpResponse(status=status)
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return used['alias'], response
+
+    def test_safe_api_reads_use_replica(self):
+        alias, _ = self.route(RequestFactory().get('/boats/'))
+        self.assertEqual(alias, 'replica_1')
+
+    def test_sessions_and_users_are_read_from_primary(self):
+        used = {}
+
+        def view(request):
+            used['aliases'] = [router.db_for_read(model) for model in (Session, get_user_model(), Permission)]
+            return HttpResponse()
+
+        ReplicaRoutingMiddleware(view)(RequestFactory().get('/boats/'))
+        self.assertEqual(used['aliases'], ['default', 'default', 'default'])
+
+    def test_admin_and_writes_use_primary(self):
+        self.assertEqual(self.route(RequestFactory().get('/admin/api_app/boat/'))[0], 'default')
+        self.assertEqual(self.route(RequestFactory().post('/inquiries/'))[0], 'default')
+        self.assertEqual(router.db_for_write(Boat), 'default')
+
+    def test_reads_stick_to_primary_after_write(self):
+        _, response = self.route(RequestFactory().post('/inquiries/'), status=201)
+        cookie = response.cookies[settings.REPLICA_STICKY_COOKIE]
+
+        request = RequestFactory().get('/boats/')
+        request.COOKIES[settings.REPLICA_STICKY_COOKIE] = cookie.value
+        self.assertEqual(self.route(request)[0], 'default')
+
+    def test_failed_write_is_not_sticky(self):
+        _, response = self.route(RequestFactory().post('/inquiries/'), status=400)
+        self.assertNotIn(settings.REPLICA_STICKY_COOKIE, response.cookies)
+
+
+class ReadOnlyTransactionTests(SimpleTestCase):
+    def test_read_only_views_skip_request_transaction(self):
+        for path in ['/boats/', '/boats/1/', '/categories/', '/testimonials/', '/blog/',
+                     '/featured-boats/', '/sitemap.xml']:
+            with self.subTest(path=path):
+                self.assertIn('default', getattr(resolve(path).func, '_non_atomic_requests', set()))
+
+    def test_write_views_keep_request_transaction(self):
+        for path in ['/inquiries/', '/sell-requests/']:
+            with self.subTest(path=path):
+                self.assertNotIn('default', getattr(resolve(path).func, '_non_atomic_requests', set()))
+
+
+class AdminQueryBudgetTests(TestCase):
+    # Session, user, count, results and filter choices
+    QUERY_BUDGET = 10
+
+    def setUp(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        self.category = BoatCategory.objects.create(name="Voiliers")
+
+    def add_rows(self, count):
+        for _ in range(count):
+            boat = create_boat(category=self.category)
+            Inquiry.objects.create(boat=boat, first_name="Jean", last_name="Dupont",
+                                   email="jean@example.com", comment="Intéressé")
+            SellRequest.objects.create(first_name="Jean", last_name="Dupont",
+                                       email="jean@example.com", boat_details="Voilier")
+            BoatVideo.objects.create(boat=boat, title="Visite", video_url="https://youtu.be/x")
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = ['/admin/api_app/boat/', '/admin/api_app/inquiry/',
+                '/admin/api_app/sellrequest/', '/admin/api_app/boatvideo/']
+        self.add_rows(2)
+        small = {url: self.changelist_queries(url) for url in urls}
+        self.add_rows(20)
+
+        for url in urls:
+            with self.subTest(url=url):
+                queries = self.changelist_queries(url)
+                self.assertEqual(queries, small[url])
+                self.assertLessEqual(queries, self.QUERY_BUDGET)
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=10)
+    def test_large_unfiltered_changelist_uses_estimate(self):
+        self.add_rows(12)
+        Inquiry.objects.filter(pk=Inquiry.objects.order_by('pk').first().pk).delete()
+
+        # MAX(rowid) overestimates after deletions, filtered lists still count exactly
+        self.assertEqual(EstimatedCountPaginator(Inquiry.objects.order_by('-created_at'), 100).count, 12)
+        self.assertEqual(EstimatedCountPaginator(Inquiry.objects.filter(is_processed=False).order_by('-created_at'), 100).count, 11)
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=10)
+    def test_pages_past_the_estimate_fall_back_to_the_last_one(self):
+        self.add_rows(12)
+        Inquiry.objects.filter(pk__in=Inquiry.objects.order_by('pk').values('pk')[:5]).delete()
+
+        paginator = EstimatedCountPaginator(Inquiry.objects.order_by('pk'), 5)
+        self.assertEqual(paginator.num_pages, 3)
+        page = paginator.page(3)
+        self.assertEqual((page.number, len(page.object_list), paginator.count, paginator.num_pages), (2, 2, 7, 2))
+
+        with mock.patch.object(InquiryAdmin, 'list_per_page', 5):
+            response = self.client.get('/admin/api_app/inquiry/?p=3', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.context['cl'].page_num, response.context['cl'].result_count), (2, 7))
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+
+
+class BoatQueryPlanTests(TestCase):
+    def test_boat_filters_do_not_scan_the_table(self):
+        create_boat()
+        call_command('explain_boat_queries', '--fail-on-scan', stdout=io.StringIO())
+
+
+class BoatImportTests(TestCase):
+    CSV = (
+        "external_ref,title,category,description,price,year_built,amenities_interior,technical_details,images\n"
+        "B-1,Voilier 10m,Voiliers,Description,45000,2005,Cuisine|Douche,electronics:GPS=Garmin,b1.jpg|b1-2.jpg\n"
+        "B-2,Vedette,Moteurs,Description,abc,2010,,,\n"
+        "B-3,Catamaran,Voiliers,Description,120000,2015,,,absent.jpg\n"
+    )
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_MAX_DIMENSION=100)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def archive(self):
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w') as archive:
+            for name in ('b1.jpg', 'b1-2.jpg'):
+                image = io.BytesIO()
+                Image.new('RGB', (400, 200), 'blue').save(image, format='JPEG')
+                archive.writestr(f"photos/{name}", image.getvalue())
+        output.seek(0)
+        return output
+
+    def run_import(self, csv):
+        rows = read_rows(io.BytesIO(csv.encode()), 'csv')
+        return BoatImporter(archive=self.archive(), workers=2).run(rows)
+
+    def test_import_reports_invalid_rows(self):
+        result = self.run_import(self.CSV)
+
+        self.assertEqual((result.created, result.updated, result.images), (1, 0, 2))
+        self.assertEqual([row for row, _ in result.errors], [2, 3])
+        boat = Boat.objects.get(external_ref='B-1')
+        self.assertEqual(boat.category.name, "Voiliers")
+        # The category of the rejected row is not created
+        self.assertEqual(list(BoatCategory.objects.values_list('name', flat=True)), ["Voiliers"])
+        self.assertEqual(set(AmenityItem.objects.filter(boat=boat).values_list('name', flat=True)), {"Cuisine", "Douche"})
+        self.assertEqual(boat.technical_detail_items.get().value, "Garmin")
+        self.assertEqual(BoatImage.objects.get(boat=boat, is_main=True).image.width, 100)
+
+    def test_reimport_updates_in_place(self):
+        self.run_import(self.CSV)
+        result = self.run_import(self.CSV.replace("45000", "42000").replace("Cuisine|Douche", "Cuisine"))
+
+        self.assertEqual((result.created, result.updated, result.images), (0, 1, 0))
+        boat = Boat.objects.get(external_ref='B-1')
+        self.assertEqual(boat.price, 42000)
+        self.assertEqual(boat.amenity_items.count(), 1)
+        self.assertEqual(boat.images.count(), 2)
+
+    def test_replaced_photos_are_removed_from_storage(self):
+        self.run_import(self.CSV)
+        boat = Boat.objects.get(external_ref='B-1')
+        old_paths = [image.image.path for image in boat.images.all()]
+
+        rows = read_rows(io.BytesIO(self.CSV.encode()), 'csv')
+        with self.captureOnCommitCallbacks(execute=True):
+            result = BoatImporter(archive=self.archive(), replace_images=True).run(rows)
+
+        self.assertEqual(result.images, 2)
+        self.assertEqual(boat.images.count(), 2)
+        self.assertTrue(all(os.path.exists(image.image.path) for image in boat.images.all()))
+        self.assertFalse(any(os.path.exists(path) for path in old_paths))
+
+    def test_photos_sharing_a_file_name_are_named_by_path(self):
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w') as archive:
+            for name, color in (('a/1.jpg', 'blue'), ('b/1.jpg', 'red')):
+                image = io.BytesIO()
+                Image.new('RGB', (40, 20), color).save(image, format='JPEG')
+                archive.writestr(name, image.getvalue())
+        output.seek(0)
+        rows = read_rows(io.BytesIO(
+            b"external_ref,title,category,description,price,images\n"
+            b"B-1,Voilier,Voiliers,Description,45000,1.jpg\n"
+            b"B-2,Vedette,Moteurs,Description,30000,b/1.jpg\n"
+        ), 'csv')
+
+        result = BoatImporter(archive=output).run(rows)
+
+        self.assertEqual([row for row, _ in result.errors], [1])
+        self.assertIn("a/1.jpg, b/1.jpg", result.errors[0][1])
+        image = BoatImage.objects.get(boat__external_ref='B-2')
+        self.assertGreater(Image.open(image.image.path).getpixel((10, 10))[0], 200)
+
+    def test_partial_reimport_keeps_the_columns_left_out(self):
+        self.run_import(self.CSV)
+        Boat.objects.filter(external_ref='B-1').update(location="Brest", is_featured=True, is_active=False)
+
+        result = self.run_import("external_ref,price\nB-1,41000\nB-9,50000\n")
+
+        self.assertEqual((result.created, result.updated), (0, 1))
+        self.assertEqual([row for row, _ in result.errors], [2])
+        boat = Boat.objects.get(external_ref='B-1')
+        self.assertEqual(boat.price, 41000)
+        self.assertEqual((boat.title, boat.location, boat.category.name), ("Voilier 10m", "Brest", "Voiliers"))
+        self.assertEqual((boat.is_active, boat.is_featured), (False, True))
+        self.assertEqual(boat.amenity_items.count(), 2)
+        self.assertEqual(boat.technical_detail_items.count(), 1)
+        self.assertFalse(Boat.objects.filter(external_ref='B-9').exists())
+
+
+class BoatImageManagerTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            UPLOAD_STAGING_DIR=f"{self.media_root}/staging",
+            IMAGE_PROCESSING_WORKERS=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        self.boat = create_boat()
+        self.url = f'/admin/api_app/boat/{self.boat.pk}/images/'
+
+    def png(self, name):
+        output = io.BytesIO()
+        Image.new('RGB', (40, 20), 'blue').save(output, format='PNG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+    def test_uploads_are_appended_in_order(self):
+        BoatImage.objects.create(boat=self.boat, image=self.png("first.png"))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url + 'upload/', {'images': [self.png("a.png"), self.png("b.png")]},
+                                        secure=True)
+
+        self.assertEqual(response.status_code, 202)
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual([image['position'] for image in response.json()['images']], [0, 1, 2])
+
+    def test_concurrent_batches_get_distinct_positions(self):
+        BoatImage.objects.create(boat=self.boat, image=self.png("first.png"), position=0)
+        batches = [stage_uploads([self.png(f"{batch}{index}.png") for index in range(2)], f"boat_{self.boat.pk}")
+                   for batch in "ab"]
+
+        with CaptureQueriesContext(connection) as queries:
+            save_processed_images(BoatImage, 'image', batches[0], 'position', boat_id=self.boat.pk)
+        save_processed_images(BoatImage, 'image', batches[1], 'position', boat_id=self.boat.pk)
+
+        # The rows are inserted before the last position is read: on SQLite the insert takes
+        # the write lock, so a concurrent batch reads the position once this one committed
+        statements = [query['sql'] for query in queries.captured_queries]
+        self.assertLess(next(i for i, sql in enumerate(statements) if sql.startswith('INSERT')),
+                        next(i for i, sql in enumerate(statements) if 'MAX(' in sql))
+        self.assertEqual(list(self.boat.images.values_list('position', flat=True)), [0, 1, 2, 3, 4])
+
+    def test_reorder_and_pick_main_image(self):
+        first, second, third = [BoatImage.objects.create(boat=self.boat, image=self.png(f"{i}.png")) for i in range(3)]
+
+        response = self.client.post(self.url + 'order/', {'order': [third.pk, first.pk, second.pk]},
+                                    content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(self.boat.images.values_list('pk', flat=True)), [third.pk, first.pk, second.pk])
+
+        BoatImage.objects.filter(pk=first.pk).update(is_main=True)
+        response = self.client.post(self.url + f'{second.pk}/main/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(self.boat.images.filter(is_main=True).values_list('pk', flat=True)), [second.pk])
+
+    def test_bulk_image_changes_reschedule_the_snapshots(self):
+        first, second = [BoatImage.objects.create(boat=self.boat, image=self.png(f"{i}.png")) for i in range(2)]
+        keys = {('boat', self.boat.pk), 'boats', 'featured-boats'}
+        self.addCleanup(snapshots._pending.clear)
+
+        with override_settings(SNAPSHOT_DIR=self.media_root, SNAPSHOT_DEBOUNCE_SECONDS=3600), \
+                mock.patch.object(snapshots, '_start_publisher'):
+            for url, data in [(self.url + 'order/', {'order': [second.pk, first.pk]}),
+                              (self.url + f'{first.pk}/main/', None),
+                              (self.url + 'upload/', {'images': [self.png("a.png")]})]:
+                snapshots._pending.clear()
+                with self.subTest(url=url), self.captureOnCommitCallbacks(execute=True):
+                    if url.endswith('upload/'):
+                        self.client.post(url, data, secure=True)
+                    else:
+                        self.client.post(url, data, content_type='application/json', secure=True)
+                self.assertEqual(snapshots._pending, keys, url)
+
+    def test_upload_requires_csrf_token(self):
+        client = self.client_class(enforce_csrf_checks=True)
+        client.force_login(get_user_model().objects.get())
+        response = client.post(self.url + 'upload/', {'images': [self.png("a.png")]}, secure=True)
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(VIEW_COUNTER_FLUSH_INTERVAL=3600)
+class ViewCounterTests(TestCase):
+    def setUp(self):
+        counters._buffer.clear()
+        self.addCleanup(counters._buffer.clear)
+        # Flushed by the tests
+        flusher = mock.patch.object(counters, '_start_flusher')
+        flusher.start()
+        self.addCleanup(flusher.stop)
+        category = BoatCategory.objects.create(name="Voiliers")
+        self.quiet = create_boat(category=category, title="Peu vu")
+        self.popular = create_boat(category=category, title="Très vu")
+
+    def test_counts_are_buffered_then_added_in_one_write(self):
+        self.client.get('/boats/', secure=True)
+        self.client.get(f'/boats/{self.popular.pk}/', secure=True)
+        self.assertFalse(BoatDailyStat.objects.exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(counters.flush_counters(), 2)
+        self.assertEqual(len([query for query in queries if 'INSERT' in query['sql']]), 1)
+
+        self.client.get(f'/boats/{self.popular.pk}/', secure=True)
+        counters.flush_counters()
+        stat = BoatDailyStat.objects.get(boat=self.popular)
+        self.assertEqual((stat.views, stat.impressions), (2, 1))
+        self.assertEqual(BoatDailyStat.objects.get(boat=self.quiet).views, 0)
+
+    @override_settings(VIEW_COUNTER_LIST_IMPRESSIONS=2)
+    def test_unpaginated_lists_count_the_first_cards_only(self):
+        newest = create_boat(category=self.quiet.category, title="Nouveau")
+
+        response = self.client.get('/boats/', secure=True)
+
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(set(counters._buffer), {(newest.pk, timezone.localdate()), (self.popular.pk, timezone.localdate())})
+
+    @override_settings(VIEW_COUNTER_FLUSH_INTERVAL=0)
+    def test_nothing_is_buffered_without_the_flush(self):
+        self.client.get(f'/boats/{self.popular.pk}/', secure=True)
+        self.assertFalse(counters._buffer)
+
+    def test_popular_ordering_decays_old_days(self):
+        today = timezone.localdate()
+        BoatDailyStat.objects.create(boat=self.quiet, date=today - datetime.timedelta(days=20), views=50)
+        # Past the window, not counted at all
+        BoatDailyStat.objects.create(boat=self.quiet, date=today - datetime.timedelta(days=400), views=100000)
+        BoatDailyStat.objects.create(boat=self.popular, date=today, views=10)
+
+        response = self.client.get('/boats/', {'ordering': 'popular'}, secure=True)
+        self.assertEqual([boat['id'] for boat in response.data], [self.popular.pk, self.quiet.pk])
+
+
+class LeadRollupTests(TestCase):
+    def setUp(self):
+        self.category = BoatCategory.objects.create(name="Voiliers")
+        self.boat = create_boat(category=self.category)
+
+    def add_leads(self, count, created_at=None):
+        for _ in range(count):
+            Inquiry.objects.create(boat=self.boat, first_name="Jean", last_name="Dupont", email="jean@example.com",
+                                   comment="Intéressé", created_at=created_at or timezone.now())
+            SellRequest.objects.create(first_name="Jean", last_name="Dupont", email="jean@example.com",
+                                       boat_details="Voilier", created_at=created_at or timezone.now())
+
+    def rollups(self):
+        return (
+            list(BoatDailyStat.objects.filter(inquiries__gt=0).order_by('date').values_list('date', 'inquiries')),
+            list(CategoryDailyStat.objects.order_by('date').values_list('date', 'inquiries')),
+            list(LeadDailyStat.objects.order_by('date').values_list('date', 'inquiries', 'sell_requests')),
+        )
+
+    def test_rollups_follow_inserts_and_rebuild(self):
+        self.add_leads(2)
+        self.add_leads(1, created_at=timezone.now() - datetime.timedelta(days=40))
+        today = timezone.localdate()
+        old = today - datetime.timedelta(days=40)
+        expected = ([(old, 1), (today, 2)], [(old, 1), (today, 2)], [(old, 1, 1), (today, 2, 2)])
+        self.assertEqual(self.rollups(), expected)
+
+        Inquiry.objects.filter(created_at__date=old).delete()
+        self.assertEqual(rebuild_rollups(), (2, 3))
+        self.assertEqual(self.rollups(), ([(today, 2)], [(today, 2)], [(old, 0, 1), (today, 2, 2)]))
+
+    def test_dashboard_queries_do_not_grow_with_leads(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+        def dashboard_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/admin/api_app/leaddailystat/', secure=True)
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        self.add_leads(1)
+        small = dashboard_queries()
+        self.add_leads(20)
+        self.assertEqual(dashboard_queries(), small)
+
+
+@override_settings(REQUEST_TIMING_ENABLED=True, REQUEST_TIMING_SAMPLE_RATE=0, REQUEST_TIMING_QUERY_WARNING=50,
+                   VIEW_COUNTER_FLUSH_INTERVAL=0)
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        self.addCleanup(counters._buffer.clear)
+        create_boat()
+
+    def test_staff_requests_get_server_timing(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+        with self.assertLogs('api_app.middleware', 'INFO') as logs:
+            response = self.client.get('/boats/', secure=True)
+
+        timings = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'db', 'serialize', 'render', 'app', 'total', 'queries'})
+        self.assertIn('"view": "boat-list"', logs.output[0])
+
+    def test_queries_run_while_serializing_are_only_counted_once(self):
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(0.05)
+            return execute(sql, params, many, context)
+
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        try:
+            with timed('serialize'), connection.execute_wrapper(slow_query):
+                Boat.objects.count()
+        finally:
+            current_timing.reset(token)
+
+        self.assertEqual(timing.queries, 1)
+        self.assertGreaterEqual(timing.sql_time, 0.05)
+        self.assertLess(timing.durations['serialize'], 0.05)
+        durations = RequestTimingMiddleware(HttpResponse).durations(timing, timing.sql_time + 0.1)
+        self.assertAlmostEqual(durations['app'], 0.1 - durations['serialize'])
+
+    def test_anonymous_requests_are_only_logged_over_the_query_budget(self):
+        response = self.client.get('/boats/', secure=True)
+        self.assertNotIn('Server-Timing', response)
+
+        with override_settings(REQUEST_TIMING_QUERY_WARNING=0):
+            with self.assertLogs('api_app.middleware', 'WARNING'):
+                response = self.client.get('/boats/', secure=True)
+        self.assertNotIn('Server-Timing', response)
+
+
+class SyntheticCatalogTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_top_ups_generate_the_same_catalog(self):
+        CatalogGenerator(seed=3, batch_size=4).generate(10)
+        in_one_go = list(Boat.objects.order_by('external_ref').values_list('external_ref', 'title', 'price'))
+        Boat.objects.all().delete()
+
+        generator = CatalogGenerator(seed=3, batch_size=4)
+        generator.generate(6)
+        counts = generator.generate(4)
+
+        self.assertEqual(counts['boats'], 4)
+        self.assertEqual(list(Boat.objects.order_by('external_ref').values_list('external_ref', 'title', 'price')),
+                         in_one_go)
+        self.assertEqual(BoatImage.objects.filter(is_main=True).count(), 10)
+        # Every generator shares the one placeholder file
+        self.assertEqual(BoatImage.objects.values('image').distinct().count(), 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'boats', 'synthetic'))), 1)
+
+    def test_generate_catalog_command_links_images_and_tops_up(self):
+        call_command('generate_catalog', boats=5, batch_size=2, images_per_boat=2, force=True, stdout=io.StringIO())
+        call_command('generate_catalog', boats=8, batch_size=2, images_per_boat=2, force=True, stdout=io.StringIO())
+
+        self.assertEqual(Boat.objects.count(), 8)
+        names = list(BoatImage.objects.values_list('image', flat=True))
+        self.assertEqual(len(set(names)), 16)
+        storage = BoatImage._meta.get_field('image').storage
+        # Every photo is its own file sharing a placeholder's data
+        self.assertTrue(all(os.stat(storage.path(name)).st_nlink > 1 for name in names))
+        self.assertEqual(LeadDailyStat.objects.aggregate(total=Sum('inquiries'))['total'] or 0,
+                         Inquiry.objects.count())
+
+        call_command('generate_catalog', boats=0, reset=True, force=True, stdout=io.StringIO())
+        self.assertFalse(Boat.objects.exists())
+        self.assertFalse(any(os.path.exists(storage.path(name)) for name in names))
+
+    def test_reset_keeps_the_other_seeds(self):
+        CatalogGenerator(seed=1).generate(20)
+        CatalogGenerator(seed=2).generate(20)
+        other_seed = set(SellRequest.objects.filter(comment__endswith='(SYN-2)').values_list('pk', flat=True))
+        self.assertEqual(len(other_seed), 2)
+        boat = Boat.objects.first()
+        # Generated with the field defaults and the listing date as last update
+        self.assertEqual((boat.updated_at, boat.images.first().caption), (boat.created_at, ''))
+
+        call_command('generate_catalog', boats=0, seed=1, reset=True, skip_rollups=True, force=True,
+                     stdout=io.StringIO())
+
+        self.assertEqual(Boat.objects.count(), 20)
+        self.assertEqual(set(SellRequest.objects.values_list('pk', flat=True)), other_seed)
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='scrape-token', METRICS_MULTIPROC_DIR='',
+                   VIEW_COUNTER_FLUSH_INTERVAL=0)
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.addCleanup(counters._buffer.clear)
+        create_boat()
+
+    def scrape(self):
+        response = self.client.get('/metrics', secure=True, HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def sample(self, text, prefix):
+        for line in text.splitlines():
+            if line.startswith(prefix + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0
+
+    def test_requests_are_counted_per_view(self):
+        before = self.scrape()
+        self.client.get('/boats/', secure=True)
+        self.client.get('/boats/', secure=True)
+        after = self.scrape()
+
+        series = 'http_requests_total{method="GET",view="boat-list",status="200"}'
+        self.assertEqual(self.sample(after, series) - self.sample(before, series), 2)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",view="boat-list",le="+Inf"}', after)
+        self.assertGreater(self.sample(after, 'db_queries_total{alias="default"}'), 0)
+        self.assertIn('media_disk_bytes{kind="free"}', after)
+
+    def test_scraping_needs_the_token_or_a_staff_user(self):
+        self.assertEqual(self.client.get('/metrics', secure=True).status_code, 403)
+        self.assertEqual(self.client.get('/metrics', secure=True, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/metrics', secure=True).status_code, 200)
+
+    def test_cache_hits_and_misses_are_counted(self):
+        cache = caches['default']
+        before = self.scrape()
+        cache.get('metrics-test')
+        cache.set('metrics-test', 1)
+        cache.get_many(['metrics-test', 'metrics-other'])
+        after = self.scrape()
+
+        for result, count in (('hit', 1), ('miss', 2)):
+            series = f'cache_requests_total{{cache="default",result="{result}"}}'
+            self.assertEqual(self.sample(after, series) - self.sample(before, series), count)
+        cache.delete('metrics-test')
+
+    def test_worker_files_are_summed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other_worker = {
+            'emails_sent_total': [[[], 3]],
+            'email_send_duration_seconds': [[[], [1] + [0] * 11 + [0.002]]],
+        }
+        with open(os.path.join(directory, 'metrics_1_other.json'), 'w') as f:
+            json.dump(other_worker, f)
+
+        with override_settings(METRICS_MULTIPROC_DIR=directory):
+            own = metrics.EMAILS_SENT.values.get((), 0)
+            metrics.EMAILS_SENT.inc()
+            text = self.scrape()
+
+        self.assertEqual(self.sample(text, 'emails_sent_total'), own + 1 + 3)
+        self.assertGreaterEqual(self.sample(text, 'email_send_duration_seconds_bucket{le="0.005"}'), 1)
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+
+@override_settings(VIEW_COUNTER_FLUSH_INTERVAL=0)
+class AsyncReadViewTests(TestCase):
+    paths = [
+        '/boats/', '/boats/?search=Lagoon&ordering=popular', '/featured-boats/', '/categories/',
+        '/testimonials/', '/blog/',
+    ]
+
+    def setUp(self):
+        self.addCleanup(counters._buffer.clear)
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        CatalogGenerator(seed=1).generate(30)
+        boat = Boat.objects.filter(is_active=True).first()
+        BoatVideo.objects.create(boat=boat, video_url="https://www.youtube.com/watch?v=x", is_main=True)
+        # The 404 last: DRF marks the test transaction for rollback when handling it
+        self.paths = self.paths + [f'/boats/{boat.pk}/', f'/categories/{boat.category_id}/', '/boats/999999/']
+        Testimonial.objects.create(name="Marie", role="Acheteuse", avatar='testimonials/marie.jpg', quote="Parfait", rating=5)
+        BlogPost.objects.create(title="Hivernage", content="Conseils", is_active=True)
+
+    def test_async_views_return_the_sync_payloads(self):
+        for path in self.paths:
+            with override_settings(ROOT_URLCONF='api_project.asgi_urls'):
+                self.assertTrue(resolve(path.split('?')[0]).url_name.startswith('async_'))
+                response = self.client.get(path, secure=True)
+            expected = self.client.get(path, secure=True)
+            self.assertEqual(response.status_code, expected.status_code, path)
+            self.assertEqual(response.json(), expected.json(), path)
+
+    def test_async_list_runs_a_bounded_number_of_queries(self):
+        with override_settings(ROOT_URLCONF='api_project.asgi_urls'):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/boats/', secure=True)
+        # Boats, main images and main videos, whatever the number of boats
+        self.assertEqual(len(queries), 3)
+
+    @override_settings(ROOT_URLCONF='api_project.asgi_urls', METRICS_ENABLED=True, METRICS_MULTIPROC_DIR='')
+    async def test_async_requests_are_measured(self):
+        before = list(metrics.REQUEST_QUERIES.values.get(('async_boat_list',), [0] * 10))
+        response = await self.async_client.get('/boats/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        after = metrics.REQUEST_QUERIES.values[('async_boat_list',)]
+        # Queries ran in the thread of sync_to_async, counted through the context variable
+        self.assertEqual(after[-1] - before[-1], 3)
+
+
+@override_settings(CATALOG_EVENTS_POLL_INTERVAL=0.05, CATALOG_EVENTS_KEEPALIVE=1, VIEW_COUNTER_FLUSH_INTERVAL=0)
+class CatalogEventTests(TestCase):
+    def test_boat_changes_are_logged_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            boat = create_boat()
+        with self.captureOnCommitCallbacks(execute=True):
+            boat.price = 12000
+            boat.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            BoatImage.objects.create(boat=boat, image='boats/photo.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            boat.is_active = False
+            boat.save()
+            boat.title = "Plus en vente"
+            boat.save()
+
+        events = list(CatalogEvent.objects.values_list('kind', 'boat_id', 'data'))
+        self.assertEqual(events, [
+            ('boat.created', boat.pk, {}),
+            ('boat.price_changed', boat.pk, {'price': 12000.0, 'previous_price': 10000.0}),
+            ('boat.updated', boat.pk, {}),
+            # Edits of a hidden boat are not published
+            ('boat.deactivated', boat.pk, {}),
+        ])
+
+    def test_polling_fallback_sends_the_events_after_the_last_id(self):
+        first = CatalogEvent.objects.create(kind='boat.created', boat_id=1)
+        CatalogEvent.objects.create(kind='boat.updated', boat_id=1)
+        CatalogEvent.objects.create(kind='boat.price_changed', boat_id=1, data={'price': 1.0, 'previous_price': 2.0})
+
+        response = self.client.get('/events/catalog/', secure=True, HTTP_LAST_EVENT_ID=str(first.pk))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = response.content.decode()
+        # The update is implied by the later price change
+        self.assertNotIn('boat.updated', body)
+        self.assertIn(f'id: {first.pk + 2}\nevent: boat.price_changed\ndata: {{"boat":1,"price":1.0,"previous_price":2.0}}',
+                      body)
+
+        response = self.client.get('/events/catalog/', secure=True, HTTP_LAST_EVENT_ID=str(first.pk - 5))
+        self.assertIn('event: reset', response.content.decode())
+
+    async def test_stream_resumes_and_pushes_new_events(self):
+        first = await CatalogEvent.objects.acreate(kind='boat.created', boat_id=1)
+        await CatalogEvent.objects.acreate(kind='boat.created', boat_id=2)
+
+        response = await self.async_client.get('/events/catalog/', secure=True, headers={'Last-Event-ID': str(first.pk)})
+        self.assertEqual(response.status_code, 200)
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry: '))
+        self.assertIn(b'"boat":2', await anext(chunks))
+
+        from asgiref.sync import sync_to_async
+        from .events import write_event
+        await sync_to_async(write_event)('boat.deactivated', 3, {}, 'default')
+        pushed = await asyncio.wait_for(anext(chunks), 5)
+        self.assertIn(b'event: boat.deactivated\ndata: {"boat":3}', pushed)
+        await response.streaming_content.aclose()
+
+
+@override_settings(SNAPSHOT_DEBOUNCE_SECONDS=3600, SITE_URL='https://testserver', VIEW_COUNTER_FLUSH_INTERVAL=0)
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.addCleanup(counters._buffer.clear)
+        # Published by the tests
+        publisher = mock.patch.object(snapshots, '_start_publisher')
+        publisher.start()
+        self.addCleanup(publisher.stop)
+        self.addCleanup(snapshots._pending.clear)
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.snapshot_dir)
+        settings_override = override_settings(SNAPSHOT_DIR=self.snapshot_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        category = BoatCategory.objects.create(name="Voiliers", image='categories/voiliers.jpg')
+        self.boat = create_boat(category=category, is_featured=True)
+        BoatImage.objects.create(boat=self.boat, image='boats/photo.jpg', is_main=True)
+        self.other = create_boat(category=category, title="Catamaran")
+        Testimonial.objects.create(name="Marie", role="Acheteuse", quote="Parfait", rating=5)
+
+    def read(self, path):
+        with open(os.path.join(self.snapshot_dir, path.strip('/'), 'index.json'), 'rb') as snapshot:
+            content = snapshot.read()
+        with open(os.path.join(self.snapshot_dir, path.strip('/'), 'index.json.gz'), 'rb') as snapshot:
+            self.assertEqual(gzip.decompress(snapshot.read()), content)
+        return json.loads(content)
+
+    def test_snapshots_hold_the_api_payloads(self):
+        out = io.StringIO()
+        call_command('publish_snapshots', stdout=out)
+        self.assertIn("7 snapshot(s)", out.getvalue())
+        for path in ['/boats/', f'/boats/{self.boat.pk}/', '/featured-boats/', '/categories/', '/testimonials/', '/blog/']:
+            self.assertEqual(self.read(path), self.client.get(path, secure=True).json(), path)
+
+        # Nothing changed, nothing rewritten
+        self.assertEqual(snapshots.publish_all(), 0)
+
+    def test_changes_rewrite_the_affected_snapshots(self):
+        snapshots.publish_all()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.price = 9000
+            self.other.save()
+        # The detail and the list, the boat is not featured
+        self.assertEqual(snapshots.publish_pending(), 2)
+        self.assertEqual(self.read(f'/boats/{self.other.pk}/')['price'], 9000)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boat.is_active = False
+            self.boat.save()
+        self.assertEqual(snapshots.publish_pending(), 3)
+        self.assertFalse(os.path.exists(os.path.join(self.snapshot_dir, 'boats', str(self.boat.pk), 'index.json')))
+        self.assertEqual(self.read('/featured-boats/'), [])
+        self.assertEqual([boat['id'] for boat in self.read('/boats/')], [self.other.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Testimonial.objects.create(name="Paul", role="Vendeur", quote="Rapide", rating=4)
+            Testimonial.objects.create(name="Luc", role="Vendeur", quote="Efficace", rating=5)
+        self.assertEqual(snapshots.publish_pending(), 1)
+        self.assertEqual(len(self.read('/testimonials/')), 3)
+
+    @override_settings(SNAPSHOT_DEBOUNCE_SECONDS=0)
+    def test_changes_are_published_at_commit_without_the_publisher(self):
+        snapshots.publish_all()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.price = 9000
+            self.other.save()
+
+        self.assertEqual(self.read(f'/boats/{self.other.pk}/')['price'], 9000)
+        self.assertFalse(snapshots._pending)
+
+
+class SeoPageTests(TestCase):
+    index = (
+        '<!doctype html>\n<html lang="fr">\n  <head>\n    <meta charset="UTF-8" />\n'
+        '    <title>BoatTrade Consulting</title>\n'
+        '    <meta name="description" content="Achat et vente de bateaux">\n'
+        '    <meta property="og:image" content="/assets/images/logo.webp">\n'
+        '    <link rel="canonical" href="https://www.boattradeconsulting.fr/">\n'
+        '    <script type="module" crossorigin src="/assets/index-1.js"></script>\n'
+        '  </head>\n  <body>\n    <div id="root"></div>\n  </body>\n</html>\n'
+    )
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.index_path = os.path.join(directory, 'index.html')
+        with open(self.index_path, 'w') as index_file:
+            index_file.write(self.index)
+        settings_override = override_settings(
+            FRONTEND_INDEX_PATH=self.index_path, FRONTEND_URL='https://www.example.com', SITE_URL='https://api.example.com'
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(caches['default'].clear)
+
+        self.boat = create_boat(title="Lagoon 42 <neuf>", year_built=2019, price=345000, location="Sète")
+        BoatImage.objects.create(boat=self.boat, image='boats/lagoon.jpg', is_main=True)
+
+    def test_page_has_the_boat_tags(self):
+        response = self.client.get(f'/seo/boats/{self.boat.pk}/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        html = response.content.decode()
+        self.assertIn('<title>Lagoon 42 &lt;neuf&gt; - 2019 - BoatTrade Consulting</title>', html)
+        self.assertIn('content="Lagoon 42 &lt;neuf&gt; - 2019 - 345\u202f000,00\u00a0€ - Sète. Description..."', html)
+        self.assertIn('<meta property="og:image" content="https://api.example.com/media/boats/lagoon.jpg">', html)
+        self.assertIn(f'<link rel="canonical" href="https://www.example.com/boats/{self.boat.pk}">', html)
+        # The generic tags are replaced, the rest of the page is kept
+        self.assertNotIn('logo.webp', html)
+        self.assertEqual(html.count('<title>'), 1)
+        self.assertIn('<script type="module" crossorigin src="/assets/index-1.js"></script>', html)
+
+    def test_page_is_cached_until_the_boat_changes(self):
+        path = f'/seo/boats/{self.boat.pk}/'
+        self.client.get(path, secure=True)
+        # Only the updated_at of the boat is read
+        with self.assertNumQueries(1):
+            self.client.get(path, secure=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boat.title = "Lagoon 42"
+            self.boat.save()
+        self.assertIn('<title>Lagoon 42 - 2019', self.client.get(path, secure=True).content.decode())
+
+        # Changed by another process, whose cache deletions do not reach this one
+        Boat.objects.filter(pk=self.boat.pk).update(price=300000, updated_at=timezone.now())
+        self.assertIn('300\u202f000,00', self.client.get(path, secure=True).content.decode())
+
+        # Main image picked in the bulk image manager, no save of the boat
+        image = BoatImage.objects.create(boat=self.boat, image='boats/salon.jpg')
+        self.client.get(path, secure=True)
+        updated_at = Boat.objects.get(pk=self.boat.pk).updated_at
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/admin/api_app/boat/{self.boat.pk}/images/{image.pk}/main/', secure=True)
+        self.assertIn('media/boats/salon.jpg', self.client.get(path, secure=True).content.decode())
+        # The page gets a new version, the public updated_at of the boat is left alone
+        self.assertEqual(Boat.objects.get(pk=self.boat.pk).updated_at, updated_at)
+
+        # A new frontend build
+        with open(self.index_path, 'w') as index_file:
+            index_file.write(self.index.replace('index-1.js', 'index-2.js'))
+        os.utime(self.index_path, ns=(0, os.stat(self.index_path).st_mtime_ns + 1))
+        self.assertIn('index-2.js', self.client.get(path, secure=True).content.decode())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boat.is_active = False
+            self.boat.save()
+        response = self.client.get(path, secure=True)
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('<title>BoatTrade Consulting</title>', response.content.decode())
+
+
+@override_settings(SITE_URL='https://api.example.com')
+class ImageSitemapTests(TestCase):
+    def setUp(self):
+        self.addCleanup(caches['default'].clear)
+        category = BoatCategory.objects.create(name="Voiliers")
+        self.boat = create_boat(category=category)
+        BoatImage.objects.create(boat=self.boat, image='boats/side.jpg', position=0)
+        BoatImage.objects.create(boat=self.boat, image='boats/main.jpg', position=1, is_main=True, caption="Vue & pont")
+        create_boat(category=category, title="Sans photo")
+        hidden = create_boat(category=category, is_active=False)
+        BoatImage.objects.create(boat=hidden, image='boats/hidden.jpg')
+
+    def test_boat_urls_list_their_images(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/sitemap-boats.xml', secure=True)
+        self.assertEqual(response.status_code, 200)
+        xml = response.content.decode()
+        self.assertIn('xmlns:image="http://www.google.com/schemas/sitemap-image/1.1"', xml)
+        self.assertIn(
+            f'<loc>https://testserver/boats/{self.boat.pk}/</loc>', xml
+        )
+        # Main image first, with its caption
+        self.assertLess(xml.index('boats/main.jpg'), xml.index('boats/side.jpg'))
+        self.assertIn('<image:loc>https://api.example.com/media/boats/main.jpg</image:loc>'
+                      '<image:caption>Vue &amp; pont</image:caption>', xml)
+        self.assertNotIn('hidden.jpg', xml)
+        self.assertEqual(xml.count('<image:image>'), 2)
+        # Count, boats and images, whatever the number of boats
+        self.assertEqual(len(queries), 3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/sitemap-boats.xml', secure=True).content.decode(), xml)
+
+
+@override_settings(CDN_CACHE_ENABLED=True, VIEW_COUNTER_FLUSH_INTERVAL=0)
+class CdnCacheTests(TestCase):
+    def setUp(self):
+        self.addCleanup(counters._buffer.clear)
+        self.category = BoatCategory.objects.create(name="Voiliers")
+        self.boats = [create_boat(category=self.category, title=f"Bateau {index}") for index in range(3)]
+
+    def test_public_reads_get_a_policy_and_surrogate_keys(self):
+        boat_keys = {f'boat-{boat.pk}' for boat in self.boats}
+        for urlconf in ['api_app.urls', 'api_project.asgi_urls']:
+            with self.subTest(urlconf=urlconf), override_settings(ROOT_URLCONF=urlconf):
+                response = self.client.get('/boats/', secure=True)
+                self.assertEqual(
+                    set(response['Cache-Control'].split(', ')),
+                    {'public', 'max-age=60', 's-maxage=3600', 'stale-while-revalidate=600'},
+                )
+                self.assertEqual(set(response['Surrogate-Key'].split()), {'boats', f'category-{self.category.pk}'} | boat_keys)
+                self.assertEqual(response['Cache-Tag'], response['Surrogate-Key'].replace(' ', ','))
+
+                response = self.client.get(f'/boats/{self.boats[0].pk}/', secure=True)
+                self.assertEqual(set(response['Surrogate-Key'].split()), {f'boat-{self.boats[0].pk}', f'category-{self.category.pk}'})
+
+        with override_settings(CDN_MAX_SURROGATE_KEYS=3):
+            # The list is purged through its collection key
+            self.assertEqual(self.client.get('/boats/', secure=True)['Surrogate-Key'], f'boats category-{self.category.pk}')
+
+        response = self.client.get('/categories/', secure=True)
+        self.assertIn('s-maxage=86400', response['Cache-Control'])
+
+    def test_private_and_other_responses_are_left_out(self):
+        response = self.client.get('/events/catalog/', secure=True)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertNotIn('Surrogate-Key', response)
+        response = self.client.get('/boats/', secure=True, HTTP_COOKIE=f'{settings.SESSION_COOKIE_NAME}=x')
+        self.assertEqual(set(response['Cache-Control'].split(', ')), {'private', 'max-age=0'})
+        self.assertNotIn('Surrogate-Key', response)
+        response = self.client.post('/inquiries/', {}, secure=True)
+        self.assertNotIn('Surrogate-Key', response)
+        # Last, DRF rolls the test transaction back when authentication fails
+        response = self.client.get('/boats/', secure=True, HTTP_AUTHORIZATION='Bearer invalide')
+        self.assertNotIn('Surrogate-Key', response)
+
+    def test_changes_are_purged_through_the_backend(self):
+        with cdn.LocalPurgeServer() as server, override_settings(
+            CDN_PURGE_BACKEND='api_app.cdn.HttpPurgeBackend', CDN_PURGE_URL=server.url,
+            CDN_PURGE_TOKEN='secret', CDN_PURGE_INTERVAL=0,
+        ):
+            boat = self.boats[0]
+            with self.captureOnCommitCallbacks(execute=True):
+                boat.price = 9000
+                boat.save()
+            self.assertEqual(server.requests, [{'path': '/purge', 'authorization': 'Bearer secret', 'keys': [f'boat-{boat.pk}', 'boats']}])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                BoatImage.objects.create(boat=boat, image='boats/photo.jpg')
+                self.category.name = "Voiliers de course"
+                self.category.save()
+                BlogPost.objects.create(title="Hivernage", content="Conseils")
+            self.assertEqual(server.purged[2:], [
+                f'boat-{boat.pk}', 'boats', 'categories', f'category-{self.category.pk}', 'blog', f'blog-{BlogPost.objects.get().pk}',
+            ])
+
+            # Hidden boats are not cached, their changes are not purged
+            hidden = create_boat(category=self.category, is_active=False)
+            with self.captureOnCommitCallbacks(execute=True):
+                hidden.price = 1
+                hidden.save()
+            self.assertNotIn(f'boat-{hidden.pk}', server.purged)
+
+        with self.settings(CDN_PURGE_BACKEND='api_app.cdn.CloudflarePurgeBackend'), \
+                mock.patch.object(cdn.CloudflarePurgeBackend, 'post') as post:
+            self.assertTrue(cdn.send_purges({f'boat-{index}' for index in range(65)}))
+        # At most 30 tags per Cloudflare request
+        self.assertEqual([len(json.loads(call.args[1])['tags']) for call in post.call_args_list], [30, 30, 5])
+
+    def test_main_image_change_in_the_admin_is_purged(self):
+        boat = self.boats[0]
+        _, second = [BoatImage.objects.create(boat=boat, image=f'boats/{index}.jpg') for index in range(2)]
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+        with cdn.LocalPurgeServer() as server, override_settings(
+            CDN_PURGE_BACKEND='api_app.cdn.HttpPurgeBackend', CDN_PURGE_URL=server.url, CDN_PURGE_INTERVAL=0,
+        ), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/admin/api_app/boat/{boat.pk}/images/{second.pk}/main/', secure=True)
+
+        self.assertEqual(response.status_code, 200)
+        # The images are written with update(), no post_save is sent
+        self.assertEqual(server.purged, [f'boat-{boat.pk}', 'boats'])
+        self.assertEqual(list(CatalogEvent.objects.values_list('kind', 'boat_id')), [(CatalogEvent.KIND_UPDATED, boat.pk)])
+
+
+class HashedMediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_UPLOAD_SHARDING='flat')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.boat = create_boat()
+
+    def test_saved_files_are_named_after_their_content(self):
+        first = BoatImage.objects.create(boat=self.boat, image=SimpleUploadedFile('photo.jpg', b'avant'))
+        replaced = BoatImage.objects.create(boat=self.boat, image=SimpleUploadedFile('photo.jpg', b'apres'))
+        again = BoatImage.objects.create(boat=self.boat, image=SimpleUploadedFile('photo.jpg', b'avant'))
+
+        digest = hashlib.sha256(b'avant').hexdigest()[:12]
+        self.assertEqual(first.image.name, f'boats/photo.{digest}.jpg')
+        self.assertEqual(first.image.url, f'/media/boats/photo.{digest}.jpg')
+        self.assertNotEqual(replaced.image.name, first.image.name)
+        # Same content under an existing name, the storage picks a free name keeping the digest
+        self.assertNotEqual(again.image.name, first.image.name)
+        self.assertTrue(again.image.name.endswith(f'.{digest}.jpg'))
+
+    def test_media_server_marks_hashed_files_immutable(self):
+        hashed = BoatImage.objects.create(boat=self.boat, image=SimpleUploadedFile('photo.jpg', b'contenu')).image.name
+        with open(os.path.join(self.media_root, 'legacy.jpg'), 'wb') as legacy:
+            legacy.write(b'ancien')
+
+        response = serve_media(RequestFactory().get('/media/'), hashed, document_root=self.media_root)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        response = serve_media(RequestFactory().get('/media/'), 'legacy.jpg', document_root=self.media_root)
+        self.assertNotIn('Cache-Control', response)
+
+    def test_hash_media_names_renames_older_files(self):
+        os.makedirs(os.path.join(self.media_root, 'boats'))
+        with open(os.path.join(self.media_root, 'boats', 'legacy.jpg'), 'wb') as legacy:
+            legacy.write(b'ancien')
+        image = BoatImage.objects.create(boat=self.boat, image='boats/legacy.jpg')
+
+        out = io.StringIO()
+        call_command('hash_media_names', stdout=out)
+        self.assertIn("Moved 1 file(s)", out.getvalue())
+        image.refresh_from_db()
+        self.assertEqual(image.image.name, f"boats/legacy.{hashlib.sha256(b'ancien').hexdigest()[:12]}.jpg")
+        self.assertTrue(os.path.exists(image.image.path))
+
+        call_command('hash_media_names', stdout=out)
+        self.assertIn("Moved 0 file(s)", out.getvalue())
+
+
+class ShardedMediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_UPLOAD_SHARDING='flat')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.boat = create_boat()
+
+    def legacy_image(self, name, content=b'ancien'):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as legacy:
+            legacy.write(content)
+        return BoatImage.objects.create(boat=self.boat, image=name)
+
+    def test_paths_follow_the_strategy_and_depth(self):
+        digest = hashlib.md5(b'photo.jpg').hexdigest()
+        when = datetime.datetime(2024, 5, 3, 12, 0)
+
+        with override_settings(MEDIA_UPLOAD_SHARD_DEPTH=2):
+            self.assertEqual(sharded_upload_path('boats/', 'C:\\photos\\photo.jpg', 'hash'),
+                             f'boats/{digest[:2]}/{digest[2:4]}/photo.jpg')
+        with override_settings(MEDIA_UPLOAD_SHARD_DEPTH=1):
+            self.assertEqual(sharded_upload_path('boats/', 'photo.jpg', 'hash'), f'boats/{digest[:2]}/photo.jpg')
+            # The content digest of a stored name does not move it to another directory
+            self.assertEqual(sharded_upload_path('boats/', 'boats/ab/photo.0123456789ab.jpg', 'hash'),
+                             f'boats/{digest[:2]}/photo.0123456789ab.jpg')
+            self.assertEqual(sharded_upload_path('boats/', 'photo_Xy12345.0123456789ab.jpg', 'hash'),
+                             f'boats/{digest[:2]}/photo_Xy12345.0123456789ab.jpg')
+        self.assertEqual(sharded_upload_path('/blog/', 'photo.jpg', 'date', when), 'blog/2024/05/03/photo.jpg')
+        self.assertEqual(sharded_upload_path('blog/', 'photo.jpg', 'flat'), 'blog/photo.jpg')
+        with self.assertRaises(ValueError):
+            sharded_upload_path('blog/', 'photo.jpg', 'random')
+        with override_settings(MEDIA_UPLOAD_SHARDING='date'):
+            self.assertEqual(ShardedUploadTo('boats/')(None, 'photo.jpg'),
+                             timezone.now().strftime('boats/%Y/%m/%d/photo.jpg'))
+
+    def test_shard_media_moves_files_and_rewrites_paths(self):
+        image = self.legacy_image('boats/legacy.jpg')
+
+        out = io.StringIO()
+        with override_settings(MEDIA_UPLOAD_SHARDING='hash', MEDIA_UPLOAD_SHARD_DEPTH=2):
+            call_command('shard_media', stdout=out)
+            self.assertIn("Moved 1 file(s)", out.getvalue())
+            image.refresh_from_db()
+            self.assertEqual(image.image.name, sharded_upload_path('boats/', 'legacy.jpg'))
+            self.assertTrue(os.path.exists(image.image.path))
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, 'boats', 'legacy.jpg')))
+
+            call_command('shard_media', stdout=out)
+            self.assertIn("Moved 0 file(s)", out.getvalue())
+
+    def test_shard_media_leaves_new_uploads_in_place(self):
+        with override_settings(MEDIA_UPLOAD_SHARDING='hash', MEDIA_UPLOAD_SHARD_DEPTH=2):
+            image = BoatImage.objects.create(boat=self.boat, image=SimpleUploadedFile('photo.jpg', b'nouveau'))
+            again = BoatImage.objects.create(boat=self.boat, image=SimpleUploadedFile('photo.jpg', b'nouveau'))
+            self.assertNotEqual(again.image.name, image.image.name)
+
+            out = io.StringIO()
+            call_command('shard_media', dry_run=True, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), "Would move 0 file(s)")
+
+    def test_shard_media_puts_the_files_back_when_the_update_fails(self):
+        first = self.legacy_image('boats/first.jpg')
+        second = self.legacy_image('boats/second.jpg')
+
+        with override_settings(MEDIA_UPLOAD_SHARDING='hash'), \
+                mock.patch.object(QuerySet, 'update', side_effect=[1, OSError("disque plein")]), \
+                self.assertRaises(OSError):
+            call_command('shard_media', stdout=io.StringIO())
+
+        for image, name in ((first, 'boats/first.jpg'), (second, 'boats/second.jpg')):
+            image.refresh_from_db()
+            self.assertEqual(image.image.name, name)
+            self.assertTrue(os.path.exists(image.image.path))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, sharded_upload_path('boats/', 'first.jpg', 'hash'))))
+
+
+class DatabaseBackupTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.db_path = os.path.join(self.directory, 'db.sqlite3')
+        with sqlite3.connect(self.db_path) as source:
+            source.execute("CREATE TABLE boat (id INTEGER PRIMARY KEY, title TEXT)")
+            source.executemany("INSERT INTO boat (title) VALUES (?)", ((f"Bateau {i}" * 20,) for i in range(500)))
+        source.close()
+
+    def count_rows(self, path):
+        connection = sqlite3.connect(path)
+        try:
+            return connection.execute("SELECT COUNT(*) FROM boat").fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_backup_is_checked_compressed_and_old_ones_removed(self):
+        backup_dir = os.path.join(self.directory, 'backups')
+        os.makedirs(backup_dir)
+        old_backup = os.path.join(backup_dir, 'db.sqlite3_20200101_000000.bak.gz')
+        recent_backup = os.path.join(backup_dir, 'db.sqlite3_20990101_000000.bak.gz')
+        for path in (old_backup, recent_backup):
+            open(path, 'wb').close()
+        forty_days_ago = time.time() - 40 * 86400
+        os.utime(old_backup, (forty_days_ago, forty_days_ago))
+
+        out = io.StringIO()
+        with override_settings(SQLITE_BACKUP_DIR=backup_dir, BACKUP_RETENTION_DAYS=30), \
+                mock.patch.dict(settings.DATABASES['default'], NAME=self.db_path):
+            call_command('backup_database', pages=1, pause=0, stdout=out)
+
+        self.assertIn("Successfully backed up", out.getvalue())
+        self.assertIn("Removed 1 old backup(s)", out.getvalue())
+        backups = sorted(os.listdir(backup_dir))
+        self.assertEqual(len(backups), 2)
+        self.assertNotIn(os.path.basename(old_backup), backups)
+        # Only the compressed copy is kept
+        self.assertFalse([name for name in backups if not name.endswith('.bak.gz')])
+
+        restored = os.path.join(self.directory, 'restored.sqlite3')
+        new_backup = next(name for name in backups if name != os.path.basename(recent_backup))
+        with gzip.open(os.path.join(backup_dir, new_backup), 'rb') as backup, open(restored, 'wb') as target:
+            shutil.copyfileobj(backup, target)
+        check_integrity(restored)
+        self.assertEqual(self.count_rows(restored), 500)
+
+    def test_backup_restarted_by_writes_finishes_in_one_step(self):
+        writer = sqlite3.connect(self.db_path, isolation_level=None)
+        self.addCleanup(writer.close)
+
+        def write(pause):
+            # A write from another connection between two steps restarts the copy
+            writer.execute("INSERT INTO boat (title) VALUES ('Nouveau')")
+
+        target_path = os.path.join(self.directory, 'snapshot.sqlite3')
+        with mock.patch('api_app.backup.time.sleep', side_effect=write) as sleep, \
+                self.assertLogs('api_app.backup', 'WARNING'):
+            online_backup(self.db_path, target_path, pages=1, pause=0.01, max_restarts=3)
+
+        check_integrity(target_path)
+        self.assertEqual(self.count_rows(target_path), 500 + sleep.call_count)
+
+
+class IncrementalBackupTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = ChunkStore(os.path.join(self.directory, 'store'), avg_chunk_size=1024)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as target:
+            target.write(content)
+        return path
+
+    def read_file(self, path):
+        with open(path, 'rb') as source:
+            return source.read()
+
+    def chunk_files(self):
+        return {name for _, _, names in os.walk(self.store.chunks_dir) for name in names}
+
+    def test_files_round_trip_and_share_their_unchanged_blocks(self):
+        content = random.Random(1).randbytes(10 * 1024 + 100)
+        chunk_ids = self.store.store_file(self.write_file('a.bin', content))
+        edited_ids = self.store.store_file(self.write_file('b.bin', content[:3000] + b'x' * 10 + content[3010:]))
+
+        self.assertEqual(len(chunk_ids), 11)
+        self.assertEqual([index for index, (old, new) in enumerate(zip(chunk_ids, edited_ids)) if old != new], [2])
+        self.store.restore_file(chunk_ids, os.path.join(self.directory, 'restored.bin'))
+        self.assertEqual(self.read_file(os.path.join(self.directory, 'restored.bin')), content)
+
+        # Already compressed media are not compressed again
+        photo_ids = self.store.store_file(self.write_file('photo.JPG', b'a' * 1024))
+        self.assertGreater(os.path.getsize(self.store.chunk_path(photo_ids[0])), 1024)
+        self.assertEqual(self.store.read_chunk(photo_ids[0]), b'a' * 1024)
+
+    def test_blocks_round_trip_and_unchanged_blocks_are_not_rewritten(self):
+        content = random.Random(2).randbytes(40 * 1024)
+        path = self.write_file('db.sqlite3', content)
+        chunk_ids = self.store.store_blocks(path, 4096, workers=2)
+        self.assertEqual(len(chunk_ids), 10)
+        stored = self.chunk_files()
+
+        # One page changed in place
+        self.write_file('db.sqlite3', content[:8192] + b'x' * 4096 + content[12288:])
+        changed_ids = self.store.store_blocks(path, 4096, workers=2)
+        self.assertEqual([index for index, (old, new) in enumerate(zip(chunk_ids, changed_ids)) if old != new], [2])
+        self.assertEqual(len(self.chunk_files() - stored), 1)
+
+        self.store.restore_file(chunk_ids, os.path.join(self.directory, 'restored.sqlite3'))
+        self.assertEqual(self.read_file(os.path.join(self.directory, 'restored.sqlite3')), content)
+
+    def test_prune_keeps_the_chunks_still_in_use(self):
+        now = timezone.now()
+        shared = self.store.write_chunk(b'commun')
+        old_only = self.store.write_chunk(b'ancien')
+        recent_only = self.store.write_chunk(b'recent')
+        self.store.write_chunk(b'orphelin')
+        for created_at, chunk_ids in ((now - datetime.timedelta(days=40), [shared, old_only]),
+                                      (now - datetime.timedelta(days=35), [shared, recent_only])):
+            self.store.write_manifest({'created_at': created_at.isoformat(),
+                                       'database': {'name': 'db.sqlite3', 'chunks': chunk_ids}, 'media': {}})
+
+        # Both manifests are past the cutoff, the latest one is kept anyway
+        self.assertEqual(self.store.prune(now - datetime.timedelta(days=30)), (1, 2))
+        self.assertEqual(self.chunk_files(), {shared, recent_only})
+        self.assertEqual(self.store.latest_manifest()['database']['chunks'], [shared, recent_only])
+
+    def test_backup_and_restore_commands_round_trip(self):
+        db_path = os.path.join(self.directory, 'db.sqlite3')
+        source = sqlite3.connect(db_path)
+        source.execute("CREATE TABLE boat (id INTEGER PRIMARY KEY, title TEXT)")
+        source.executemany("INSERT INTO boat (title) VALUES (?)", ((f"Bateau {i}",) for i in range(1000)))
+        source.commit()
+        source.close()
+        media_root = os.path.join(self.directory, 'media')
+        photo = random.Random(3).randbytes(20000)
+        self.write_file('media/boats/photo.jpg', photo)
+
+        out = io.StringIO()
+        with override_settings(BACKUP_STORE_DIR=self.store.root, MEDIA_ROOT=media_root, BACKUP_CHUNK_SIZE_KB=4), \
+                mock.patch.dict(settings.DATABASES['default'], NAME=db_path):
+            call_command('backup_incremental', workers=1, pause=0, stdout=out)
+            stored = self.chunk_files()
+            call_command('backup_incremental', workers=1, pause=0, stdout=out)
+            # Nothing changed, the second backup only adds its manifest
+            self.assertIn("1 media file(s), 0 new or changed", out.getvalue())
+            self.assertEqual(self.chunk_files(), stored)
+
+            call_command('restore_backup', database=os.path.join(self.directory, 'restored.sqlite3'),
+                         media=os.path.join(self.directory, 'restored_media'), stdout=out)
+            call_command('restore_backup', list=True, stdout=out)
+
+        self.assertEqual(len(self.store.manifest_names()), 2)
+        restored = sqlite3.connect(os.path.join(self.directory, 'restored.sqlite3'))
+        self.assertEqual(restored.execute("SELECT COUNT(*) FROM boat").fetchone()[0], 1000)
+        restored.close()
+        self.assertEqual(self.read_file(os.path.join(self.directory, 'restored_media', 'boats', 'photo.jpg')), photo)
@@ -0,0 +1,56 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Set by RequestTimingMiddleware while a measured request is handled
+current_timing = ContextVar('current_timing', default=None)
+# Queries per database alias of the current request, set by MetricsMiddleware
+current_query_counts = ContextVar('current_query_counts', default=None)
+
+class RequestTiming:
+    """Query count, SQL time and named durations (in seconds) of one request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.durations = defaultdict(float)
+
+    def add(self, name, duration):
+        self.durations[name] += duration
+
+    def add_excluding_sql(self, name, start, sql_time_at_start):
+        """Add the time since `start` to name, less the SQL time already counted in sql_time"""
+        self.add(name, time.perf_counter() - start - (self.sql_time - sql_time_at_start))
+
+def measure_query(execute, sql, params, many, context):
+    """Execute wrapper installed on every database connection. The measures of the request
+    live in context variables, which sync_to_async hands over to the thread running the
+    query, so async views are measured like sync ones."""
+    timing = current_timing.get()
+    counts = current_query_counts.get()
+    if timing is None and counts is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if timing is not None:
+            timing.queries += 1
+            timing.sql_time += time.perf_counter() - start
+        if counts is not None:
+            counts[context['connection'].alias] += 1
+
+@contextmanager
+def timed(name):
+    """Add the duration of the block to the current request timing, if it is measured.
+    Queries run in the block are only counted in the SQL time, so the durations never overlap."""
+    timing = current_timing.get()
+    if timing is None:
+        yield
+        return
+    start, sql_time = time.perf_counter(), timing.sql_time
+    try:
+        yield
+    finally:
+        timing.add_excluding_sql(name, start, sql_time)
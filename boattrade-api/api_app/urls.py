@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.urls import path, include
+from django.views.decorators.cache import cache_page
 from rest_framework.routers import DefaultRouter
 from django.contrib.sitemaps.views import sitemap
-from . import views
+from . import async_views, views
 from .sitemaps import BoatSitemap, StaticViewSitemap
 
 router = DefaultRouter()
@@ -14,13 +16,19 @@ sitemaps = {
     'boats': BoatSitemap(),
     'static': StaticViewSitemap(),
 }
+# The template adds the image:image entries of the boats
+sitemap_kwargs = {'sitemaps': sitemaps, 'template_name': 'sitemaps/sitemap.xml'}
+sitemap_view = views.non_atomic_view(cache_page(settings.SITEMAP_CACHE_TIMEOUT)(sitemap))
 
 urlpatterns = [
     path('', include(router.urls)),
     path('inquiries/', views.submit_inquiry, name='submit_inquiry'),
     path('sell-requests/', views.submit_sell_request, name='submit_sell_request'),
     path('featured-boats/', views.get_featured_boats, name='featured_boats'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('events/catalog/', async_views.catalog_events, name='catalog_events'),
+    path('seo/boats/<int:pk>/', views.seo_boat_page, name='seo_boat_page'),
     # Simplified sitemap configuration
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
-    path('sitemap-<section>.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    path('sitemap.xml', sitemap_view, sitemap_kwargs, name='django.contrib.sitemaps.views.sitemap'),
+    path('sitemap-<section>.xml', sitemap_view, sitemap_kwargs, name='django.contrib.sitemaps.views.sitemap'),
 ]
\ No newline at end of file
@@ -3,8 +3,12 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
-from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_safe
+from django.views.static import serve
+from django.utils.crypto import constant_time_compare
 from django.db.models import Q
 
 from .models import Boat, BoatCategory, BoatImage, Inquiry, SellRequest, SellRequestImage, Testimonial, BlogPost
@@ -13,15 +17,82 @@ from .serializers import (
     InquirySerializer, SellRequestSerializer, BoatListSerializer,
     TestimonialSerializer, BlogPostSerializer
 )
+from .emails import queue_email
+from . import metrics
+from .counters import popularity, record_impressions, record_view
+from .images import LimitedUploadHandler, stage_uploads, schedule_image_processing
+from .cdn import add_surrogate_keys, object_key
+from .seo import load_index, render_boat_page
+from .storage import is_hashed_name
+
+SAFE_METHODS = ('get', 'head', 'options')
+
+def non_atomic_view(view):
+    """Exclude a view from the ATOMIC_REQUESTS transaction on every database"""
+    for alias in settings.DATABASES:
+        view = transaction.non_atomic_requests(using=alias)(view)
+    return view
+
+class ReadOnlyTransactionMixin:
+    """Viewset routes serving only safe methods run without the per-request transaction,
+    reads then skip the BEGIN/COMMIT round trips and do not hold the lock between queries"""
+    
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if actions and all(method in SAFE_METHODS for method in actions):
+            view = non_atomic_view(view)
+        return view
+
+def filter_boats(queryset, params):
+    """Apply the filters and ordering of the boat list query string, shared by the sync and async views"""
+    # Apply filters if provided
+    category = params.get('category')
+    search = params.get('search')
+    min_price = params.get('min_price')
+    max_price = params.get('max_price')
+    min_year = params.get('min_year')
+    max_year = params.get('max_year')
+    featured = params.get('featured')
+    ordering = params.get('ordering')
+    
+    if category:
+        queryset = queryset.filter(category_id=category)
+    
+    if search:
+        queryset = queryset.filter(
+            Q(title__icontains=search) | 
+            Q(description__icontains=search)
+        )
+    
+    if min_price:
+        queryset = queryset.filter(price__gte=min_price)
+    
+    if max_price:
+        queryset = queryset.filter(price__lte=max_price)
+    
+    if min_year:
+        queryset = queryset.filter(year_built__gte=min_year)
+    if max_year:
+        queryset = queryset.filter(year_built__lte=max_year)
+        
+    if featured and featured.lower() == 'true':
+        queryset = queryset.filter(is_featured=True)
+    
+    if ordering == 'popular':
+        # Counted views are buffered, the ordering lags behind by up to one flush
+        queryset = queryset.alias(popularity=popularity()).order_by('-popularity', '-created_at')
+        
+    return queryset
 
 # Public endpoints for visitors
-class BoatCategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class BoatCategoryViewSet(ReadOnlyTransactionMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint to view boat categories"""
     queryset = BoatCategory.objects.all()
     serializer_class = BoatCategorySerializer
     permission_classes = [AllowAny]
 
-class BoatViewSet(viewsets.ReadOnlyModelViewSet):
+class BoatViewSet(ReadOnlyTransactionMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint for listing and retrieving boats"""
     queryset = Boat.objects.filter(is_active=True).order_by('-created_at')
     permission_classes = [AllowAny]
@@ -33,43 +104,27 @@ class BoatViewSet(viewsets.ReadOnlyModelViewSet):
             return BoatSerializer
         return BoatSerializer
     
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.method == 'GET':
+            if isinstance(response.data, dict):
+                boats = response.data.get('results', [])
+            else:
+                # Unpaginated, the list holds every matching boat but only the first cards are on screen
+                boats = response.data[:settings.VIEW_COUNTER_LIST_IMPRESSIONS]
+            record_impressions([boat['id'] for boat in boats])
+        return response
+    
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        if request.method == 'GET':
+            record_view(response.data['id'])
+        return response
+    
     def get_queryset(self):
-        queryset = super().get_queryset()
-        
-        # Apply filters if provided
-        category = self.request.query_params.get('category')
-        search = self.request.query_params.get('search')
-        min_price = self.request.query_params.get('min_price')
-        max_price = self.request.query_params.get('max_price')
-        min_year = self.request.query_params.get('min_year')
-        max_year = self.request.query_params.get('max_year')
-        featured = self.request.query_params.get('featured')
-        
-        if category:
-            queryset = queryset.filter(category_id=category)
-        
-        if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) | 
-                Q(description__icontains=search)
-            )
-        
-        if min_price:
-            queryset = queryset.filter(price__gte=min_price)
-        
-        if max_price:
-            queryset = queryset.filter(price__lte=max_price)
-        
-        if min_year:
-            queryset = queryset.filter(year_built__gte=min_year)
-        if max_year:
-            queryset = queryset.filter(year_built__lte=max_year)
-            
-        if featured and featured.lower() == 'true':
-            queryset = queryset.filter(is_featured=True)
-            
-        return queryset
+        return filter_boats(super().get_queryset(), self.request.query_params)
 
+@non_atomic_view
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_featured_boats(request):
@@ -91,7 +146,7 @@ def submit_inquiry(request):
         
         inquiry = serializer.save()
         
-        # Send email notification to admin
+        # Email notification to admin
         subject = f"New Inquiry: {boat.title}"
         message = f"""
         Someone is interested in {boat.title}!
@@ -103,18 +158,8 @@ def submit_inquiry(request):
         Message:
         {inquiry.comment}
         """
-        try:
-            print("Sending email")
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [settings.ADMIN_EMAIL],
-                fail_silently=False,
-            )
-            print("Email sent")
-        except Exception as e:
-            print(f"Error sending email: {e}")
+        # Queued in the request transaction, delivered by the send_queued_emails worker
+        queue_email(subject, message)
         
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
@@ -124,25 +169,40 @@ def submit_inquiry(request):
 @permission_classes([AllowAny])
 def submit_sell_request(request):
     """API endpoint for submitting a request to sell a boat"""
+    # Stream uploads to disk and stop reading the body as soon as a size cap is exceeded
+    upload_handler = LimitedUploadHandler(
+        request._request,
+        max_file_size=settings.SELL_REQUEST_MAX_IMAGE_MB * 1024 * 1024,
+        max_total_size=settings.SELL_REQUEST_MAX_TOTAL_MB * 1024 * 1024,
+    )
+    if not hasattr(request._request, '_files'):
+        request._request.upload_handlers = [upload_handler]
+    
     serializer = SellRequestSerializer(data=request.data)
+    if upload_handler.error:
+        return Response({'images': [upload_handler.error]}, status=status.HTTP_400_BAD_REQUEST)
+    
+    images = request.FILES.getlist('images')
+    if len(images) > settings.SELL_REQUEST_MAX_IMAGES:
+        return Response(
+            {'images': [f"Vous pouvez envoyer au maximum {settings.SELL_REQUEST_MAX_IMAGES} images."]},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
     if serializer.is_valid():
         sell_request = serializer.save()
         
         # Track uploaded images for email notification
-        image_info = []
+        image_info = [f"- {image.name} ({image.size/1024:.1f} KB)" for image in images]
         
-        # Handle uploaded images
-        if 'images' in request.FILES:
-            images = request.FILES.getlist('images')
-            for image in images:
-                sell_request_image = SellRequestImage.objects.create(
-                    sell_request=sell_request,
-                    image=image
-                )
-                image_info.append(f"- {image.name} ({image.size/1024:.1f} KB)")
+        # Images are resized and stored by the worker pool once the request is committed
+        if images:
+            staging_dir = stage_uploads(images, f"sell_request_{sell_request.id}")
+            transaction.on_commit(lambda: schedule_image_processing(
+                SellRequestImage, 'image', staging_dir, sell_request_id=sell_request.id
+            ))
         
-        # Send email notification to admin
+        # Email notification to admin
         subject = "New Boat Selling Request"
         message = f"""
         Someone wants to sell their boat!
@@ -160,30 +220,51 @@ def submit_sell_request(request):
         Uploaded Images ({len(image_info)} total):
         {"None" if not image_info else "\n".join(image_info)}
         """
-        try:
-            print("Sending email")
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [settings.ADMIN_EMAIL],
-                fail_silently=False,
-            )
-        except Exception as e:
-            print(f"Error sending email: {e}")
+        # Queued in the request transaction, delivered by the send_queued_emails worker
+        queue_email(subject, message)
         
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class TestimonialViewSet(viewsets.ReadOnlyModelViewSet):
+class TestimonialViewSet(ReadOnlyTransactionMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint to view testimonials"""
     queryset = Testimonial.objects.all()
     serializer_class = TestimonialSerializer
     permission_classes = [AllowAny]
 
-class BlogPostViewSet(viewsets.ReadOnlyModelViewSet):
+class BlogPostViewSet(ReadOnlyTransactionMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint to view blog posts"""
     queryset = BlogPost.objects.filter(is_active=True).order_by('-published_date')
     serializer_class = BlogPostSerializer
     permission_classes = [AllowAny]
+
+@non_atomic_view
+def metrics_view(request):
+    """Prometheus scrape endpoint, for the METRICS_TOKEN bearer token or staff sessions"""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(settings.METRICS_TOKEN) and constant_time_compare(authorization, f"Bearer {settings.METRICS_TOKEN}")
+    if not token_ok and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@non_atomic_view
+@require_safe
+def seo_boat_page(request, pk):
+    """Frontend page of a boat with its meta tags in the HTML, for the crawlers and link
+    previews that do not run the SPA"""
+    page = render_boat_page(pk)
+    if page is None:
+        # The unchanged page, the SPA shows its own message
+        return HttpResponse(load_index()[3], status=404)
+    add_surrogate_keys(object_key(Boat, pk))
+    return HttpResponse(page)
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """Development media server, sends the production cache policy for content hashed names"""
+    response = serve(request, path, document_root, show_indexes)
+    if is_hashed_name(path):
+        response['Cache-Control'] = settings.MEDIA_CACHE_CONTROL
+    return response
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "api_project.settings")
+# Async views for the public reads, ASYNC_READ_VIEWS=False keeps the sync DRF views
+os.environ.setdefault("ASYNC_READ_VIEWS", "True")
 
 application = get_asgi_application()
@@ -0,0 +1,12 @@
+"""
+URL configuration used when ASYNC_READ_VIEWS is set: the public read endpoints are
+served by the async views of api_app.async_views, everything else by api_project.urls.
+"""
+from django.urls import include, path
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('', include('api_app.async_urls')),
+    *sync_urlpatterns,
+]
@@ -62,8 +62,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api_app.middleware.MetricsMiddleware",
     'corsheaders.middleware.CorsMiddleware',
     "django.middleware.security.SecurityMiddleware",
+    "api_app.middleware.RequestTimingMiddleware",
+    "api_app.middleware.ReplicaRoutingMiddleware",
+    "api_app.middleware.CdnCacheMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -72,7 +76,10 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
-ROOT_URLCONF = "api_project.urls"
+# Serve the public read endpoints with the async views of api_app.async_views,
+# set by api_project/asgi.py: under WSGI each async view would run its own event loop
+ASYNC_READ_VIEWS = os.environ.get("ASYNC_READ_VIEWS", "False") == "True"
+ROOT_URLCONF = "api_project.asgi_urls" if ASYNC_READ_VIEWS else "api_project.urls"
 
 TEMPLATES = [
     {
@@ -113,6 +120,48 @@ DATABASES = {
     }
 }
 
+# Production SQLite profile: WAL journaling lets readers run while a writer
+# commits, and connections are kept open across requests.
+# Compare both profiles with `manage.py benchmark_sqlite`.
+SQLITE_PRODUCTION = os.environ.get("SQLITE_PRODUCTION", "False") == "True"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -64000)),  # negative value = KiB
+    "temp_store": "MEMORY",
+}
+# Applied to every new connection of the production profile
+SQLITE_PRODUCTION_OPTIONS = {
+    "init_command": "".join(f"PRAGMA {name}={value};" for name, value in SQLITE_PRAGMAS.items()),
+    "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000,
+}
+if SQLITE_PRODUCTION:
+    DATABASES["default"].update({
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 600)),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": SQLITE_PRODUCTION_OPTIONS,
+    })
+
+# Read replicas serving the safe-method API requests (see ReplicaRoutingMiddleware).
+# SQLite replicas are files listed in SQLITE_REPLICA_FILES and refreshed from the
+# primary by `manage.py sync_replicas`. Other engines (e.g. Postgres streaming
+# replicas) can be declared in DATABASES and added to DATABASE_REPLICAS.
+SQLITE_REPLICA_FILES = [path for path in os.environ.get("SQLITE_REPLICA_FILES", "").split(",") if path]
+for index, replica_path in enumerate(SQLITE_REPLICA_FILES, start=1):
+    DATABASES[f"replica_{index}"] = {
+        **DATABASES["default"],
+        "NAME": Path(replica_path),
+        "ATOMIC_REQUESTS": False,
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith("replica_")]
+DATABASE_ROUTERS = ["api_app.db_routers.ReplicaRouter"]
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 15))
+REPLICA_STICKY_COOKIE = "read_primary_until"
+REPLICA_EXCLUDED_PATHS = ["/admin/"]
+
 # Ensure SQLite database directory has proper permissions
 import stat
 DB_DIR = DB_FILE_PATH.parent
@@ -125,6 +174,19 @@ SQLITE_BACKUP_DIR = os.path.join(BASE_DIR, os.environ.get('SQLITE_BACKUP_DIR', '
 os.makedirs(SQLITE_BACKUP_DIR, exist_ok=True)
 os.chmod(SQLITE_BACKUP_DIR, stat.S_IRWXU)  # 700 permissions for backup dir
 BACKUP_RETENTION_DAYS = int(os.environ.get('BACKUP_RETENTION_DAYS', 30))
+# Online backups copy BACKUP_PAGES_PER_STEP pages at a time and pause between steps
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 1024))
+BACKUP_STEP_PAUSE = float(os.environ.get('BACKUP_STEP_PAUSE', 0.05))
+# Restarts caused by writes before the rest of the database is copied in one step
+BACKUP_MAX_RESTARTS = int(os.environ.get('BACKUP_MAX_RESTARTS', 3))
+# Deduplicated store used by `manage.py backup_incremental` / `restore_backup`
+BACKUP_STORE_DIR = os.path.join(BASE_DIR, os.environ.get('BACKUP_STORE_DIR', 'backup_store'))
+BACKUP_CHUNK_SIZE_KB = int(os.environ.get('BACKUP_CHUNK_SIZE_KB', 64))  # size of the stored blocks
+BACKUP_WORKERS = int(os.environ.get('BACKUP_WORKERS', os.cpu_count() or 1))
+
+
+# Unfiltered admin changelists of tables above this size show an estimated count
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.environ.get('ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000))
 
 
 # Password validation
@@ -168,8 +230,158 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = "media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+# Uploaded files are stored with the digest of their content in their name
+# (boats/ab/photo.<digest>.jpg, see `manage.py hash_media_names` for older files):
+# their URL changes with their content, nginx can send MEDIA_CACHE_CONTROL for them
+#   location ~ "^/media/.+\.[0-9a-f]{12}(\.[^./]+)?$" {
+#       add_header Cache-Control "public, max-age=31536000, immutable";
+#   }
+STORAGES = {
+    "default": {"BACKEND": "api_app.storage.HashedFileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+MEDIA_CACHE_CONTROL = os.environ.get("MEDIA_CACHE_CONTROL", "public, max-age=31536000, immutable")
 MEDIA_FULL_URL = SITE_URL.rstrip("/") + "/" + MEDIA_URL.rstrip("/") + "/"
 
+# Layout of uploaded media: 'hash' spreads files over hashed subdirectories,
+# 'date' over YYYY/MM/DD subdirectories and 'flat' keeps one directory per model.
+# Run `manage.py shard_media` after changing it to move the existing files.
+MEDIA_UPLOAD_SHARDING = os.environ.get("MEDIA_UPLOAD_SHARDING", "hash")
+MEDIA_UPLOAD_SHARD_DEPTH = int(os.environ.get("MEDIA_UPLOAD_SHARD_DEPTH", 2))
+
+# Uploaded images are staged outside MEDIA_ROOT, then normalized (orientation,
+# metadata, IMAGE_MAX_DIMENSION) by a pool of IMAGE_PROCESSING_WORKERS threads.
+# With 0 workers the images are processed inline once the request is committed.
+UPLOAD_STAGING_DIR = os.path.join(BASE_DIR, os.environ.get('UPLOAD_STAGING_DIR', 'upload_staging'))
+IMAGE_PROCESSING_WORKERS = int(os.environ.get("IMAGE_PROCESSING_WORKERS", 2))
+IMAGE_MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", 2560))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 85))
+SELL_REQUEST_MAX_IMAGES = int(os.environ.get("SELL_REQUEST_MAX_IMAGES", 20))
+SELL_REQUEST_MAX_IMAGE_MB = int(os.environ.get("SELL_REQUEST_MAX_IMAGE_MB", 20))
+SELL_REQUEST_MAX_TOTAL_MB = int(os.environ.get("SELL_REQUEST_MAX_TOTAL_MB", 200))
+# Size cap of each photo sent through the bulk image manager of the boat admin
+BOAT_IMAGE_MAX_MB = int(os.environ.get("BOAT_IMAGE_MAX_MB", 30))
+
+# Boat views and list impressions are counted in memory and added to the daily
+# rollup every VIEW_COUNTER_FLUSH_INTERVAL seconds by each worker process (0
+# disables the counting). Unpaginated lists count an impression for their first
+# VIEW_COUNTER_LIST_IMPRESSIONS boats only, the cards shown before scrolling.
+# ?ordering=popular weighs each day of the last POPULARITY_WINDOW_DAYS half as
+# much every POPULARITY_HALF_LIFE_DAYS.
+VIEW_COUNTER_FLUSH_INTERVAL = int(os.environ.get("VIEW_COUNTER_FLUSH_INTERVAL", 30))
+VIEW_COUNTER_LIST_IMPRESSIONS = int(os.environ.get("VIEW_COUNTER_LIST_IMPRESSIONS", 10))
+POPULARITY_WINDOW_DAYS = int(os.environ.get("POPULARITY_WINDOW_DAYS", 30))
+POPULARITY_HALF_LIFE_DAYS = float(os.environ.get("POPULARITY_HALF_LIFE_DAYS", 7))
+POPULARITY_IMPRESSION_WEIGHT = float(os.environ.get("POPULARITY_IMPRESSION_WEIGHT", 0.1))
+
+# Per-request SQL, serialization and render timings, sent as Server-Timing headers
+# to staff users and to a REQUEST_TIMING_SAMPLE_RATE share of the requests, and
+# logged as JSON by api_app.middleware. Requests running more than
+# REQUEST_TIMING_QUERY_WARNING queries are logged as warnings (N+1 queries).
+REQUEST_TIMING_ENABLED = os.environ.get("REQUEST_TIMING_ENABLED", "False") == "True"
+REQUEST_TIMING_SAMPLE_RATE = float(os.environ.get("REQUEST_TIMING_SAMPLE_RATE", 0))
+REQUEST_TIMING_QUERY_WARNING = int(os.environ.get("REQUEST_TIMING_QUERY_WARNING", 50))
+
+# Prometheus metrics served at /metrics to METRICS_TOKEN bearers and staff users.
+# Under several processes (gunicorn workers, the send_queued_emails worker), set
+# METRICS_MULTIPROC_DIR to a directory shared by them and emptied when the service
+# starts: each process writes its values there every METRICS_FLUSH_INTERVAL
+# seconds and the scraped worker sums them.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "False") == "True"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_MULTIPROC_DIR = os.environ.get("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL = int(os.environ.get("METRICS_FLUSH_INTERVAL", 10))
+
+# Boat changes are logged in CatalogEvent (last CATALOG_EVENTS_LOG_SIZE kept) and
+# streamed at /events/catalog/ as Server-Sent Events. Each process polls the log
+# every CATALOG_EVENTS_POLL_INTERVAL seconds for all its clients, idle streams get a
+# comment every CATALOG_EVENTS_KEEPALIVE seconds and a client missing more than
+# CATALOG_EVENTS_QUEUE_SIZE events is disconnected to resume with Last-Event-ID.
+# Under WSGI the endpoint answers at once and clients poll every CATALOG_EVENTS_RETRY_MS.
+CATALOG_EVENTS_LOG_SIZE = int(os.environ.get("CATALOG_EVENTS_LOG_SIZE", 1000))
+CATALOG_EVENTS_POLL_INTERVAL = float(os.environ.get("CATALOG_EVENTS_POLL_INTERVAL", 1))
+CATALOG_EVENTS_KEEPALIVE = int(os.environ.get("CATALOG_EVENTS_KEEPALIVE", 15))
+CATALOG_EVENTS_QUEUE_SIZE = int(os.environ.get("CATALOG_EVENTS_QUEUE_SIZE", 100))
+CATALOG_EVENTS_RETRY_MS = int(os.environ.get("CATALOG_EVENTS_RETRY_MS", 5000))
+
+# The public catalog payloads (/boats/, each /boats/<id>/, /featured-boats/,
+# /categories/, /testimonials/, /blog/) are published as <path>/index.json and a
+# gzip copy under SNAPSHOT_DIR (disabled when empty), SNAPSHOT_DEBOUNCE_SECONDS
+# after the last change and SNAPSHOT_MAX_DELAY seconds after the first at most
+# (0 publishes them in the request, right after the commit). nginx serves them when there is no query
+# string (filters are left to Django) with
+#   location ~ ^/(boats|featured-boats|categories|testimonials|blog)/ {
+#       error_page 418 = @django;
+#       if ($args) { return 418; }
+#       gzip_static on;
+#       try_files /snapshots$uri/index.json @django;
+#   }
+# and `manage.py publish_snapshots` rewrites all of them after a deploy.
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "")
+SNAPSHOT_DEBOUNCE_SECONDS = float(os.environ.get("SNAPSHOT_DEBOUNCE_SECONDS", 2))
+SNAPSHOT_MAX_DELAY = float(os.environ.get("SNAPSHOT_MAX_DELAY", 30))
+
+# /seo/boats/<id>/ returns the built frontend index.html with the meta tags of the
+# boat, nginx can route the boat pages of FRONTEND_URL to it for the crawlers and link
+# previews that do not run the SPA. Pages are cached until the boat or the file changes,
+# SEO_PAGE_CACHE_TIMEOUT seconds at most. Changes of the photos and equipment reach the
+# other worker processes through a shared CACHE_BACKEND only.
+FRONTEND_INDEX_PATH = os.environ.get(
+    "FRONTEND_INDEX_PATH", os.path.join(BASE_DIR.parent, "boattrade-frontend", "dist", "index.html")
+)
+FRONTEND_URL = os.environ.get("FRONTEND_URL", "https://www.boattradeconsulting.fr")
+SEO_PAGE_CACHE_TIMEOUT = int(os.environ.get("SEO_PAGE_CACHE_TIMEOUT", 7 * 24 * 3600))
+
+# The sitemaps (with the boat photos as image:image entries) are cached for
+# SITEMAP_CACHE_TIMEOUT seconds
+SITEMAP_CACHE_TIMEOUT = int(os.environ.get("SITEMAP_CACHE_TIMEOUT", 3600))
+
+# With CDN_CACHE_ENABLED the public reads get the Cache-Control policy of their
+# endpoint (see api_app.cdn.ENDPOINTS) and Surrogate-Key / Cache-Tag headers naming
+# the boats, categories, testimonials and posts they show, at most
+# CDN_MAX_SURROGATE_KEYS. Requests with credentials are marked private.
+CDN_CACHE_ENABLED = os.environ.get("CDN_CACHE_ENABLED", "False") == "True"
+CDN_CACHE_POLICIES = {
+    # Purged on change, the browsers keep it for a minute
+    "catalog": {
+        "max_age": int(os.environ.get("CDN_CATALOG_MAX_AGE", 60)),
+        "s_maxage": int(os.environ.get("CDN_CATALOG_S_MAXAGE", 3600)),
+        "stale_while_revalidate": int(os.environ.get("CDN_CATALOG_STALE_WHILE_REVALIDATE", 600)),
+    },
+    # Categories, testimonials and blog posts rarely change
+    "content": {
+        "max_age": int(os.environ.get("CDN_CONTENT_MAX_AGE", 300)),
+        "s_maxage": int(os.environ.get("CDN_CONTENT_S_MAXAGE", 86400)),
+        "stale_while_revalidate": int(os.environ.get("CDN_CONTENT_STALE_WHILE_REVALIDATE", 86400)),
+    },
+    "sitemap": {
+        "max_age": SITEMAP_CACHE_TIMEOUT,
+        "s_maxage": SITEMAP_CACHE_TIMEOUT,
+        "stale_while_revalidate": 86400,
+    },
+}
+CDN_MAX_SURROGATE_KEYS = int(os.environ.get("CDN_MAX_SURROGATE_KEYS", 500))
+# Changed objects are purged from the CDN by CDN_PURGE_BACKEND (none when empty):
+# api_app.cdn.FastlyPurgeBackend or CloudflarePurgeBackend (service or zone id in
+# CDN_PURGE_SERVICE_ID) or HttpPurgeBackend posting the keys to CDN_PURGE_URL, all
+# with the CDN_PURGE_TOKEN API token. Each process sends the keys changed in the
+# last CDN_PURGE_INTERVAL seconds together (0 sends them at each commit).
+CDN_PURGE_BACKEND = os.environ.get("CDN_PURGE_BACKEND", "")
+CDN_PURGE_URL = os.environ.get("CDN_PURGE_URL", "")
+CDN_PURGE_SERVICE_ID = os.environ.get("CDN_PURGE_SERVICE_ID", "")
+CDN_PURGE_TOKEN = os.environ.get("CDN_PURGE_TOKEN", "")
+CDN_PURGE_INTERVAL = float(os.environ.get("CDN_PURGE_INTERVAL", 1))
+CDN_PURGE_TIMEOUT = int(os.environ.get("CDN_PURGE_TIMEOUT", 10))
+
+# Cache backends of api_app.caches count their hits and misses for /metrics
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "api_app.caches.LocMemCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+        "METRICS_NAME": "default",
+    }
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
@@ -200,5 +412,13 @@ EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', 'password')
 DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", 'BoatTrade<messagerie-automatique@boattradeconsulting.fr>')
 ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL", 'jeremy.guerin34@yahoo.com')
 
+# Notification emails are written to the OutboundEmail outbox during the request
+# and delivered by `manage.py send_queued_emails` (cron or `--loop` worker).
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get("EMAIL_OUTBOX_BATCH_SIZE", 50))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("EMAIL_OUTBOX_MAX_ATTEMPTS", 8))
+EMAIL_OUTBOX_RETRY_DELAY = int(os.environ.get("EMAIL_OUTBOX_RETRY_DELAY", 60))  # seconds, doubled on each failure
+# Seconds a worker holds the emails it claimed, they are sent again by another worker after a crash
+EMAIL_OUTBOX_CLAIM_TIMEOUT = int(os.environ.get("EMAIL_OUTBOX_CLAIM_TIMEOUT", 300))
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = os.environ.get("CORS_ALLOW_ALL_ORIGINS", "False") == "True"
\ No newline at end of file